@@ -1,7 +1,101 @@
+"""
+Audit Module
+Audit log entries, written off the request path.
+
+log_audit() only appends the entry to an in-memory buffer; a background
+writer flushes it with insert_many(ordered=False) once AUDIT_BATCH_SIZE
+entries are waiting or every AUDIT_FLUSH_SECONDS, whichever comes first.
+
+- the buffer holds at most AUDIT_BUFFER_SIZE entries; when it is full,
+  AUDIT_OVERFLOW_POLICY decides: 'drop' (default) discards the new entry
+  and counts it, 'block' makes the caller wait for room
+- a batch that fails to write (database unreachable, primary step-down)
+  is retried AUDIT_WRITE_RETRIES times with exponential backoff from
+  AUDIT_RETRY_SECONDS, then put back in the buffer for the next flush;
+  only entries that no longer fit in a full buffer are lost (counted as
+  failed)
+- the writer is flushed on shutdown
+- AUDIT_WRITE_MODE=sync writes each entry inline (tests, scripts); the same
+  happens whenever the writer has not been started
+
+get_audit_writer_stats() reports queue depth, drops, failures and flush
+latency. Entries that must commit with another write go through the outbox
+instead (audit_event()). Storage, retention and the daily stats buckets are
+in app/audit_storage.py.
+"""
+
 import asyncio
+import os
+import time
 from datetime import datetime
-import traceback
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from .db import get_db
+from .outbox import register_outbox_handler
+from .audit_storage import AUDIT_COLLECTION, entry_time, record_audit_stats
+
+AUDIT_TOPIC = 'audit'
+
+WRITE_MODE = os.getenv('AUDIT_WRITE_MODE', 'buffered').lower()
+BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', '10000'))
+BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '1'))
+OVERFLOW_POLICY = os.getenv('AUDIT_OVERFLOW_POLICY', 'drop').lower()
+WRITE_RETRIES = int(os.getenv('AUDIT_WRITE_RETRIES', '3'))
+RETRY_SECONDS = float(os.getenv('AUDIT_RETRY_SECONDS', '0.5'))
+
+_writer = {'queue': None, 'task': None, 'wakeup': None, 'running': False}
+_writer_stats = {
+    'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'blocked': 0,
+    'retries': 0, 'requeued': 0,
+    'flushes': 0, 'flushSecondsTotal': 0.0, 'flushSecondsMax': 0.0,
+    'lastFlushAt': None, 'lastError': None,
+}
+
+
+def audit_entry(
+    action: str,
+    resource: str = None,
+    resourceId: str = None,
+    userId: str = None,
+    userName: str = None,
+    details: dict = None,
+    ip: str = None,
+    device: str = None,
+    status: str = 'success'
+) -> dict:
+    """Audit log document (same arguments as log_audit)"""
+    return {
+        'action': action,
+        'resource': resource,
+        'resourceId': resourceId,
+        'userId': userId,
+        'userName': userName,
+        'details': details,
+        'ip': ip,
+        'device': device,
+        'status': status,
+        'createdAt': datetime.utcnow()
+    }
+
+
+def audit_event(*args, **kwargs) -> tuple:
+    """Outbox event that writes an audit entry: enqueue_many([audit_event(...), ...])"""
+    return AUDIT_TOPIC, audit_entry(*args, **kwargs)
+
+
+async def _deliver_audit(payload: dict, event_id: str):
+    # The event id doubles as the entry id, so redelivery is a no-op
+    # (events queued before createdAt became a datetime carry a string)
+    doc = {**payload, '_id': ObjectId(event_id), 'createdAt': entry_time(payload)}
+    try:
+        await get_db().get_collection(AUDIT_COLLECTION).insert_one(doc)
+    except DuplicateKeyError:
+        return
+    await record_audit_stats([doc])
+
+
+register_outbox_handler(AUDIT_TOPIC, _deliver_audit)
 
 
 async def log_audit(
@@ -29,23 +123,195 @@ async def log_audit(
         device: The device/browser info
         status: The status of the action ('success', 'failed', 'warning')
     """
+    doc = audit_entry(action, resource, resourceId, userId, userName, details, ip, device, status)
+    queue = _writer['queue']
+    if queue is None:
+        await _write_now(doc)
+        return
+
+    try:
+        queue.put_nowait(doc)
+    except asyncio.QueueFull:
+        if OVERFLOW_POLICY != 'block':
+            _writer_stats['dropped'] += 1
+            return
+        _writer_stats['blocked'] += 1
+        _writer['wakeup'].set()
+        await queue.put(doc)
+    _writer_stats['enqueued'] += 1
+    if queue.qsize() >= BATCH_SIZE:
+        _writer['wakeup'].set()
+
+
+async def _write_now(doc: dict):
+    """Unbuffered write; never fails the main operation"""
+    try:
+        await get_db().get_collection(AUDIT_COLLECTION).insert_one(doc)
+        _writer_stats['written'] += 1
+        await record_audit_stats([doc])
+    except Exception as e:
+        _writer_stats['failed'] += 1
+        _writer_stats['lastError'] = str(e)
+        print(f"[Audit] Audit logging failed: {e}")
+
+
+# ============ BUFFERED WRITER ============
+
+def _take_batch(queue: asyncio.Queue, limit: int) -> list:
+    batch = []
+    while len(batch) < min(BATCH_SIZE, limit):
+        try:
+            batch.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
+
+
+async def _insert_batch(batch: list) -> list:
+    """
+    insert_many() the batch, retrying connection-level failures with backoff.
+    Returns the entries now stored; raises once the retries are used up.
+    """
+    coll = get_db().get_collection(AUDIT_COLLECTION)
+    attempt = 0
+    while True:
+        try:
+            await coll.insert_many(batch, ordered=False)
+            return batch
+        except BulkWriteError as e:
+            # Duplicate ids were stored by an earlier attempt that failed late
+            errors = e.details.get('writeErrors', [])
+            rejected = {error['index'] for error in errors if error.get('code') != 11000}
+            if rejected:
+                _writer_stats['lastError'] = str(e)
+                print(f"[Audit] {len(rejected)} of {len(batch)} audit entries failed to write")
+            return [doc for i, doc in enumerate(batch) if i not in rejected]
+        except Exception as e:
+            _writer_stats['lastError'] = str(e)
+            if attempt >= WRITE_RETRIES:
+                raise
+            _writer_stats['retries'] += 1
+            await asyncio.sleep(RETRY_SECONDS * 2 ** attempt)
+            attempt += 1
+
+
+def _requeue(batch: list):
+    """Put an unwritten batch back for the next flush, as far as the buffer has room"""
+    queue = _writer['queue']
+    lost = 0
+    for doc in batch:
+        try:
+            queue.put_nowait(doc)
+            _writer_stats['requeued'] += 1
+        except (asyncio.QueueFull, AttributeError):
+            lost += 1
+    _writer_stats['failed'] += lost
+    if lost:
+        print(f"[Audit] Buffer full, {lost} unwritten audit entries lost")
+
+
+async def _write_batch(batch: list):
+    started = time.perf_counter()
     try:
-        db = get_db()
-        coll = db.get_collection('audit_logs')
-        doc = {
-            'action': action,
-            'resource': resource,
-            'resourceId': resourceId,
-            'userId': userId,
-            'userName': userName,
-            'details': details,
-            'ip': ip,
-            'device': device,
-            'status': status,
-            'createdAt': datetime.utcnow().isoformat()
-        }
-        await coll.insert_one(doc)
+        inserted = await _insert_batch(batch)
+        _writer_stats['failed'] += len(batch) - len(inserted)
     except Exception as e:
-        # Log to console but don't crash the main operation
-        print(f"Audit logging failed: {e}")
-        traceback.print_exc()
+        inserted = []
+        print(f"[Audit] Could not write {len(batch)} audit entries, keeping them for the next flush: {e}")
+        _requeue(batch)
+    elapsed = time.perf_counter() - started
+    if inserted:
+        await record_audit_stats(inserted)
+    _writer_stats['written'] += len(inserted)
+    _writer_stats['flushes'] += 1
+    _writer_stats['flushSecondsTotal'] += elapsed
+    _writer_stats['flushSecondsMax'] = max(_writer_stats['flushSecondsMax'], elapsed)
+    _writer_stats['lastFlushAt'] = datetime.utcnow().isoformat()
+
+
+async def flush_audit() -> int:
+    """
+    Write everything buffered so far; returns how many entries were taken.
+    Entries put back by a failed write wait for the next flush.
+    """
+    queue = _writer['queue']
+    if queue is None:
+        return 0
+    pending = queue.qsize()
+    flushed = 0
+    while flushed < pending:
+        batch = _take_batch(queue, pending - flushed)
+        if not batch:
+            break
+        await _write_batch(batch)
+        flushed += len(batch)
+    return flushed
+
+
+async def _writer_loop():
+    wakeup = _writer['wakeup']
+    while _writer['running']:
+        try:
+            await asyncio.wait_for(wakeup.wait(), FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        try:
+            await flush_audit()
+        except Exception as e:
+            print(f"[Audit] Flush failed: {e}")
+
+
+def start_audit_writer():
+    """Start buffering audit entries (no-op in sync mode)"""
+    if WRITE_MODE == 'sync' or _writer['task'] is not None:
+        return
+    _writer['queue'] = asyncio.Queue(maxsize=BUFFER_SIZE)
+    _writer['wakeup'] = asyncio.Event()
+    _writer['running'] = True
+    _writer['task'] = asyncio.create_task(_writer_loop())
+    print(f"[Audit] Buffered writer started (batch {BATCH_SIZE}, every {FLUSH_SECONDS}s, on overflow: {OVERFLOW_POLICY})")
+
+
+async def stop_audit_writer():
+    """Stop the writer and flush what is left; later entries are written inline"""
+    task = _writer['task']
+    if task is None:
+        return
+    _writer['task'] = None
+    # Let the loop finish its current batch rather than cancelling mid-insert
+    _writer['running'] = False
+    _writer['wakeup'].set()
+    await asyncio.gather(task, return_exceptions=True)
+    await flush_audit()
+    left = _writer['queue'].qsize()
+    if left:
+        _writer_stats['failed'] += left
+        print(f"[Audit] {left} audit entries could not be written before shutdown")
+    _writer['queue'] = None
+    _writer['wakeup'] = None
+
+
+def get_audit_writer_stats() -> dict:
+    queue = _writer['queue']
+    flushes = _writer_stats['flushes']
+    return {
+        'mode': 'buffered' if _writer['task'] is not None else 'sync',
+        'overflowPolicy': OVERFLOW_POLICY,
+        'queueDepth': queue.qsize() if queue is not None else 0,
+        'queueCapacity': BUFFER_SIZE,
+        'batchSize': BATCH_SIZE,
+        'flushIntervalSeconds': FLUSH_SECONDS,
+        'enqueued': _writer_stats['enqueued'],
+        'written': _writer_stats['written'],
+        'dropped': _writer_stats['dropped'],
+        'failed': _writer_stats['failed'],
+        'blocked': _writer_stats['blocked'],
+        'retries': _writer_stats['retries'],
+        'requeued': _writer_stats['requeued'],
+        'flushes': flushes,
+        'avgFlushSeconds': round(_writer_stats['flushSecondsTotal'] / flushes, 4) if flushes else None,
+        'maxFlushSeconds': round(_writer_stats['flushSecondsMax'], 4),
+        'lastFlushAt': _writer_stats['lastFlushAt'],
+        'lastError': _writer_stats['lastError'],
+    }
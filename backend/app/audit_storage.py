@@ -0,0 +1,290 @@
+"""
+Audit Storage Module
+How audit entries are stored, retained and summarised.
+
+- createdAt is a BSON datetime. Entries written before that held ISO
+  strings; migrate_legacy_audit_dates() converts them in chunks and runs in
+  the background on startup while any are left
+- retention: a TTL index on createdAt expires entries after the
+  `auditRetentionDays` system setting (AUDIT_RETENTION_DAYS by default);
+  changing the setting updates the index in place with collMod
+- AUDIT_TIMESERIES=on creates audit_logs as a time-series collection when it
+  does not exist yet (an existing collection is never converted). Time-series
+  collections have no unique _id index, so an outbox redelivery can store an
+  entry twice there
+- daily buckets in `audit_stats_daily` hold per-day counts by action,
+  resource, user and status. Writers add to them as entries are inserted
+  (record_audit_stats) and /api/audit/stats sums the buckets inside the
+  retention window instead of grouping the whole collection
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from .db import get_db
+from .rollups import parse_datetime
+
+AUDIT_COLLECTION = 'audit_logs'
+STATS_COLLECTION = 'audit_stats_daily'
+
+DEFAULT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '90'))
+TIMESERIES = os.getenv('AUDIT_TIMESERIES', 'off').lower() in ('on', 'true', '1')
+MIGRATION_CHUNK = int(os.getenv('AUDIT_MIGRATION_CHUNK', '1000'))
+
+TTL_INDEX = 'createdAt_ttl'
+STATS_TTL_INDEX = 'date_ttl'
+
+# bucket field -> audit entry field
+BREAKDOWNS = {
+    'byAction': 'action',
+    'byResource': 'resource',
+    'byUser': 'userName',
+    'byStatus': 'status',
+}
+
+_state = {'migration': None}
+
+
+def _encode_key(value) -> str:
+    """Bucket sub-document key for a value ('.' and '$' are not allowed in keys)"""
+    return str(value).replace('.', '．').replace('$', '＄')
+
+
+def _decode_key(key: str) -> str:
+    return key.replace('．', '.').replace('＄', '$')
+
+
+def _day_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, value.day)
+
+
+def entry_time(doc: dict) -> datetime:
+    """createdAt of an entry as a datetime, whatever it was stored as"""
+    created = parse_datetime(doc.get('createdAt'))
+    if created is None and isinstance(doc.get('_id'), ObjectId):
+        created = doc['_id'].generation_time.replace(tzinfo=None)
+    return created or datetime.utcnow()
+
+
+# ============ DAILY STATS ============
+
+def _stats_increments(docs: list) -> dict:
+    """{day start: {field: increment}} for a batch of entries"""
+    days = {}
+    for doc in docs:
+        day = _day_start(entry_time(doc))
+        inc = days.setdefault(day, {})
+        inc['total'] = inc.get('total', 0) + 1
+        for bucket, field in BREAKDOWNS.items():
+            if doc.get(field):
+                key = f"{bucket}.{_encode_key(doc[field])}"
+                inc[key] = inc.get(key, 0) + 1
+    return days
+
+
+async def record_audit_stats(docs: list):
+    """Add inserted entries to their daily buckets; never raises"""
+    if not docs:
+        return
+    ops = [
+        UpdateOne(
+            {'_id': day.strftime('%Y-%m-%d')},
+            {'$inc': inc, '$setOnInsert': {'date': day}},
+            upsert=True
+        )
+        for day, inc in _stats_increments(docs).items()
+    ]
+    try:
+        await get_db().get_collection(STATS_COLLECTION).bulk_write(ops, ordered=False)
+    except Exception as e:
+        # rebuild_audit_stats() fixes it
+        print(f"[Audit] Could not update daily audit stats: {e}")
+
+
+async def rebuild_audit_stats(since: datetime = None, until: datetime = None) -> int:
+    """
+    Recompute the daily buckets of [since, until) from the entries themselves
+    (whole days; everything when both are None). Returns the buckets written.
+    """
+    db = get_db()
+    logs = db.get_collection(AUDIT_COLLECTION)
+    stats = db.get_collection(STATS_COLLECTION)
+
+    since = _day_start(since) if since else None
+    until = _day_start(until) if until else None
+    created = {}
+    if since:
+        created['$gte'] = since
+    if until:
+        created['$lt'] = until
+    date_range = {'date': created} if created else {}
+
+    day = {'$dateToString': {'format': '%Y-%m-%d', 'date': '$createdAt'}}
+    facets = {'total': [{'$group': {'_id': {'day': day}, 'count': {'$sum': 1}}}]}
+    for bucket, field in BREAKDOWNS.items():
+        facets[bucket] = [
+            {'$match': {field: {'$nin': [None, '']}}},
+            {'$group': {'_id': {'day': day, 'value': f"${field}"}, 'count': {'$sum': 1}}},
+        ]
+    pipeline = [{'$match': {'createdAt': {'$type': 'date', **created}}}, {'$facet': facets}]
+    result = (await logs.aggregate(pipeline).to_list(1))[0]
+
+    buckets = {}
+    for row in result['total']:
+        key = row['_id']['day']
+        buckets[key] = {'_id': key, 'date': datetime.strptime(key, '%Y-%m-%d'), 'total': row['count']}
+    for bucket in BREAKDOWNS:
+        for row in result[bucket]:
+            doc = buckets.get(row['_id']['day'])
+            if doc is not None:
+                doc.setdefault(bucket, {})[_encode_key(row['_id']['value'])] = row['count']
+
+    await stats.delete_many(date_range)
+    if buckets:
+        await stats.insert_many(list(buckets.values()))
+    return len(buckets)
+
+
+async def get_retention_days() -> int:
+    config = await get_db().get_collection('system_config').find_one(
+        {'_id': 'main_config'}, {'auditRetentionDays': 1}
+    )
+    return int((config or {}).get('auditRetentionDays') or DEFAULT_RETENTION_DAYS)
+
+
+def _merge_top(buckets: list, name: str, top: int) -> dict:
+    totals = {}
+    for doc in buckets:
+        for key, count in (doc.get(name) or {}).items():
+            value = _decode_key(key)
+            totals[value] = totals.get(value, 0) + count
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return dict(ranked[:top] if top else ranked)
+
+
+async def get_audit_summary(top: int = 10) -> dict:
+    """Totals for the retention window and for today, read from the daily buckets"""
+    retention_days = await get_retention_days()
+    today = _day_start(datetime.utcnow())
+    buckets = await get_db().get_collection(STATS_COLLECTION).find(
+        {'date': {'$gte': today - timedelta(days=retention_days)}}
+    ).to_list(None)
+    today_bucket = next((doc for doc in buckets if doc['date'] == today), {})
+    return {
+        'total': sum(doc.get('total', 0) for doc in buckets),
+        'today': today_bucket.get('total', 0),
+        'byAction': _merge_top(buckets, 'byAction', top),
+        'byResource': _merge_top(buckets, 'byResource', top),
+        'byUser': _merge_top(buckets, 'byUser', top),
+        'byStatus': _merge_top(buckets, 'byStatus', 0),
+        'retentionDays': retention_days,
+    }
+
+
+# ============ RETENTION ============
+
+async def _is_timeseries(db) -> bool:
+    try:
+        async for info in await db.list_collections(filter={'name': AUDIT_COLLECTION}):
+            return info.get('type') == 'timeseries'
+    except Exception:
+        pass
+    return False
+
+
+async def _ensure_ttl(db, collection: str, field: str, name: str, seconds: int):
+    """Create the TTL index, or change its expiry in place if it exists"""
+    coll = db.get_collection(collection)
+    existing = (await coll.index_information()).get(name)
+    if existing is None:
+        await coll.create_index([(field, 1)], name=name, expireAfterSeconds=seconds)
+    elif existing.get('expireAfterSeconds') != seconds:
+        await db.command({'collMod': collection, 'index': {'name': name, 'expireAfterSeconds': seconds}})
+
+
+async def apply_audit_retention(days: int = None) -> dict:
+    """Expire audit entries (and their daily buckets) after `days`"""
+    db = get_db()
+    days = days or await get_retention_days()
+    seconds = days * 86400
+    if await _is_timeseries(db):
+        await db.command({'collMod': AUDIT_COLLECTION, 'expireAfterSeconds': seconds})
+    else:
+        await _ensure_ttl(db, AUDIT_COLLECTION, 'createdAt', TTL_INDEX, seconds)
+    # Keep a bucket one day longer than the last entry it counts
+    await _ensure_ttl(db, STATS_COLLECTION, 'date', STATS_TTL_INDEX, seconds + 86400)
+    return {'retentionDays': days, 'expireAfterSeconds': seconds}
+
+
+# ============ MIGRATION ============
+
+async def migrate_legacy_audit_dates(chunk_size: int = MIGRATION_CHUNK) -> int:
+    """
+    Convert string createdAt values to datetimes, chunk_size entries per
+    round trip. Entries whose string does not parse take their _id time.
+    Returns how many entries were converted.
+    """
+    coll = get_db().get_collection(AUDIT_COLLECTION)
+    migrated = 0
+    while True:
+        docs = await coll.find(
+            {'createdAt': {'$type': 'string'}}, {'createdAt': 1}
+        ).limit(chunk_size).to_list(chunk_size)
+        if not docs:
+            break
+        ops = [
+            UpdateOne(
+                {'_id': doc['_id'], 'createdAt': doc['createdAt']},
+                {'$set': {'createdAt': entry_time(doc)}}
+            )
+            for doc in docs
+        ]
+        result = await coll.bulk_write(ops, ordered=False)
+        migrated += result.modified_count
+        if result.modified_count == 0:
+            # Nothing converted: stop rather than spin on the same documents
+            break
+        # Give request handlers a turn between chunks
+        await asyncio.sleep(0)
+    return migrated
+
+
+async def _migrate_and_rebuild():
+    try:
+        migrated = await migrate_legacy_audit_dates()
+        buckets = await rebuild_audit_stats()
+        print(f"[Audit] Migrated {migrated} legacy audit entries, rebuilt {buckets} daily stats buckets")
+    except Exception as e:
+        print(f"[Audit] Audit storage migration failed: {e}")
+
+
+async def prepare_audit_storage():
+    """
+    Startup: create the time-series collection if configured, apply the
+    retention TTL, and migrate legacy entries in the background.
+    """
+    db = get_db()
+    names = await db.list_collection_names()
+    if TIMESERIES and AUDIT_COLLECTION not in names:
+        await db.create_collection(
+            AUDIT_COLLECTION,
+            timeseries={'timeField': 'createdAt', 'granularity': 'seconds'},
+            expireAfterSeconds=(await get_retention_days()) * 86400
+        )
+        print("[Audit] Created audit_logs as a time-series collection")
+
+    try:
+        await apply_audit_retention()
+    except Exception as e:
+        print(f"[Audit] Could not apply audit retention: {e}")
+
+    logs = db.get_collection(AUDIT_COLLECTION)
+    legacy = await logs.find_one({'createdAt': {'$type': 'string'}}, {'_id': 1})
+    unsummarised = (
+        STATS_COLLECTION not in names
+        and await logs.find_one({}, {'_id': 1}) is not None
+    )
+    if legacy or unsummarised:
+        _state['migration'] = asyncio.create_task(_migrate_and_rebuild())
@@ -0,0 +1,387 @@
+"""
+Backup Engine Module
+Streams collections into gzip-compressed NDJSON chunks instead of loading
+them into one `backupData` field.
+
+- Each collection is read from a cursor in batches and written as chunks of
+  at most BACKUP_CHUNK_BYTES (uncompressed), so memory stays bounded by the
+  chunk size whatever the data size.
+- Documents are encoded as MongoDB Extended JSON (relaxed), so ObjectIds and
+  dates survive a restore with their types.
+- Chunks are stored in GridFS (default) or under BACKUP_DIR
+  (BACKUP_STORAGE=local).
+- The `backups` document only holds metadata plus a per-collection manifest:
+  document count, content checksum and the list of chunks with their own
+  sizes and checksums.
+
+Incremental backups (mode='incremental') chain onto the previous backup:
+they hold only the documents whose updatedAt/createdAt/created_at/timestamp
+is at or after the parent's watermark, plus the list of `_id`s that still
+exist so deletions can be replayed. Restoring one replays the chain from its
+full base. Writes that do not touch any of those fields are only picked up
+by the next full backup.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import os
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from bson import ObjectId, json_util
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from .db import get_db
+
+BACKUPS_COLLECTION = 'backups'
+BACKUP_FORMAT = 'ndjson.gz'
+GRIDFS_BUCKET = 'backup_chunks'
+
+STORAGE = os.getenv('BACKUP_STORAGE', 'gridfs')
+BACKUP_DIR = Path(os.getenv('BACKUP_DIR', Path(__file__).resolve().parent.parent / 'backups'))
+CHUNK_BYTES = int(os.getenv('BACKUP_CHUNK_BYTES', str(4 * 1024 * 1024)))
+CURSOR_BATCH_SIZE = int(os.getenv('BACKUP_CURSOR_BATCH_SIZE', '1000'))
+
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+BACKUP_MODES = ('full', 'incremental')
+WATERMARK_FIELDS = ['updatedAt', 'createdAt', 'created_at', 'timestamp']
+# Re-read a little before the parent's watermark to cover in-flight writes
+WATERMARK_OVERLAP_SECONDS = int(os.getenv('BACKUP_WATERMARK_OVERLAP_SECONDS', '300'))
+
+
+def format_size(size_bytes: int) -> str:
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    if size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.2f} KB"
+    return f"{size_bytes / (1024 * 1024):.2f} MB"
+
+
+# ============ CHUNK STORAGE ============
+
+class GridFSChunkStore:
+    name = 'gridfs'
+
+    def __init__(self, db):
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=GRIDFS_BUCKET)
+
+    async def write(self, filename: str, data: bytes, metadata: dict):
+        return await self.bucket.upload_from_stream(filename, data, metadata=metadata)
+
+    async def read(self, ref) -> bytes:
+        stream = await self.bucket.open_download_stream(ref)
+        return await stream.read()
+
+    async def delete(self, ref):
+        await self.bucket.delete(ref)
+
+
+class LocalChunkStore:
+    name = 'local'
+
+    def __init__(self, root: Path = BACKUP_DIR):
+        self.root = Path(root)
+
+    async def write(self, filename: str, data: bytes, metadata: dict):
+        path = self.root / filename
+        def _write():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+        await asyncio.to_thread(_write)
+        return filename
+
+    async def read(self, ref) -> bytes:
+        return await asyncio.to_thread((self.root / ref).read_bytes)
+
+    async def delete(self, ref):
+        await asyncio.to_thread((self.root / ref).unlink, True)
+
+
+def get_chunk_store(name: str = None):
+    db = get_db()
+    if (name or STORAGE) == 'local':
+        return LocalChunkStore()
+    return GridFSChunkStore(db)
+
+
+# ============ WRITING ============
+
+class _ChunkWriter:
+    """Compresses NDJSON lines and flushes a chunk every CHUNK_BYTES"""
+
+    def __init__(self, store, backup_id: str, collection: str, part: str = 'docs'):
+        self.store = store
+        self.backup_id = backup_id
+        self.collection = collection
+        self.part = part
+        self.chunks = []
+        self.count = 0
+        self.content_hash = hashlib.sha256()
+        self._reset()
+
+    def _reset(self):
+        self._compressor = zlib.compressobj(wbits=31)  # gzip container
+        self._parts = []
+        self._raw_bytes = 0
+        self._docs = 0
+
+    async def add(self, doc: dict):
+        line = (json_util.dumps(doc, json_options=JSON_OPTIONS) + '\n').encode('utf-8')
+        self.content_hash.update(line)
+        self._parts.append(self._compressor.compress(line))
+        self._raw_bytes += len(line)
+        self._docs += 1
+        self.count += 1
+        if self._raw_bytes >= CHUNK_BYTES:
+            await self.flush()
+
+    async def flush(self):
+        if not self._docs:
+            return
+        self._parts.append(self._compressor.flush())
+        data = b''.join(self._parts)
+        seq = len(self.chunks)
+        prefix = '' if self.part == 'docs' else f"{self.part}-"
+        filename = f"{self.backup_id}/{self.collection}/{prefix}{seq:05d}.{BACKUP_FORMAT}"
+        checksum = hashlib.sha256(data).hexdigest()
+        ref = await self.store.write(filename, data, {
+            'backupId': self.backup_id,
+            'collection': self.collection,
+            'part': self.part,
+            'seq': seq,
+        })
+        self.chunks.append({
+            'seq': seq,
+            'file': ref,
+            'documents': self._docs,
+            'bytes': self._raw_bytes,
+            'compressedBytes': len(data),
+            'sha256': checksum,
+        })
+        self._reset()
+
+    def manifest(self) -> dict:
+        return {
+            'count': self.count,
+            'sha256': self.content_hash.hexdigest(),
+            'bytes': sum(c['bytes'] for c in self.chunks),
+            'compressedBytes': sum(c['compressedBytes'] for c in self.chunks),
+            'chunks': self.chunks,
+        }
+
+
+async def _write_cursor(writer: _ChunkWriter, cursor) -> dict:
+    try:
+        async for doc in cursor:
+            await writer.add(doc)
+        await writer.flush()
+    except BaseException:
+        # Do not leave orphaned chunks behind for a collection that failed
+        await delete_backup_files({'manifest': {writer.collection: writer.manifest()}, 'storage': writer.store.name})
+        raise
+    return writer.manifest()
+
+
+async def backup_collection(store, backup_id: str, collection: str, query: dict = None) -> dict:
+    """Stream one collection (optionally filtered) into chunks and return its manifest"""
+    db = get_db()
+    writer = _ChunkWriter(store, backup_id, collection)
+    cursor = db.get_collection(collection).find(query or {}).sort('_id', 1).batch_size(CURSOR_BATCH_SIZE)
+    return await _write_cursor(writer, cursor)
+
+
+async def backup_collection_ids(store, backup_id: str, collection: str) -> dict:
+    """Stream the `_id` of every document (answered from the _id index)"""
+    db = get_db()
+    writer = _ChunkWriter(store, backup_id, collection, part='ids')
+    cursor = db.get_collection(collection).find({}, {'_id': 1}).sort('_id', 1).batch_size(CURSOR_BATCH_SIZE * 10)
+    return await _write_cursor(writer, cursor)
+
+
+def changed_since_query(since: datetime) -> dict:
+    """Documents created or updated at/after `since`, whether stored as dates or ISO strings"""
+    clauses = []
+    for field in WATERMARK_FIELDS:
+        clauses.append({field: {'$gte': since}})
+        clauses.append({field: {'$gte': since.isoformat()}})
+    return {'$or': clauses}
+
+
+async def delete_backup_files(backup: dict):
+    """Remove every chunk referenced by a backup's manifest"""
+    manifest = backup.get('manifest') or {}
+    if not manifest:
+        return
+    store = get_chunk_store(backup.get('storage'))
+    for entry in manifest.values():
+        for chunk in entry.get('chunks', []) + (entry.get('ids') or {}).get('chunks', []):
+            try:
+                await store.delete(chunk['file'])
+            except Exception as e:
+                print(f"[Backup] Could not delete chunk {chunk.get('file')}: {e}")
+
+
+async def create_streaming_backup(collection_names: list, name: str, backup_type: str = 'manual',
+                                  extra: dict = None, parent: dict = None) -> dict:
+    """
+    Back up the given collections and return the `backups` document.
+
+    With a `parent` backup this is an incremental backup of what changed
+    since the parent's watermark. The document is inserted first with status
+    'in_progress' and completed with the manifest at the end; on failure it
+    is marked 'failed' and the chunks written so far are removed.
+    """
+    db = get_db()
+    coll = db.get_collection(BACKUPS_COLLECTION)
+    store = get_chunk_store()
+
+    now = datetime.utcnow()
+    backup_doc = {
+        'name': name,
+        'type': backup_type,
+        'kind': 'incremental' if parent else 'full',
+        'collections': collection_names,
+        'date': now.strftime('%Y-%m-%d'),
+        'time': now.strftime('%H:%M:%S'),
+        'status': 'in_progress',
+        'format': BACKUP_FORMAT,
+        'storage': store.name,
+        # Anything written from here on is picked up by the next incremental
+        'watermark': now.isoformat(),
+        'createdAt': now.isoformat(),
+        **(extra or {}),
+    }
+    since = None
+    if parent:
+        since = backup_watermark(parent) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)
+        backup_doc.update({
+            'parentBackupId': str(parent['_id']),
+            'baseBackupId': parent.get('baseBackupId') or str(parent['_id']),
+            'since': since.isoformat(),
+        })
+    res = await coll.insert_one(backup_doc)
+    backup_id = str(res.inserted_id)
+
+    manifest = {}
+    errors = {}
+    try:
+        for coll_name in collection_names:
+            try:
+                if since is None:
+                    manifest[coll_name] = await backup_collection(store, backup_id, coll_name)
+                else:
+                    entry = await backup_collection(store, backup_id, coll_name, changed_since_query(since))
+                    manifest[coll_name] = entry
+                    entry['ids'] = await backup_collection_ids(store, backup_id, coll_name)
+            except Exception as e:
+                print(f"[Backup] Warning: Could not backup collection {coll_name}: {e}")
+                errors[coll_name] = str(e)
+    except BaseException as e:
+        await delete_backup_files({'manifest': manifest, 'storage': store.name})
+        await coll.update_one({'_id': res.inserted_id}, {'$set': {
+            'status': 'failed', 'error': str(e), 'manifest': {},
+        }})
+        raise
+
+    def stored(entry, field):
+        return entry[field] + (entry.get('ids') or {}).get(field, 0)
+
+    total_docs = sum(m['count'] for m in manifest.values())
+    compressed = sum(stored(m, 'compressedBytes') for m in manifest.values())
+    update = {
+        'status': 'completed',
+        'manifest': manifest,
+        'documentCounts': {c: m['count'] for c, m in manifest.items()},
+        'totalDocuments': total_docs,
+        'sizeBytes': compressed,
+        'size': format_size(compressed),
+        'uncompressedBytes': sum(stored(m, 'bytes') for m in manifest.values()),
+        'completedAt': datetime.utcnow().isoformat(),
+        'errors': errors or None,
+    }
+    await coll.update_one({'_id': res.inserted_id}, {'$set': update})
+    backup_doc.update(update)
+    backup_doc['_id'] = res.inserted_id
+    return backup_doc
+
+
+# ============ CHAINS ============
+
+def backup_watermark(backup: dict) -> datetime:
+    """Start time of a backup; chunked backups made before chains used createdAt"""
+    value = backup.get('watermark') or backup.get('createdAt')
+    return datetime.fromisoformat(str(value).replace('Z', ''))
+
+
+async def find_chain_parent(collection_names: list, full_interval_days: int = 7):
+    """
+    The backup a new incremental backup should chain onto, or None when a
+    full backup is due: no usable previous backup, a different collection
+    set, or a full base older than `full_interval_days`.
+    """
+    db = get_db()
+    coll = db.get_collection(BACKUPS_COLLECTION)
+    latest = await coll.find_one(
+        {'format': BACKUP_FORMAT, 'status': 'completed', 'errors': None},
+        {'manifest': 0},
+        sort=[('createdAt', -1)]
+    )
+    if not latest or not set(collection_names) <= set(latest.get('collections') or []):
+        return None
+
+    base = latest
+    if latest.get('kind') == 'incremental':
+        base = await coll.find_one({'_id': ObjectId(latest['baseBackupId'])}, {'manifest': 0})
+        if not base:
+            return None
+    if datetime.utcnow() - backup_watermark(base) > timedelta(days=full_interval_days):
+        return None
+    return latest
+
+
+async def load_backup_chain(backup: dict) -> list:
+    """[full base, incremental, ..., backup] in replay order"""
+    db = get_db()
+    coll = db.get_collection(BACKUPS_COLLECTION)
+    chain = [backup]
+    while chain[0].get('kind') == 'incremental':
+        parent_id = chain[0].get('parentBackupId')
+        parent = await coll.find_one({'_id': ObjectId(parent_id)}) if parent_id and ObjectId.is_valid(parent_id) else None
+        if not parent or parent.get('status') != 'completed':
+            raise ValueError(f"Backup chain is broken: parent backup {parent_id} is missing")
+        chain.insert(0, parent)
+    return chain
+
+
+async def count_dependent_backups(backup_id: str) -> int:
+    db = get_db()
+    return await db.get_collection(BACKUPS_COLLECTION).count_documents({'parentBackupId': str(backup_id)})
+
+
+# ============ READING ============
+
+def is_chunked_backup(backup: dict) -> bool:
+    return backup.get('format') == BACKUP_FORMAT
+
+
+async def read_chunk(store, chunk: dict, verify: bool = True) -> list:
+    """Download, verify and decode one chunk into documents"""
+    data = await store.read(chunk['file'])
+    if verify and hashlib.sha256(data).hexdigest() != chunk.get('sha256'):
+        raise ValueError(f"Checksum mismatch for backup chunk {chunk.get('file')}")
+    text = gzip.decompress(data).decode('utf-8')
+    return [json_util.loads(line, json_options=JSON_OPTIONS) for line in text.splitlines() if line]
+
+
+async def iter_backup_chunks(backup: dict, collection: str, verify: bool = True, part: str = 'docs'):
+    """
+    Yield the documents of one collection, one chunk (list) at a time.
+    part='ids' yields the `_id` list of an incremental backup instead.
+    """
+    store = get_chunk_store(backup.get('storage'))
+    entry = (backup.get('manifest') or {}).get(collection, {})
+    if part == 'ids':
+        entry = entry.get('ids') or {}
+    for chunk in entry.get('chunks', []):
+        yield await read_chunk(store, chunk, verify=verify)
@@ -0,0 +1,210 @@
+"""
+Catalog Cache Module
+In-process cache of menu items (by normalized name and by id) and recipes
+(by menuItemId), used to resolve order lines to recipes without querying
+`menu_items`/`recipes` on every order.
+
+Invalidation:
+- The menu and recipe routes call invalidate_catalog() after writing. This
+  clears the local cache and bumps a shared version document, so other
+  worker processes reload within CATALOG_CACHE_CHECK_SECONDS (0 compares
+  the version on every lookup).
+- With CATALOG_CHANGE_STREAM=true (replica set required), a change stream on
+  both collections also clears the cache for writes made outside the API.
+- Entries are never older than CATALOG_CACHE_MAX_AGE seconds.
+
+Cached documents are shared: treat them as read-only.
+"""
+
+import asyncio
+import os
+import time
+from .db import get_db
+
+VERSIONS_COLLECTION = 'cache_versions'
+CATALOG_VERSION_ID = 'catalog'
+WATCHED_COLLECTIONS = ['menu_items', 'recipes']
+
+CHECK_SECONDS = float(os.getenv('CATALOG_CACHE_CHECK_SECONDS', '5'))
+MAX_AGE_SECONDS = float(os.getenv('CATALOG_CACHE_MAX_AGE', '300'))
+
+_cache = {
+    'generation': 0,
+    'loaded': False,
+    'loadedAt': 0.0,
+    'checkedAt': 0.0,
+    'version': None,
+    'menuByName': {},
+    'menuById': {},
+    'recipesByMenuItem': {},
+}
+_stats = {'hits': 0, 'misses': 0, 'loads': 0, 'invalidations': 0, 'versionChecks': 0}
+_lock = asyncio.Lock()
+_watch_task = None
+
+
+def normalize_name(name) -> str:
+    """Case-insensitive exact-match key for a menu item name"""
+    return str(name or '').strip().lower()
+
+
+def _clear():
+    _cache['generation'] += 1
+    _cache['loaded'] = False
+    _cache['menuByName'] = {}
+    _cache['menuById'] = {}
+    _cache['recipesByMenuItem'] = {}
+
+
+async def _remote_version(db):
+    doc = await db.get_collection(VERSIONS_COLLECTION).find_one({'_id': CATALOG_VERSION_ID})
+    return doc.get('value') if doc else None
+
+
+async def _load(db):
+    while True:
+        generation = _cache['generation']
+        menu_by_name = {}
+        menu_by_id = {}
+        async for item in db.menu_items.find({}, {'name': 1, 'available': 1, 'category': 1, 'price': 1}):
+            item_id = str(item['_id'])
+            menu_by_id[item_id] = item
+            # First match wins, like the find_one() it replaces
+            menu_by_name.setdefault(normalize_name(item.get('name')), item)
+
+        recipes = {}
+        async for recipe in db.recipes.find({}):
+            if recipe.get('menuItemId'):
+                recipes.setdefault(str(recipe['menuItemId']), recipe)
+
+        # Invalidated while loading: the data may predate the write, read again
+        if generation == _cache['generation']:
+            break
+
+    _cache['menuByName'] = menu_by_name
+    _cache['menuById'] = menu_by_id
+    _cache['recipesByMenuItem'] = recipes
+    _cache['loaded'] = True
+    _cache['loadedAt'] = time.monotonic()
+    _stats['loads'] += 1
+
+
+async def _ensure_fresh():
+    """Load the cache if needed; counts the lookup as a hit or a miss"""
+    now = time.monotonic()
+    if _cache['loaded'] and now - _cache['loadedAt'] < MAX_AGE_SECONDS and (
+        now - _cache['checkedAt'] < CHECK_SECONDS
+    ):
+        _stats['hits'] += 1
+        return
+
+    async with _lock:
+        db = get_db()
+        now = time.monotonic()
+        if _cache['loaded'] and now - _cache['loadedAt'] < MAX_AGE_SECONDS:
+            if now - _cache['checkedAt'] < CHECK_SECONDS:
+                _stats['hits'] += 1
+                return
+            # Another worker may have written: compare the shared version
+            _stats['versionChecks'] += 1
+            version = await _remote_version(db)
+            _cache['checkedAt'] = now
+            if version == _cache['version']:
+                _stats['hits'] += 1
+                return
+            _cache['version'] = version
+        else:
+            _cache['version'] = await _remote_version(db)
+            _cache['checkedAt'] = now
+
+        _stats['misses'] += 1
+        await _load(db)
+
+
+# ============ LOOKUPS ============
+
+async def get_menu_item_by_name(name: str):
+    await _ensure_fresh()
+    return _cache['menuByName'].get(normalize_name(name))
+
+
+async def get_menu_item_by_id(menu_item_id: str):
+    await _ensure_fresh()
+    return _cache['menuById'].get(str(menu_item_id))
+
+
+async def get_recipe_for_menu_item(menu_item_id: str):
+    await _ensure_fresh()
+    return _cache['recipesByMenuItem'].get(str(menu_item_id))
+
+
+async def resolve_recipe(menu_item_id: str = None, name: str = None):
+    """Recipe for an order line: by menuItemId first, then by menu item name"""
+    await _ensure_fresh()
+    recipes = _cache['recipesByMenuItem']
+    if menu_item_id and str(menu_item_id) in recipes:
+        return recipes[str(menu_item_id)]
+    menu_item = _cache['menuByName'].get(normalize_name(name)) if name else None
+    if menu_item:
+        return recipes.get(str(menu_item['_id']))
+    return None
+
+
+# ============ INVALIDATION ============
+
+async def invalidate_catalog(broadcast: bool = True):
+    """Drop the local cache; with broadcast, make other workers reload too"""
+    _clear()
+    _stats['invalidations'] += 1
+    if not broadcast:
+        return
+    try:
+        await get_db().get_collection(VERSIONS_COLLECTION).update_one(
+            {'_id': CATALOG_VERSION_ID},
+            {'$inc': {'value': 1}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"[CatalogCache] Could not bump catalog version: {e}")
+
+
+async def _watch_changes():
+    db = get_db()
+    pipeline = [{'$match': {'ns.coll': {'$in': WATCHED_COLLECTIONS}}}]
+    try:
+        async with db.watch(pipeline) as stream:
+            print("[CatalogCache] Watching menu_items/recipes for changes")
+            async for _ in stream:
+                await invalidate_catalog(broadcast=False)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Change streams need a replica set; fall back to version checks
+        print(f"[CatalogCache] Change stream unavailable, using version checks: {e}")
+
+
+def start_catalog_watch():
+    """Start the optional change-stream watcher (CATALOG_CHANGE_STREAM=true)"""
+    global _watch_task
+    if os.getenv('CATALOG_CHANGE_STREAM', 'false').lower() != 'true' or _watch_task:
+        return
+    _watch_task = asyncio.create_task(_watch_changes())
+
+
+def stop_catalog_watch():
+    global _watch_task
+    if _watch_task:
+        _watch_task.cancel()
+        _watch_task = None
+
+
+def get_cache_stats() -> dict:
+    lookups = _stats['hits'] + _stats['misses']
+    return {
+        **_stats,
+        'hitRate': round(_stats['hits'] / lookups, 4) if lookups else None,
+        'loaded': _cache['loaded'],
+        'menuItems': len(_cache['menuById']),
+        'recipes': len(_cache['recipesByMenuItem']),
+        'changeStream': _watch_task is not None and not _watch_task.done(),
+    }
@@ -0,0 +1,137 @@
+"""
+Checkout Benchmark
+Compares the checkout fast path (routes/billing._checkout_order) with the
+previous two-step path (pay, then complete) under concurrent cashiers, and
+prints p50/p99 latency and throughput for each.
+
+Runs against MONGODB_URI in a scratch database (CHECKOUT_BENCH_DB,
+default 'rms_checkout_bench') that is dropped afterwards.
+
+Usage:
+    cd backend
+    python -m app.checkout_bench --orders 500 --cashiers 8
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime
+from bson import ObjectId
+from . import db as db_module
+from .db import get_db
+from .audit import log_audit
+from .indexes import ensure_indexes
+from .status_counters import tracked_update
+
+BENCH_DB = os.getenv('CHECKOUT_BENCH_DB', 'rms_checkout_bench')
+
+
+async def _legacy_checkout(data: dict):
+    """The checkout sequence before the fast path, call for call"""
+    db = get_db()
+    order_id = data["orderId"]
+    order = await db.orders.find_one({"_id": ObjectId(order_id)})
+    if order.get("paymentStatus") == "paid":
+        raise RuntimeError("Order already paid")
+    # Transaction ids used to be numbered from a count of payments
+    count = await db.payments.count_documents({})
+    transaction_id = f"TXN-{datetime.utcnow().strftime('%Y%m%d')}-{count + 1001}"
+    result = await db.payments.insert_one({
+        "orderId": order_id,
+        "orderNumber": order.get("orderNumber"),
+        "transactionId": transaction_id,
+        "amount": data["amount"],
+        "tips": 0,
+        "total": data["amount"],
+        "method": data["method"],
+        "status": "completed",
+        "createdAt": datetime.utcnow()
+    })
+    await db.orders.update_one(
+        {"_id": ObjectId(order_id)},
+        {"$set": {"paymentStatus": "paid", "paymentMethod": data["method"],
+                  "paidAt": datetime.utcnow(), "paymentId": str(result.inserted_id)}}
+    )
+    await log_audit("payment", "order", order_id, {"amount": data["amount"]})
+    await tracked_update(
+        "orders",
+        {"_id": ObjectId(order_id)},
+        {"$set": {"status": "completed", "statusUpdatedAt": datetime.utcnow(), "completedAt": datetime.utcnow()}}
+    )
+    await log_audit("checkout", "order", order_id, {"transactionId": transaction_id})
+
+
+async def _seed_orders(count: int) -> list:
+    db = get_db()
+    docs = [{
+        "orderNumber": f"#BENCH-{i}",
+        "tableNumber": i % 20 + 1,
+        "items": [{"name": "Bench Item", "quantity": 2, "price": 150}],
+        "total": 300,
+        "status": "served",
+        "paymentStatus": "pending_payment",
+        "createdAt": datetime.utcnow().isoformat() + 'Z',
+    } for i in range(count)]
+    result = await db.orders.insert_many(docs)
+    return [str(order_id) for order_id in result.inserted_ids]
+
+
+async def _run(name: str, checkout, order_ids: list, cashiers: int) -> dict:
+    queue = asyncio.Queue()
+    for order_id in order_ids:
+        queue.put_nowait(order_id)
+    latencies = []
+
+    async def cashier():
+        while True:
+            try:
+                order_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            await checkout({"orderId": order_id, "method": "card", "amount": 300})
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(cashier() for _ in range(cashiers)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "path": name,
+        "checkouts": len(latencies),
+        "p50Ms": round(statistics.median(latencies), 2),
+        "p99Ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+        "perSecond": round(len(latencies) / elapsed, 1),
+    }
+
+
+async def main():
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from .db import init_db
+    from .routes.billing import _checkout_order
+
+    parser = argparse.ArgumentParser(description="Benchmark checkout paths")
+    parser.add_argument("--orders", type=int, default=500, help="checkouts per path")
+    parser.add_argument("--cashiers", type=int, default=8, help="concurrent cashiers")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+    init_db()
+    db_module.db = db_module._client[BENCH_DB]
+    try:
+        await ensure_indexes()
+        print(f"🧾 {args.orders} checkouts per path, {args.cashiers} concurrent cashiers ({BENCH_DB})")
+        for name, checkout in (("two-step", _legacy_checkout), ("fast path", _checkout_order)):
+            order_ids = await _seed_orders(args.orders)
+            result = await _run(name, checkout, order_ids, args.cashiers)
+            print(f"  {result['path']:<10} p50 {result['p50Ms']:>8} ms   p99 {result['p99Ms']:>8} ms   "
+                  f"{result['perSecond']:>8} checkouts/s")
+    finally:
+        await db_module._client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
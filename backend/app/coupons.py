@@ -0,0 +1,261 @@
+"""
+Coupons Module
+Coupon validity, atomic redemption and the best-coupon index.
+
+- Validity windows are stored as datetimes next to the valid_from/valid_to
+  strings the UI edits: validFromAt (start of valid_from) and validUntilAt
+  (end of valid_to, exclusive). prepare_coupons() fills them in for older
+  coupons at startup.
+- redeem_coupon() checks and counts a redemption in one conditional
+  find_one_and_update (active, inside the window, usage_count below
+  usage_limit, order total above min_order, $inc usage_count), so two tills
+  cannot both take the last use.
+- Active coupons are kept in memory sorted by min_order; best_coupon()
+  only looks at the coupons an order total qualifies for. Coupon writes
+  call invalidate_coupons(), which bumps the shared 'coupons' version in
+  cache_versions; other workers compare versions every
+  COUPON_INDEX_CHECK_SECONDS (0: on every lookup). The index only suggests
+  a coupon: redemption re-checks everything against the database.
+"""
+
+import asyncio
+import bisect
+import os
+import time
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from .db import get_db
+from .catalog_cache import VERSIONS_COLLECTION
+from .rollups import parse_datetime
+
+COUPON_VERSION_ID = 'coupons'
+CHECK_SECONDS = float(os.getenv('COUPON_INDEX_CHECK_SECONDS', '5'))
+
+INDEX_FIELDS = ['code', 'status', 'type', 'value', 'min_order', 'max_discount', 'valid_from',
+                'valid_to', 'validFromAt', 'validUntilAt', 'usage_count', 'usage_limit']
+
+_index = {
+    'coupons': [],
+    'minOrders': [],
+    'loaded': False,
+    'version': None,
+    'checkedAt': 0.0,
+    'generation': 0,
+}
+_stats = {'loads': 0, 'versionChecks': 0, 'invalidations': 0, 'lookups': 0,
+          'redeemed': 0, 'rejected': 0}
+_lock = asyncio.Lock()
+
+
+def _number(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# ============ VALIDITY ============
+
+def _window_start(value):
+    return parse_datetime(value) if value else None
+
+
+def _window_end(value):
+    """valid_to is inclusive: a bare date lasts until the end of that day"""
+    parsed = parse_datetime(value) if value else None
+    if parsed is not None and isinstance(value, str) and len(value.strip()) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def window_fields(data: dict) -> dict:
+    """validFromAt/validUntilAt for the valid_from/valid_to present in `data`"""
+    fields = {}
+    if 'valid_from' in data:
+        fields['validFromAt'] = _window_start(data['valid_from'])
+    if 'valid_to' in data:
+        fields['validUntilAt'] = _window_end(data['valid_to'])
+    return fields
+
+
+def coupon_discount(coupon: dict, order_total: float) -> float:
+    """Discount a coupon gives on an order total"""
+    value = _number(coupon.get('value'))
+    if coupon.get('type') == 'percentage':
+        discount = order_total * value / 100
+        if coupon.get('max_discount'):
+            discount = min(discount, _number(coupon['max_discount']))
+    else:
+        discount = value
+    return round(min(max(discount, 0.0), order_total), 2)
+
+
+def rejection_reason(coupon: dict, order_total: float = None, now: datetime = None) -> str:
+    """Why a coupon cannot be used right now, or None"""
+    now = now or datetime.utcnow()
+    starts = coupon.get('validFromAt') or _window_start(coupon.get('valid_from'))
+    ends = coupon.get('validUntilAt') or _window_end(coupon.get('valid_to'))
+    if coupon.get('status') != 'active':
+        return "Coupon is not active"
+    if starts and starts > now:
+        return "Coupon is not yet valid"
+    if ends and ends <= now:
+        return "Coupon has expired"
+    limit = coupon.get('usage_limit')
+    if limit is not None and coupon.get('usage_count', 0) >= limit:
+        return "Coupon usage limit reached"
+    if order_total is not None and order_total < _number(coupon.get('min_order')):
+        return f"Minimum order amount is ₹{coupon.get('min_order')}"
+    return None
+
+
+def redeemable_filter(now: datetime, order_total: float = None) -> dict:
+    """Query matching coupons that can be redeemed now (for an order of order_total)"""
+    conditions = [
+        {'$or': [{'validFromAt': None}, {'validFromAt': {'$lte': now}}]},
+        {'$or': [{'validUntilAt': None}, {'validUntilAt': {'$gt': now}}]},
+        {'$or': [
+            {'usage_limit': None},
+            {'$expr': {'$lt': [{'$ifNull': ['$usage_count', 0]}, '$usage_limit']}},
+        ]},
+    ]
+    if order_total is not None:
+        conditions.append({'$or': [{'min_order': None}, {'min_order': {'$lte': order_total}}]})
+    return {'status': 'active', '$and': conditions}
+
+
+# ============ REDEMPTION ============
+
+async def redeem_coupon(match: dict, order_total: float = None):
+    """
+    Count one use of the coupon matching `match` (e.g. {'code': ...}) if it
+    can be redeemed now. Returns the updated coupon, or None.
+    """
+    now = datetime.utcnow()
+    coupon = await get_db().coupons.find_one_and_update(
+        {**match, **redeemable_filter(now, order_total)},
+        {'$inc': {'usage_count': 1}, '$set': {'lastUsedAt': now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if coupon is None:
+        _stats['rejected'] += 1
+        return None
+    _stats['redeemed'] += 1
+    await _note_redemption(coupon)
+    return coupon
+
+
+async def _note_redemption(coupon: dict):
+    """Keep the local index's usage count current; drop the coupon everywhere once used up"""
+    coupon_id = str(coupon['_id'])
+    for entry in _index['coupons']:
+        if entry['_id'] == coupon_id:
+            entry['usage_count'] = coupon.get('usage_count', 0)
+            break
+    limit = coupon.get('usage_limit')
+    if limit is not None and coupon.get('usage_count', 0) >= limit:
+        await invalidate_coupons()
+
+
+# ============ BEST-COUPON INDEX ============
+
+async def _remote_version(db):
+    doc = await db.get_collection(VERSIONS_COLLECTION).find_one({'_id': COUPON_VERSION_ID})
+    return doc.get('value') if doc else None
+
+
+async def _load(db):
+    coupons = []
+    async for coupon in db.coupons.find({'status': 'active'}, {field: 1 for field in INDEX_FIELDS}):
+        coupon['_id'] = str(coupon['_id'])
+        coupon['min_order'] = _number(coupon.get('min_order'))
+        if 'validUntilAt' not in coupon:
+            coupon.update(window_fields({'valid_from': coupon.get('valid_from'),
+                                         'valid_to': coupon.get('valid_to')}))
+        coupons.append(coupon)
+    coupons.sort(key=lambda c: c['min_order'])
+    _stats['loads'] += 1
+    return coupons
+
+
+async def _ensure_index():
+    now = time.monotonic()
+    if _index['loaded'] and now - _index['checkedAt'] < CHECK_SECONDS:
+        return
+    async with _lock:
+        db = get_db()
+        now = time.monotonic()
+        if _index['loaded'] and now - _index['checkedAt'] < CHECK_SECONDS:
+            return
+        _stats['versionChecks'] += 1
+        version = await _remote_version(db)
+        _index['checkedAt'] = now
+        if _index['loaded'] and version == _index['version']:
+            return
+        while True:
+            generation = _index['generation']
+            coupons = await _load(db)
+            # Invalidated while loading: the data may predate the write, read again
+            if generation == _index['generation']:
+                break
+            version = await _remote_version(db)
+        _index['coupons'] = coupons
+        _index['minOrders'] = [c['min_order'] for c in coupons]
+        _index['version'] = version
+        _index['loaded'] = True
+
+
+async def best_coupon(order_total: float):
+    """(coupon, discount) giving the largest discount on order_total, or (None, 0)"""
+    await _ensure_index()
+    _stats['lookups'] += 1
+    now = datetime.utcnow()
+    # Coupons sorted by min_order: the ones this total qualifies for are a prefix
+    eligible = bisect.bisect_right(_index['minOrders'], order_total)
+    best, best_discount = None, 0.0
+    for coupon in _index['coupons'][:eligible]:
+        if rejection_reason(coupon, order_total, now):
+            continue
+        discount = coupon_discount(coupon, order_total)
+        if discount > best_discount:
+            best, best_discount = coupon, discount
+    return best, best_discount
+
+
+async def invalidate_coupons():
+    """Rebuild the best-coupon index here and in every other worker"""
+    _stats['invalidations'] += 1
+    _index['generation'] += 1
+    _index['loaded'] = False
+    try:
+        await get_db().get_collection(VERSIONS_COLLECTION).update_one(
+            {'_id': COUPON_VERSION_ID},
+            {'$inc': {'value': 1}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"[Coupons] Could not bump coupon version: {e}")
+
+
+async def prepare_coupons():
+    """Fill in validFromAt/validUntilAt on coupons created before they existed"""
+    db = get_db()
+    updated = 0
+    async for coupon in db.coupons.find({'validUntilAt': {'$exists': False}},
+                                        {'valid_from': 1, 'valid_to': 1}):
+        await db.coupons.update_one({'_id': coupon['_id']}, {'$set': window_fields({
+            'valid_from': coupon.get('valid_from'),
+            'valid_to': coupon.get('valid_to'),
+        })})
+        updated += 1
+    if updated:
+        print(f"[Coupons] Added validity dates to {updated} coupon(s)")
+        await invalidate_coupons()
+
+
+def get_coupon_stats() -> dict:
+    return {
+        **_stats,
+        'indexed': len(_index['coupons']),
+        'loaded': _index['loaded'],
+    }
@@ -0,0 +1,214 @@
+"""
+Inventory Deduction Module
+Deducts the ingredients used by an order in a fixed number of round trips:
+
+1. Resolve every recipe from the in-process catalog cache (by menuItemId,
+   then by name)
+2. Sum the amount needed per ingredient in memory
+3. Apply all deductions in one `bulk_write` of pipeline updates, so the
+   stock level and its status are computed on the server from the current
+   document (no read-modify-write, no lost updates between kitchens)
+
+An order is deducted at most once: deduct_for_order() first inserts its
+deduction log as a 'pending' claim (unique claimKey = orderId), deducts,
+then marks the log 'completed'. A second call, e.g. a redelivered outbox
+event racing the first, hits the unique index and is skipped.
+"""
+
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from .db import get_db
+from .catalog_cache import resolve_recipe
+from .indexes import declare_index
+from .outbox import register_outbox_handler
+
+DEFAULT_MIN_THRESHOLD = 10
+DEDUCTION_TOPIC = 'inventory.deduct'
+
+# Manually recorded deductions (POST /inventory/deductions) carry no claimKey
+declare_index("deduction_logs", [("claimKey", 1)], unique=True,
+              partialFilterExpression={"claimKey": {"$type": "string"}})
+
+
+def stock_status_expression(stock_expr) -> dict:
+    """Server-side version of inventory.calculate_status"""
+    threshold = {"$ifNull": ["$minThreshold", DEFAULT_MIN_THRESHOLD]}
+    return {"$switch": {
+        "branches": [
+            {"case": {"$lte": [stock_expr, 0]}, "then": "Out"},
+            {"case": {"$lte": [stock_expr, {"$multiply": [threshold, 0.5]}]}, "then": "Critical"},
+            {"case": {"$lte": [stock_expr, threshold]}, "then": "Low"},
+        ],
+        "default": "Healthy",
+    }}
+
+
+def deduction_update(amount: float, now: datetime) -> list:
+    """Pipeline update that subtracts `amount` (floored at 0) and recomputes status"""
+    return [
+        {"$set": {
+            "stockLevel": {"$max": [0, {"$subtract": [{"$ifNull": ["$stockLevel", 0]}, amount]}]},
+            "lastDeduction": now,
+        }},
+        {"$set": {"status": stock_status_expression("$stockLevel")}},
+    ]
+
+
+async def resolve_recipes(items: list) -> dict:
+    """
+    Find the recipe for each order line.
+
+    Lines are matched by menuItemId first, then by case-insensitive menu item
+    name. Returns {line index: recipe}; lines without a recipe are left out.
+    """
+    resolved = {}
+    for index, item in enumerate(items):
+        recipe = await resolve_recipe(item.get("menuItemId"), item.get("name"))
+        if recipe:
+            resolved[index] = recipe
+    return resolved
+
+
+def ingredient_totals(items: list, recipes: dict, errors: list) -> dict:
+    """Sum the amount of each ingredient needed across all order lines"""
+    totals = {}
+    for index, item in enumerate(items):
+        recipe = recipes.get(index)
+        if not recipe:
+            errors.append(f"No recipe found for '{item.get('name', '')}'")
+            continue
+
+        quantity = item.get("quantity", 1)
+        for ing in recipe.get("ingredients", []):
+            ingredient_id = ing.get("ingredientId")
+            if not ingredient_id:
+                continue
+            if not ObjectId.is_valid(str(ingredient_id)):
+                errors.append(f"Error deducting {ingredient_id}: invalid ingredient id")
+                continue
+            totals[str(ingredient_id)] = totals.get(str(ingredient_id), 0) + ing.get("amount", 0) * quantity
+    return totals
+
+
+async def apply_ingredient_deductions(totals: dict, errors: list = None) -> list:
+    """
+    Deduct {ingredientId: amount} from stock in a single bulk write.
+
+    Returns the deducted ingredients with their new stock and status;
+    ingredients that no longer exist or failed to update are skipped
+    (failures are appended to `errors`).
+    """
+    if not totals:
+        return []
+
+    db = get_db()
+    now = datetime.utcnow()
+    ingredient_ids = list(totals.keys())
+    try:
+        await db.ingredients.bulk_write([
+            UpdateOne({"_id": ObjectId(ingredient_id)}, deduction_update(totals[ingredient_id], now))
+            for ingredient_id in ingredient_ids
+        ], ordered=False)
+    except BulkWriteError as e:
+        # ordered=False: every other update was still applied
+        for write_error in e.details.get("writeErrors", []):
+            ingredient_id = ingredient_ids[write_error["index"]]
+            totals = {k: v for k, v in totals.items() if k != ingredient_id}
+            if errors is not None:
+                errors.append(f"Error deducting {ingredient_id}: {write_error.get('errmsg')}")
+
+    ingredients = {}
+    async for ingredient in db.ingredients.find(
+        {"_id": {"$in": [ObjectId(ingredient_id) for ingredient_id in totals]}},
+        {"name": 1, "unit": 1, "stockLevel": 1, "status": 1}
+    ):
+        ingredients[str(ingredient["_id"])] = ingredient
+
+    deducted = []
+    for ingredient_id, amount in totals.items():
+        ingredient = ingredients.get(ingredient_id)
+        if not ingredient:
+            continue
+        deducted.append({
+            "ingredientId": ingredient_id,
+            "name": ingredient.get("name"),
+            "amount": amount,
+            "unit": ingredient.get("unit"),
+            "newStock": ingredient.get("stockLevel"),
+            "status": ingredient.get("status")
+        })
+    return deducted
+
+
+async def deduct_for_order(order_id: str, items: list) -> dict:
+    """Deduct inventory for an order once; repeated calls are a no-op"""
+    db = get_db()
+    already_processed = {"success": True, "message": "Already processed", "already_processed": True}
+
+    # Logs written before claims existed have no claimKey
+    if await db.deduction_logs.find_one({"orderId": order_id, "claimKey": {"$exists": False}}, {"_id": 1}):
+        return already_processed
+
+    # Claim the order before touching stock
+    try:
+        claim = await db.deduction_logs.insert_one({
+            "claimKey": order_id,
+            "orderId": order_id,
+            "items": items,
+            "ingredients": [],
+            "status": "pending",
+            "timestamp": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        return already_processed
+
+    errors = []
+    try:
+        recipes = await resolve_recipes(items)
+        totals = ingredient_totals(items, recipes, errors)
+    except Exception:
+        # Nothing deducted yet: release the claim so a retry can run
+        await db.deduction_logs.delete_one({"_id": claim.inserted_id})
+        raise
+
+    try:
+        deducted_ingredients = await apply_ingredient_deductions(totals, errors)
+    except Exception as e:
+        # Stock may be partly deducted; keep the claim so it is not applied twice
+        await db.deduction_logs.update_one(
+            {"_id": claim.inserted_id},
+            {"$set": {"status": "failed", "errors": [str(e)], "timestamp": datetime.utcnow()}}
+        )
+        raise
+
+    # Logged even when nothing was deducted (no recipes), so the order is not retried
+    await db.deduction_logs.update_one(
+        {"_id": claim.inserted_id},
+        {"$set": {
+            "status": "completed",
+            "ingredients": deducted_ingredients,
+            "timestamp": datetime.utcnow(),
+            "errors": errors if errors else None
+        }}
+    )
+
+    return {
+        "success": True,
+        "deducted": deducted_ingredients,
+        "errors": errors if errors else None
+    }
+
+
+def deduction_event(order_id: str, items: list) -> tuple:
+    """Outbox event that deducts inventory for an order"""
+    return DEDUCTION_TOPIC, {'orderId': order_id, 'items': items}
+
+
+async def _deliver_deduction(payload: dict, event_id: str):
+    # deduct_for_order skips orders that already have a deduction claim
+    await deduct_for_order(payload['orderId'], payload.get('items') or [])
+
+
+register_outbox_handler(DEDUCTION_TOPIC, _deliver_deduction)
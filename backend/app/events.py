@@ -0,0 +1,209 @@
+"""
+Event Bus Module
+In-process publish/subscribe used to push live updates (e.g. the kitchen
+display) to connected clients.
+
+Every worker has one hub that fans messages out to its local subscribers,
+each with its own bounded queue. How messages travel between workers is up
+to the broker (EVENT_BROKER):
+
+- memory (default): messages only reach subscribers of the same process;
+  enough for a single worker and for tests
+- mongo: messages are written to a capped collection that every worker
+  tails, so a publish on one worker reaches screens connected to any other
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from pymongo import CursorType
+from .db import get_db
+
+EVENTS_COLLECTION = 'event_bus'
+EVENTS_CAPPED_BYTES = int(os.getenv('EVENT_BUS_CAPPED_BYTES', str(16 * 1024 * 1024)))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv('EVENT_SUBSCRIBER_QUEUE_SIZE', '256'))
+
+
+class Subscription:
+    """A subscriber's queue; `overflowed` is set when it fell too far behind"""
+
+    def __init__(self, hub, channel: str, maxsize: int):
+        self.hub = hub
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def deliver(self, message: dict):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Slow consumer: stop buffering, it has to resync from a snapshot
+            self.overflowed = True
+
+    async def get(self, timeout: float = None):
+        """Next message, or None on timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventHub:
+    """Local fan-out from one publisher to many subscribers"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self.stats = {'published': 0, 'delivered': 0, 'overflows': 0}
+
+    def subscribe(self, channel: str, maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> Subscription:
+        subscription = Subscription(self, channel, maxsize)
+        self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.get(subscription.channel, set()).discard(subscription)
+
+    def dispatch(self, channel: str, message: dict):
+        self.stats['published'] += 1
+        for subscription in list(self._subscribers.get(channel, ())):
+            was_overflowed = subscription.overflowed
+            subscription.deliver(message)
+            if subscription.overflowed and not was_overflowed:
+                self.stats['overflows'] += 1
+            elif not subscription.overflowed:
+                self.stats['delivered'] += 1
+
+    def subscriber_count(self, channel: str = None) -> int:
+        if channel:
+            return len(self._subscribers.get(channel, ()))
+        return sum(len(s) for s in self._subscribers.values())
+
+
+class InMemoryBroker:
+    name = 'memory'
+
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: dict):
+        self.hub.dispatch(channel, message)
+
+
+class MongoBroker:
+    """Cross-worker delivery through a tailable cursor on a capped collection"""
+    name = 'mongo'
+
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+        self._task = None
+
+    async def _ensure_collection(self, db):
+        if EVENTS_COLLECTION not in await db.list_collection_names():
+            try:
+                await db.create_collection(EVENTS_COLLECTION, capped=True, size=EVENTS_CAPPED_BYTES)
+            except Exception:
+                # Another worker created it first
+                pass
+
+    async def start(self):
+        db = get_db()
+        await self._ensure_collection(db)
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, channel: str, message: dict):
+        db = get_db()
+        await db.get_collection(EVENTS_COLLECTION).insert_one({
+            'channel': channel,
+            'message': message,
+            'createdAt': datetime.utcnow(),
+        })
+
+    async def _tail(self):
+        db = get_db()
+        coll = db.get_collection(EVENTS_COLLECTION)
+        # Only deliver what is published from now on
+        last = await coll.find_one({}, sort=[('$natural', -1)])
+        last_id = last['_id'] if last else None
+        while True:
+            try:
+                query = {'_id': {'$gt': last_id}} if last_id else {}
+                cursor = coll.find(query, cursor_type=CursorType.TAILABLE_AWAIT, no_cursor_timeout=True)
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc['_id']
+                        self.hub.dispatch(doc['channel'], doc['message'])
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Events] Tailing {EVENTS_COLLECTION} failed, retrying: {e}")
+            await asyncio.sleep(1)
+
+
+hub = EventHub()
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        if os.getenv('EVENT_BROKER', 'memory').lower() == 'mongo':
+            _broker = MongoBroker(hub)
+        else:
+            _broker = InMemoryBroker(hub)
+    return _broker
+
+
+def set_broker(broker):
+    """Swap the broker (tests, or a custom transport such as Redis)"""
+    global _broker
+    _broker = broker
+
+
+async def start_event_bus():
+    await get_broker().start()
+    print(f"[Events] Event bus started ({get_broker().name} broker)")
+
+
+async def stop_event_bus():
+    await get_broker().stop()
+
+
+async def publish(channel: str, message: dict):
+    """Publish to every subscriber of `channel`; never raises"""
+    try:
+        await get_broker().publish(channel, message)
+    except Exception as e:
+        print(f"[Events] Could not publish to {channel}: {e}")
+
+
+def subscribe(channel: str, maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> Subscription:
+    return hub.subscribe(channel, maxsize)
+
+
+def get_event_stats() -> dict:
+    return {
+        'broker': get_broker().name,
+        'subscribers': hub.subscriber_count(),
+        **hub.stats,
+    }
@@ -0,0 +1,208 @@
+"""
+Idempotency Module
+`Idempotency-Key` support for endpoints that must not run twice when a
+client retries (payments, checkout).
+
+The first request with a key claims it in `idempotency_keys` (insert on a
+unique _id), runs, and stores its response. Requests repeating the key:
+- get the stored response back without running the handler again
+  (`Idempotent-Replayed: true` header)
+- wait while the first one is still running, then get its response;
+  after IDEMPOTENCY_WAIT_SECONDS they receive 409
+- receive 422 if the key was used for a different request body
+
+While the request runs, its worker renews the claim every third of
+IDEMPOTENCY_LOCK_SECONDS, so a slow handler keeps it. A claim whose worker
+died stops being renewed, expires after IDEMPOTENCY_LOCK_SECONDS and the
+next retry takes it over. Server errors (5xx) release the key so the
+request can be retried; client errors (4xx) are stored like successes.
+Keys expire IDEMPOTENCY_TTL_SECONDS after first use.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .db import get_db
+from .indexes import declare_index
+
+IDEMPOTENCY_COLLECTION = 'idempotency_keys'
+
+TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '30'))
+WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+MAX_KEY_LENGTH = 255
+
+declare_index(IDEMPOTENCY_COLLECTION, [('createdAt', 1)], expireAfterSeconds=TTL_SECONDS)
+
+# key id -> event set when this worker finishes the request holding the key
+_running = {}
+_stats = {'executed': 0, 'replayed': 0, 'waited': 0, 'conflicts': 0, 'takeovers': 0,
+          'renewals': 0, 'lostClaims': 0}
+
+
+def request_fingerprint(payload) -> str:
+    """Stable hash of what the request asked for"""
+    canonical = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _replay(doc: dict) -> JSONResponse:
+    _stats['replayed'] += 1
+    response = doc['response']
+    return JSONResponse(
+        content=response['body'],
+        status_code=response['statusCode'],
+        headers={'Idempotent-Replayed': 'true'},
+    )
+
+
+async def _claim(coll, key_id: str, fingerprint: str, token: str):
+    """Claim the key; returns None when claimed, otherwise the existing record"""
+    now = datetime.utcnow()
+    try:
+        await coll.insert_one({
+            '_id': key_id,
+            'fingerprint': fingerprint,
+            'status': 'in_progress',
+            'token': token,
+            'lockedUntil': now + timedelta(seconds=LOCK_SECONDS),
+            'createdAt': now,
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    # Take over a claim whose request never finished
+    taken = await coll.find_one_and_update(
+        {'_id': key_id, 'status': 'in_progress', 'fingerprint': fingerprint, 'lockedUntil': {'$lt': now}},
+        {'$set': {'token': token, 'lockedUntil': now + timedelta(seconds=LOCK_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if taken is not None:
+        _stats['takeovers'] += 1
+        return None
+    return await coll.find_one({'_id': key_id}) or {'status': 'released'}
+
+
+async def _keep_claim(coll, owner: dict):
+    """Push lockedUntil forward while the handler holding the claim runs"""
+    while True:
+        await asyncio.sleep(LOCK_SECONDS / 3)
+        try:
+            result = await coll.update_one(
+                {**owner, 'status': 'in_progress'},
+                {'$set': {'lockedUntil': datetime.utcnow() + timedelta(seconds=LOCK_SECONDS)}}
+            )
+        except Exception as e:
+            print(f"[Idempotency] Could not renew claim {owner['_id']}: {e}")
+            continue
+        if result.matched_count == 0:
+            # Taken over after a missed renewal (e.g. the database was unreachable)
+            _stats['lostClaims'] += 1
+            print(f"[Idempotency] Lost claim {owner['_id']} while its request was running")
+            return
+        _stats['renewals'] += 1
+
+
+async def _wait_for_result(coll, key_id: str) -> dict:
+    """Wait for the request holding the key to finish; returns its record (or None if released)"""
+    _stats['waited'] += 1
+    deadline = asyncio.get_running_loop().time() + WAIT_SECONDS
+    delay = 0.05
+    while True:
+        local = _running.get(key_id)
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        if local is not None:
+            # Same worker: wake up as soon as it is done
+            try:
+                await asyncio.wait_for(local.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 1.0)
+        doc = await coll.find_one({'_id': key_id})
+        if doc is None or doc['status'] != 'in_progress':
+            return doc
+        if doc['lockedUntil'] < datetime.utcnow():
+            return doc
+
+
+async def run_idempotent(key: str, scope: str, payload, handler):
+    """
+    Run `await handler()` at most once per (scope, key).
+
+    Args:
+        key: Value of the Idempotency-Key header (None runs the handler as usual)
+        scope: Endpoint name, so one key can be used on different endpoints
+        payload: What the request asked for; reusing a key with another payload is a 422
+        handler: Coroutine function producing the response
+    """
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters")
+
+    coll = get_db().get_collection(IDEMPOTENCY_COLLECTION)
+    key_id = f"{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+    token = uuid.uuid4().hex
+
+    while True:
+        existing = await _claim(coll, key_id, fingerprint, token)
+        if existing is None:
+            break
+        if existing.get('fingerprint', fingerprint) != fingerprint:
+            _stats['conflicts'] += 1
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if existing['status'] == 'completed':
+            return _replay(existing)
+        if existing['status'] == 'in_progress':
+            existing = await _wait_for_result(coll, key_id)
+            if existing is not None and existing['status'] == 'completed':
+                return _replay(existing)
+        # Released or abandoned: try to claim it again
+
+    done = _running[key_id] = asyncio.Event()
+    owner = {'_id': key_id, 'token': token}
+    heartbeat = asyncio.create_task(_keep_claim(coll, owner))
+    try:
+        try:
+            result = await handler()
+        except HTTPException as e:
+            if e.status_code >= 500:
+                raise
+            await coll.update_one(owner, {'$set': {
+                'status': 'completed',
+                'response': {'statusCode': e.status_code, 'body': {'detail': e.detail}},
+                'completedAt': datetime.utcnow(),
+            }})
+            raise
+        _stats['executed'] += 1
+        await coll.update_one(owner, {'$set': {
+            'status': 'completed',
+            'response': {'statusCode': 200, 'body': jsonable_encoder(result)},
+            'completedAt': datetime.utcnow(),
+        }})
+        return result
+    except BaseException:
+        # Server error or cancelled: let a retry run it again
+        await asyncio.shield(coll.delete_one({**owner, 'status': 'in_progress'}))
+        raise
+    finally:
+        heartbeat.cancel()
+        _running.pop(key_id, None)
+        done.set()
+
+
+def get_idempotency_stats() -> dict:
+    return {'inFlight': len(_running), **_stats}
@@ -0,0 +1,185 @@
+"""
+Index Registry Module
+Route modules declare the indexes their queries rely on with declare_index();
+ensure_indexes() applies them idempotently on startup and index_report()
+compares them against what the server actually has and uses.
+"""
+
+from pymongo import IndexModel
+from .db import get_db
+
+# collection -> {index name: {"keys": [(field, direction)], "options": {...}}}
+_registry = {}
+
+
+def index_name(keys: list) -> str:
+    """Default MongoDB index name for a key list, e.g. status_1_createdAt_-1"""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def declare_index(collection: str, keys: list, **options):
+    """
+    Declare an index on a collection.
+
+    Args:
+        collection: Collection name
+        keys: List of (field, direction) tuples
+        **options: Extra IndexModel options (unique, expireAfterSeconds, ...)
+    """
+    name = options.pop('name', None) or index_name(keys)
+    _registry.setdefault(collection, {})[name] = {'keys': list(keys), 'options': options}
+
+
+def declared_indexes() -> dict:
+    return _registry
+
+
+async def ensure_indexes() -> dict:
+    """
+    Create every declared index; existing identical indexes are a no-op.
+    Indexes are created one at a time so a conflict on one of them does not
+    keep the others on the same collection from being built.
+    """
+    db = get_db()
+    created = {}
+    errors = {}
+    for collection, indexes in _registry.items():
+        coll = db.get_collection(collection)
+        for name, spec in indexes.items():
+            try:
+                await coll.create_indexes([IndexModel(spec['keys'], name=name, **spec['options'])])
+                created.setdefault(collection, []).append(name)
+            except Exception as e:
+                # Usually an existing index with the same keys but other options
+                errors.setdefault(collection, {})[name] = str(e)
+                print(f"[Indexes] Could not create index {name} on {collection}: {e}")
+    return {'created': created, 'errors': errors}
+
+
+def _leading_match(index_keys: list, fields: set) -> int:
+    """Number of leading index keys that appear in the query's fields"""
+    matched = 0
+    for field, _ in index_keys:
+        if field not in fields:
+            break
+        matched += 1
+    return matched
+
+
+def _query_fields(filter_doc: dict) -> set:
+    fields = set()
+    for key, value in (filter_doc or {}).items():
+        if key in ('$and', '$or', '$nor') and isinstance(value, list):
+            for clause in value:
+                fields |= _query_fields(clause)
+        elif not key.startswith('$'):
+            fields.add(key)
+    return fields
+
+
+async def _profiled_collscans(db, limit: int) -> list:
+    """Group COLLSCAN queries recorded by the profiler by collection and filter shape"""
+    shapes = {}
+    cursor = db.get_collection('system.profile').find(
+        {'planSummary': 'COLLSCAN', 'op': {'$in': ['query', 'command']}},
+        {'ns': 1, 'command': 1, 'millis': 1}
+    ).sort('ts', -1).limit(limit)
+    async for entry in cursor:
+        command = entry.get('command') or {}
+        filter_doc = command.get('filter') or command.get('query') or {}
+        if not isinstance(filter_doc, dict):
+            continue
+        collection = entry.get('ns', '').split('.', 1)[-1]
+        fields = sorted(_query_fields(filter_doc))
+        sort_fields = sorted((command.get('sort') or {}).keys())
+        key = (collection, tuple(fields), tuple(sort_fields))
+        shape = shapes.setdefault(key, {
+            'collection': collection, 'filter': fields, 'sort': sort_fields,
+            'count': 0, 'totalMillis': 0,
+        })
+        shape['count'] += 1
+        shape['totalMillis'] += entry.get('millis', 0)
+    return sorted(shapes.values(), key=lambda s: s['count'], reverse=True)
+
+
+async def index_report(profile_sample: int = 1000) -> dict:
+    """
+    Compare declared indexes with the live ones and their $indexStats usage,
+    and list profiled query shapes that no index supports.
+    """
+    db = get_db()
+    collections = set(_registry.keys()) | set(await db.list_collection_names())
+    collections = {c for c in collections if not c.startswith('system.')}
+
+    report = {}
+    live_keys = {}
+    for collection in sorted(collections):
+        coll = db.get_collection(collection)
+        declared = _registry.get(collection, {})
+        try:
+            live = await coll.index_information()
+        except Exception:
+            live = {}
+        live_keys[collection] = [spec['key'] for spec in live.values()]
+
+        usage = {}
+        try:
+            async for stat in coll.aggregate([{'$indexStats': {}}]):
+                usage[stat['name']] = {
+                    'ops': stat.get('accesses', {}).get('ops', 0),
+                    'since': stat.get('accesses', {}).get('since'),
+                }
+        except Exception:
+            pass
+
+        live_by_keys = {tuple(spec['key']): name for name, spec in live.items()}
+        missing = [
+            name for name, spec in declared.items()
+            if tuple(spec['keys']) not in live_by_keys
+        ]
+        declared_keys = {tuple(spec['keys']) for spec in declared.values()}
+        undeclared = [
+            name for name, spec in live.items()
+            if name != '_id_' and tuple(spec['key']) not in declared_keys
+        ]
+        unused = [
+            name for name, stat in usage.items()
+            if name != '_id_' and stat['ops'] == 0
+        ]
+
+        if not (declared or undeclared or missing):
+            continue
+        report[collection] = {
+            'declared': [
+                {'name': name, 'keys': spec['keys'], 'options': spec['options']}
+                for name, spec in declared.items()
+            ],
+            'missing': missing,
+            'undeclared': undeclared,
+            'unused': unused,
+            'usage': usage,
+        }
+
+    try:
+        profile_status = await db.command({'profile': -1})
+        profiler_enabled = profile_status.get('was', 0) > 0
+    except Exception:
+        profiler_enabled = False
+
+    uncovered = []
+    try:
+        for shape in await _profiled_collscans(db, profile_sample):
+            fields = set(shape['filter'])
+            if not fields:
+                continue
+            best = max((_leading_match(keys, fields) for keys in live_keys.get(shape['collection'], [])), default=0)
+            if best == 0:
+                uncovered.append(shape)
+    except Exception as e:
+        print(f"[Indexes] Could not read profiler data: {e}")
+
+    return {
+        'collections': report,
+        'profilerEnabled': profiler_enabled,
+        'uncoveredQueryShapes': uncovered,
+    }
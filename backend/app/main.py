@@ -30,6 +30,15 @@ from .routes import notifications as notifications_router
 from .routes import billing as billing_router
 from .routes import analytics as analytics_router
 from .routes import recipes as recipes_router
+from .routes import admin as admin_router
+from .routes import workflow as workflow_router
+from .indexes import ensure_indexes
+from .catalog_cache import start_catalog_watch, stop_catalog_watch
+from .events import start_event_bus, stop_event_bus
+from .outbox import start_outbox_dispatcher, stop_outbox_dispatcher
+from .audit import start_audit_writer, stop_audit_writer
+from .audit_storage import prepare_audit_storage
+from .coupons import prepare_coupons
 
 
 app = FastAPI(title='RMS Backend (FastAPI)')
@@ -61,6 +70,20 @@ async def startup():
         from .db import init_db
         init_db()
         print("✅ MongoDB connected successfully")
+        # Apply the index registry (no-op for indexes that already exist)
+        await ensure_indexes()
+        # Audit TTL retention, and migration of string-dated entries in the background
+        await prepare_audit_storage()
+        # Datetime validity windows on coupons created before they were stored
+        await prepare_coupons()
+        # Optional change stream that keeps the menu/recipe cache fresh
+        start_catalog_watch()
+        # Kitchen display push channel (EVENT_BROKER=mongo for several workers)
+        await start_event_bus()
+        # Deliver queued side effects (audit, notifications, deduction, ...)
+        start_outbox_dispatcher()
+        # Batch audit log writes off the request path (AUDIT_WRITE_MODE=sync to disable)
+        start_audit_writer()
         # Start the backup scheduler
         await start_scheduler()
     except Exception as e:
@@ -70,6 +93,11 @@ async def startup():
 
 @app.on_event('shutdown')
 async def shutdown():
+    stop_catalog_watch()
+    await stop_event_bus()
+    await stop_outbox_dispatcher()
+    # Flush buffered audit entries before the connection goes away
+    await stop_audit_writer()
     shutdown_scheduler()
 
 
@@ -82,6 +110,7 @@ app.include_router(audit_router.router, prefix='/api/audit')
 app.include_router(menu_router.router, prefix='/api/menu')
 app.include_router(orders_router.router, prefix='/api/orders')
 app.include_router(tables_router.router, prefix='/api/tables')
+app.include_router(workflow_router.router, prefix='/api')
 app.include_router(inventory_router.router, prefix='/api/inventory')
 app.include_router(recipes_router.router, prefix='/api/recipes')
 
@@ -98,6 +127,9 @@ app.include_router(billing_router.router, prefix='/api/billing')
 # Analytics
 app.include_router(analytics_router.router, prefix='/api/analytics')
 
+# Administration
+app.include_router(admin_router.router, prefix='/api/admin')
+
 
 # Health check endpoint
 @app.get('/api/health')
@@ -0,0 +1,235 @@
+"""
+Order Lifecycle Module
+Applies an order status transition as one unit of work.
+
+Required effects commit together, in a multi-document transaction when the
+deployment supports it (replica set or sharded cluster):
+- the status change itself, a single find_one_and_update whose pre-image
+  gives the previous status atomically; with `expected_status` the update
+  only matches while the order is still in that status (409 otherwise)
+- on 'served': the billing entry (upserted by orderId, priced from the
+  in-process pricing engine) and the order's billing reference
+- on 'completed': paymentStatus 'settled' unless already paid, folded into
+  the same update with a pipeline
+
+Follow-up work (inventory deduction on 'preparing', the 'order ready'
+notification, customer stats on 'completed', the audit entry) is written to
+the outbox in the same transaction and delivered by the dispatcher (see
+app/outbox.py). Analytics rollups, status counters, kitchen prep-time histograms and
+the kitchen display event are updated concurrently right after commit. Everything keys off the
+pre-image, so two racing requests for the same transition trigger it once.
+
+Set ORDER_TRANSACTIONS=off to never use transactions (standalone servers
+are detected automatically).
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from .db import get_db
+
+ORDER_STATUSES = ["placed", "preparing", "ready", "served", "completed", "cancelled"]
+
+_transactions = {'supported': None}
+
+
+def transactions_supported(db) -> bool:
+    """True when the server topology can run multi-document transactions"""
+    if os.getenv('ORDER_TRANSACTIONS', 'auto').lower() == 'off':
+        return False
+    if _transactions['supported'] is None:
+        try:
+            topology = db.client.topology_description.topology_type_name
+            _transactions['supported'] = topology in ('ReplicaSetWithPrimary', 'Sharded', 'LoadBalanced')
+        except Exception:
+            _transactions['supported'] = False
+    return _transactions['supported']
+
+
+async def run_in_transaction(db, work):
+    """
+    Run `work(session)` in a transaction (retried on transient errors), or
+    with session=None when transactions are not available.
+    """
+    if not transactions_supported(db):
+        return await work(None)
+    async with await db.client.start_session() as session:
+        return await session.with_transaction(work)
+
+
+def billing_entry_for_order(order_id: str, order: dict, pricing: dict) -> dict:
+    """Billing entry created when an order is served, priced by app/pricing.py"""
+    entry = {
+        "orderId": order_id,
+        "orderNumber": order.get("orderNumber", f"#ORD-{order_id[:8]}"),
+        "tableNumber": order.get("tableNumber"),
+        "customerName": order.get("customerName", "Customer"),
+        "items": order.get("items", []),
+        **pricing,
+        "status": "pending_payment",
+        "type": order.get("type", "dine-in"),
+        "waiterId": order.get("waiterId"),
+        "waiterName": order.get("waiterName"),
+        "createdAt": datetime.utcnow().isoformat() + 'Z',
+        "servedAt": datetime.utcnow().isoformat() + 'Z',
+    }
+    # Kept on the bill so it can be re-priced the same way
+    for field in ("membershipTier", "discountRuleIds"):
+        if order.get(field):
+            entry[field] = order[field]
+    return entry
+
+
+def _status_update(status: str, now: str):
+    if status != "completed":
+        return {"$set": {"status": status, "statusUpdatedAt": now}}
+    # Settle unpaid orders in the same write
+    paid = {"$eq": ["$paymentStatus", "paid"]}
+    return [{"$set": {
+        "status": status,
+        "statusUpdatedAt": now,
+        "paymentStatus": {"$cond": [paid, "$paymentStatus", "settled"]},
+        "completedAt": {"$cond": [paid, "$completedAt", now]},
+    }}]
+
+
+def _follow_up_events(order_id: str, order: dict, status: str, deduct_inventory: bool) -> list:
+    """Outbox events for a transition, decided from the pre-image"""
+    from .audit import audit_event
+    from .deduction import deduction_event
+    from .routes.customers import order_completed_event
+    from .routes.notifications import notification_event
+
+    previous_status = order.get("status")
+    events = []
+    deduct = status == "preparing" and deduct_inventory and bool(order.get("items"))
+    if deduct:
+        events.append(deduction_event(order_id, order["items"]))
+    if status == "ready" and previous_status != "ready":
+        events.append(notification_event({
+            "type": "order_ready",
+            "orderId": order_id,
+            "orderNumber": order.get("orderNumber"),
+            "tableNumber": order.get("tableNumber"),
+            "message": f"Order {order.get('orderNumber')} is ready for serving",
+            "createdAt": datetime.utcnow().isoformat() + 'Z'
+        }))
+    if status == "completed" and previous_status != "completed" and order.get("customerId"):
+        events.append(order_completed_event(str(order["customerId"]), order_id, order.get("total")))
+    events.append(audit_event("status_update", "order", order_id, details={
+        "newStatus": status,
+        "previousStatus": previous_status,
+        "inventoryDeductionQueued": deduct,
+    }))
+    return events
+
+
+async def _commit_transition(db, order_id: str, status: str, expected_status: str = None,
+                             deduct_inventory: bool = True) -> tuple:
+    """
+    Apply the status change, its required effects and its outbox events.
+    Returns (pre-image, topics of the queued events).
+    """
+    from .outbox import enqueue_many, notify_committed
+    from .pricing import get_pricing_engine
+
+    order_filter = {"_id": ObjectId(order_id)}
+    if expected_status:
+        order_filter["status"] = expected_status
+    now = datetime.utcnow().isoformat() + 'Z'
+    # Loaded up front: pricing the bill inside the transaction reads nothing
+    pricing_engine = await get_pricing_engine() if status == "served" else None
+
+    async def work(session):
+        order = await db.orders.find_one_and_update(
+            order_filter,
+            _status_update(status, now),
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if order is None:
+            return None, []
+
+        if status == "served" and order.get("status") != "served":
+            billing = await db.billing.find_one_and_update(
+                {"orderId": order_id},
+                {"$setOnInsert": billing_entry_for_order(order_id, order, pricing_engine.price(order))},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                projection={"_id": 1},
+                session=session
+            )
+            await db.orders.update_one(
+                {"_id": order["_id"]},
+                {"$set": {
+                    "billingId": str(billing["_id"]),
+                    "paymentStatus": "pending_payment",
+                    "servedAt": now
+                }},
+                session=session
+            )
+
+        events = _follow_up_events(order_id, order, status, deduct_inventory)
+        await enqueue_many(events, session=session)
+        return order, [topic for topic, _ in events]
+
+    order, topics = await run_in_transaction(db, work)
+    if order is None:
+        if expected_status and await db.orders.count_documents({"_id": ObjectId(order_id)}, limit=1):
+            raise HTTPException(status_code=409, detail=f"Order is no longer '{expected_status}'")
+        raise HTTPException(status_code=404, detail="Order not found")
+    notify_committed()
+    return order, topics
+
+
+async def transition_order_status(order_id: str, status: str, deduct_inventory: bool = True,
+                                  expected_status: str = None) -> dict:
+    """
+    Move an order to `status`.
+
+    Flow:
+    - placed → preparing: inventory deduction if deduct_inventory=true
+    - preparing → ready: notification for serving
+    - ready → served → completed: billing entry, then payment settlement
+
+    Returns success, status, previousStatus and inventoryDeductionQueued.
+    Deduction happens after the response (from the outbox), so the
+    inventoryDeducted and deductionResult fields are no longer returned;
+    its outcome is in deduction_logs.
+    """
+    from .deduction import DEDUCTION_TOPIC
+    from .prep_metrics import record_transition_time
+    from .rollups import record_status_change
+    from .status_counters import record_update
+    from .routes.orders import publish_order_status
+
+    if status not in ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {ORDER_STATUSES}")
+    if not ObjectId.is_valid(order_id):
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    db = get_db()
+    order, topics = await _commit_transition(db, order_id, status, expected_status, deduct_inventory)
+    previous_status = order.get("status")
+
+    # In-process views of the order; cheap, and rebuilt by their own reconcile jobs
+    results = await asyncio.gather(
+        record_status_change(order, previous_status, status),
+        record_update("orders", order, {"$set": {"status": status}}),
+        record_transition_time(order, previous_status, status),
+        publish_order_status(order, previous_status, status),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"[Orders] Side effect failed for order {order_id}: {result}")
+
+    return {
+        "success": True,
+        "status": status,
+        "previousStatus": previous_status,
+        "inventoryDeductionQueued": DEDUCTION_TOPIC in topics,
+    }
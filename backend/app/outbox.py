@@ -0,0 +1,257 @@
+"""
+Outbox Module
+Transactional outbox for side effects that do not need to finish before the
+response (audit entries, notifications, inventory deduction, customer stats).
+
+Producers call enqueue()/enqueue_many() with the same session as their
+primary write, so the events commit (or roll back) with it. A dispatcher
+running in every worker drains the `outbox` collection with a pool of
+OUTBOX_WORKERS tasks:
+
+- delivery is at-least-once: an event is leased to one worker while its
+  handler runs; if the worker dies the lease expires and another worker
+  picks it up, so handlers must be idempotent (they get the event id)
+- failures are retried with backoff, up to OUTBOX_MAX_ATTEMPTS, then the
+  event is parked as 'failed'
+- backpressure: workers pull one event at a time, so at most OUTBOX_WORKERS
+  handlers run per process and bursts wait in the collection, not in memory
+- delivered events are kept OUTBOX_RETENTION_SECONDS for troubleshooting
+
+get_outbox_stats() reports backlog, lag (age of the oldest pending event)
+and delivery latency.
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from .db import get_db
+from .indexes import declare_index
+
+OUTBOX_COLLECTION = 'outbox'
+
+WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', '1'))
+LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+RETRY_BASE_SECONDS = float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '2'))
+RETENTION_SECONDS = int(os.getenv('OUTBOX_RETENTION_SECONDS', str(24 * 3600)))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+declare_index(OUTBOX_COLLECTION, [("status", 1), ("availableAt", 1)])
+declare_index(OUTBOX_COLLECTION, [("deliveredAt", 1)], expireAfterSeconds=RETENTION_SECONDS)
+
+# topic -> async handler(payload: dict, event_id: str)
+_handlers = {}
+_state = {'tasks': [], 'wakeup': None, 'running': False}
+_stats = {'delivered': 0, 'retried': 0, 'failed': 0, 'latencyTotal': 0.0, 'latencyMax': 0.0}
+
+
+def register_outbox_handler(topic: str, handler):
+    """Register the coroutine function that delivers events of `topic`"""
+    _handlers[topic] = handler
+
+
+def _event(topic: str, payload: dict, now: datetime) -> dict:
+    return {
+        '_id': ObjectId(),
+        'topic': topic,
+        'payload': payload,
+        'status': 'pending',
+        'attempts': 0,
+        'availableAt': now,
+        'createdAt': now,
+        'leaseToken': None,
+        'leaseUntil': None,
+        'lastError': None,
+    }
+
+
+def _wake():
+    if _state['wakeup'] is not None:
+        _state['wakeup'].set()
+
+
+async def enqueue(topic: str, payload: dict, session=None) -> str:
+    """Add one event; pass the session of the write it belongs to"""
+    return (await enqueue_many([(topic, payload)], session=session))[0]
+
+
+async def enqueue_many(events: list, session=None) -> list:
+    """Add several (topic, payload) events in one insert"""
+    if not events:
+        return []
+    now = datetime.utcnow()
+    docs = [_event(topic, payload, now) for topic, payload in events]
+    await get_db().get_collection(OUTBOX_COLLECTION).insert_many(docs, session=session)
+    if session is None:
+        _wake()
+    return [str(doc['_id']) for doc in docs]
+
+
+def notify_committed():
+    """Let the local dispatcher pick up events enqueued inside a transaction"""
+    _wake()
+
+
+# ============ DISPATCHER ============
+
+async def _claim(coll):
+    now = datetime.utcnow()
+    return await coll.find_one_and_update(
+        {'$or': [
+            {'status': 'pending', 'availableAt': {'$lte': now}},
+            {'status': 'processing', 'leaseUntil': {'$lt': now}},
+        ]},
+        {
+            '$set': {
+                'status': 'processing',
+                'leaseToken': uuid.uuid4().hex,
+                'leaseOwner': WORKER_ID,
+                'leaseUntil': now + timedelta(seconds=LEASE_SECONDS),
+            },
+            '$inc': {'attempts': 1},
+        },
+        sort=[('availableAt', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _deliver(coll, event: dict):
+    lease = {'_id': event['_id'], 'leaseToken': event['leaseToken']}
+    handler = _handlers.get(event['topic'])
+    try:
+        if handler is None:
+            raise RuntimeError(f"No handler registered for topic '{event['topic']}'")
+        await handler(event.get('payload') or {}, str(event['_id']))
+    except Exception as e:
+        attempts = event.get('attempts', 1)
+        failed = attempts >= MAX_ATTEMPTS
+        delay = RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+        print(f"[Outbox] {event['topic']} {event['_id']} failed (attempt {attempts}): {e}")
+        _stats['failed' if failed else 'retried'] += 1
+        await coll.update_one(lease, {'$set': {
+            'status': 'failed' if failed else 'pending',
+            'availableAt': datetime.utcnow() + timedelta(seconds=delay),
+            'leaseToken': None,
+            'leaseUntil': None,
+            'lastError': str(e),
+        }})
+        return
+
+    delivered_at = datetime.utcnow()
+    await coll.update_one(lease, {'$set': {
+        'status': 'delivered',
+        'leaseToken': None,
+        'leaseUntil': None,
+        'deliveredAt': delivered_at,
+    }})
+    latency = (delivered_at - event['createdAt']).total_seconds()
+    _stats['delivered'] += 1
+    _stats['latencyTotal'] += latency
+    _stats['latencyMax'] = max(_stats['latencyMax'], latency)
+
+
+async def _worker(number: int):
+    coll = get_db().get_collection(OUTBOX_COLLECTION)
+    wakeup = _state['wakeup']
+    while _state['running']:
+        try:
+            event = await _claim(coll)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Outbox] Worker {number} could not claim: {e}")
+            event = None
+
+        if event is not None:
+            try:
+                await _deliver(coll, event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Lease expires and the event is retried
+                print(f"[Outbox] Worker {number} could not record delivery: {e}")
+            continue
+
+        # Nothing due: sleep until something is enqueued here or the next poll.
+        # wait_for() can swallow a cancel that races the wakeup, hence the flag
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_outbox_dispatcher(workers: int = None):
+    if _state['tasks']:
+        return
+    _state['wakeup'] = asyncio.Event()
+    _state['running'] = True
+    _state['tasks'] = [asyncio.create_task(_worker(n)) for n in range(workers or WORKERS)]
+    print(f"[Outbox] Dispatcher started with {len(_state['tasks'])} worker(s)")
+
+
+async def stop_outbox_dispatcher():
+    tasks = _state['tasks']
+    _state['tasks'] = []
+    _state['running'] = False
+    _wake()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def drain_outbox(max_events: int = 1000) -> int:
+    """Deliver due events inline (tests, admin); returns how many were handled"""
+    coll = get_db().get_collection(OUTBOX_COLLECTION)
+    handled = 0
+    while handled < max_events:
+        event = await _claim(coll)
+        if event is None:
+            break
+        await _deliver(coll, event)
+        handled += 1
+    return handled
+
+
+async def requeue_failed(topic: str = None) -> int:
+    """Give parked events another round of attempts"""
+    query = {'status': 'failed'}
+    if topic:
+        query['topic'] = topic
+    result = await get_db().get_collection(OUTBOX_COLLECTION).update_many(query, {'$set': {
+        'status': 'pending', 'attempts': 0, 'availableAt': datetime.utcnow(),
+    }})
+    _wake()
+    return result.modified_count
+
+
+async def get_outbox_stats() -> dict:
+    coll = get_db().get_collection(OUTBOX_COLLECTION)
+    by_status = {}
+    async for row in coll.aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+        by_status[row['_id']] = row['count']
+    oldest = await coll.find_one(
+        {'status': {'$in': ['pending', 'processing']}},
+        {'createdAt': 1, 'topic': 1},
+        sort=[('createdAt', 1)]
+    )
+    delivered = _stats['delivered']
+    return {
+        'byStatus': by_status,
+        'lagSeconds': round((datetime.utcnow() - oldest['createdAt']).total_seconds(), 3) if oldest else 0,
+        'oldestPendingTopic': oldest.get('topic') if oldest else None,
+        'delivered': delivered,
+        'retried': _stats['retried'],
+        'failed': _stats['failed'],
+        'avgLatencySeconds': round(_stats['latencyTotal'] / delivered, 3) if delivered else None,
+        'maxLatencySeconds': round(_stats['latencyMax'], 3),
+        'workers': len(_state['tasks']),
+        'handlers': sorted(_handlers.keys()),
+        'worker': WORKER_ID,
+    }
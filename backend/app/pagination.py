@@ -0,0 +1,120 @@
+"""
+Pagination Module
+Keyset (cursor) pagination shared by the list endpoints.
+
+Pages are ordered by (sort field, _id). The response carries an opaque
+`nextCursor` that encodes the last document's sort value and _id; passing it
+back as `cursor` continues right after that document with an index range
+scan, so page 1000 costs the same as page 1. The old `skip` parameter still
+works (and also returns a cursor) for clients that have not moved over.
+
+Totals are optional (`total_mode`):
+- exact: count_documents() on the filter (the previous behaviour)
+- estimated: collection metadata when there is no filter, otherwise a count
+  capped at ESTIMATE_CAP; `totalIsEstimate` is set on the response
+- none: no count at all
+
+The sort field should hold one BSON type per collection (all datetimes or
+all ISO strings): range queries only match values of the cursor's type.
+"""
+
+import base64
+import os
+from bson import json_util
+from fastapi import HTTPException
+
+TOTAL_MODES = ('exact', 'estimated', 'none')
+ESTIMATE_CAP = int(os.getenv('PAGINATION_ESTIMATE_CAP', '10000'))
+
+
+def encode_cursor(doc: dict, sort_field: str, direction: int) -> str:
+    payload = json_util.dumps({'k': sort_field, 'd': direction, 'v': doc.get(sort_field), 'id': doc['_id']})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_field: str, direction: int) -> dict:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if payload.get('k') != sort_field or payload.get('d') != direction or 'id' not in payload:
+        raise HTTPException(status_code=400, detail="Cursor does not match this listing")
+    return payload
+
+
+def _after(sort_field: str, direction: int, value, last_id) -> dict:
+    """Filter for the documents that come after (value, last_id) in sort order"""
+    op = '$lt' if direction < 0 else '$gt'
+    same_value = {sort_field: value, '_id': {op: last_id}}
+    if value is None:
+        # null/missing sorts before every other value
+        if direction < 0:
+            return same_value
+        return {'$or': [same_value, {sort_field: {'$exists': True, '$ne': None}}]}
+    return {'$or': [{sort_field: {op: value}}, same_value]}
+
+
+async def _count(coll, query: dict, mode: str):
+    if mode == 'exact':
+        return await coll.count_documents(query), False
+    if mode == 'estimated':
+        if not query:
+            return await coll.estimated_document_count(), True
+        count = await coll.count_documents(query, limit=ESTIMATE_CAP)
+        return count, count >= ESTIMATE_CAP
+    return None, False
+
+
+async def paginate(
+    coll,
+    query: dict,
+    sort_field: str = 'createdAt',
+    direction: int = -1,
+    limit: int = 100,
+    cursor: str = None,
+    skip: int = 0,
+    total_mode: str = 'exact',
+    projection: dict = None,
+) -> dict:
+    """
+    One page of `coll` matching `query`.
+
+    Returns {'docs', 'nextCursor', 'hasMore', 'total', 'totalIsEstimate'};
+    `total` is None when total_mode is 'none'.
+    """
+    if total_mode not in TOTAL_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid total_mode. Must be one of: {list(TOTAL_MODES)}")
+
+    page_query = query
+    if cursor:
+        position = decode_cursor(cursor, sort_field, direction)
+        keyset = _after(sort_field, direction, position.get('v'), position['id'])
+        page_query = {'$and': [query, keyset]} if query else keyset
+
+    find = coll.find(page_query, projection).sort([(sort_field, direction), ('_id', direction)])
+    if skip and not cursor:
+        find = find.skip(skip)
+    # One extra document tells whether there is a next page
+    docs = await find.limit(limit + 1).to_list(limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    total, is_estimate = await _count(coll, query, total_mode)
+    return {
+        'docs': docs,
+        'nextCursor': encode_cursor(docs[-1], sort_field, direction) if has_more and docs else None,
+        'hasMore': has_more,
+        'total': total,
+        'totalIsEstimate': is_estimate,
+    }
+
+
+def page_meta(page: dict) -> dict:
+    """Response fields that describe the page, to merge next to `data`"""
+    return {
+        'total': page['total'],
+        'totalIsEstimate': page['totalIsEstimate'],
+        'nextCursor': page['nextCursor'],
+        'hasMore': page['hasMore'],
+    }
@@ -0,0 +1,207 @@
+"""
+Aggregation Pipelines Module
+Builds the MongoDB pipelines behind the weekly analytics so the daily series
+and the top-item trends are computed server-side; only the 7 daily rows and
+the top items come over the wire.
+"""
+
+from datetime import datetime, timedelta
+
+
+TOP_ITEMS_LIMIT = 10
+
+
+def _number(expr, default=0):
+    """Coerce a field to a double the way rollups.to_number does"""
+    return {
+        "$convert": {
+            "input": {
+                "$cond": [
+                    {"$eq": [{"$type": expr}, "string"]},
+                    {"$replaceAll": {"input": {"$trim": {"input": expr}}, "find": ",", "replacement": ""}},
+                    expr,
+                ]
+            },
+            "to": "double",
+            "onError": default,
+            "onNull": default,
+        }
+    }
+
+
+def _created_at_match(start: datetime, end: datetime) -> dict:
+    """
+    Pre-filter orders created in [start, end), reading created_at when
+    createdAt is missing (as rollups.get_order_datetime does). ISO strings
+    may carry a UTC offset, so their range is widened by a day; the exact
+    bounds are applied once the date is parsed (see _order_date).
+    """
+    string_range = {
+        "$gte": (start - timedelta(days=1)).isoformat(),
+        "$lt": (end + timedelta(days=1)).isoformat(),
+    }
+    return {"$or": [
+        {"createdAt": {"$gte": start, "$lt": end}},
+        {"createdAt": string_range},
+        {"createdAt": None, "created_at": {"$gte": start, "$lt": end}},
+        {"createdAt": None, "created_at": string_range},
+    ]}
+
+
+def _order_date():
+    """An order's creation time as a UTC date, like rollups.get_order_datetime"""
+    created = {"$ifNull": ["$createdAt", "$created_at"]}
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": [{"$type": created}, "date"]}, "then": created},
+            # Full ISO string, honouring a trailing Z or UTC offset
+            {"case": {"$eq": [{"$type": created}, "string"]}, "then": {"$dateFromString": {
+                "dateString": {"$trim": {"input": created}},
+                "onError": None,
+                "onNull": None,
+            }}},
+        ],
+        "default": None,
+    }}
+
+
+def weekly_rollups_pipeline(week_start: datetime, today: datetime) -> list:
+    """Weekly daily series and top items from the analytics_rollups buckets"""
+    prev_week_start = week_start - timedelta(days=7)
+    end = today + timedelta(days=1)
+    in_current_week = {"$gte": ["$bucket", week_start]}
+
+    return [
+        {"$match": {"kind": {"$in": ["day", "item"]}, "bucket": {"$gte": prev_week_start, "$lt": end}}},
+        {"$facet": {
+            "daily": [
+                {"$match": {"kind": "day", "bucket": {"$gte": week_start}}},
+                {"$project": {
+                    "_id": 0,
+                    "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$bucket"}},
+                    "orders": {"$ifNull": ["$orders", 0]},
+                    "revenue": {"$ifNull": ["$revenue", 0]},
+                }},
+            ],
+            "topItems": [
+                {"$match": {"kind": "item"}},
+                {"$group": {
+                    "_id": "$name",
+                    "count": {"$sum": {"$cond": [in_current_week, "$count", 0]}},
+                    "revenue": {"$sum": {"$cond": [in_current_week, "$revenue", 0]}},
+                    "prevCount": {"$sum": {"$cond": [in_current_week, 0, "$count"]}},
+                }},
+                {"$match": {"count": {"$gt": 0}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": TOP_ITEMS_LIMIT},
+            ],
+        }},
+    ]
+
+
+def _line_quantity(item: str):
+    """
+    Quantity of a line item like rollups.extract_items: a missing, null,
+    zero or empty quantity counts as 1, anything else (including "0") is
+    converted and truncated
+    """
+    return {"$toInt": {"$trunc": {"$let": {
+        "vars": {"raw": f"{item}.quantity"},
+        "in": {"$cond": [
+            {"$in": [{"$ifNull": ["$$raw", 0]}, [0, "", False]]},
+            1,
+            _number("$$raw", 1),
+        ]},
+    }}}}
+
+
+def _line_total(item: str):
+    return {"$multiply": [_number(f"{item}.price"), _line_quantity(item)]}
+
+
+def weekly_orders_pipeline(week_start: datetime, today: datetime) -> list:
+    """
+    Same result as weekly_rollups_pipeline, computed directly from orders.
+
+    Used before the rollups have been backfilled; tests/test_weekly_parity.py
+    checks it against the Python helpers in app.rollups.
+    """
+    prev_week_start = week_start - timedelta(days=7)
+    end = today + timedelta(days=1)
+    in_current_week = {"$gte": ["$orderDate", week_start]}
+
+    line_items = {"$filter": {
+        "input": {"$ifNull": ["$items", []]},
+        "as": "item",
+        "cond": {"$eq": [{"$type": "$$item"}, "object"]},
+    }}
+
+    return [
+        {"$match": _created_at_match(prev_week_start, end)},
+        {"$project": {
+            "orderDate": _order_date(),
+            "lineItems": line_items,
+            "total": 1,
+        }},
+        {"$match": {"orderDate": {"$gte": prev_week_start, "$lt": end}}},
+        {"$facet": {
+            "daily": [
+                {"$match": {"orderDate": {"$gte": week_start}}},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$orderDate"}},
+                    "orders": {"$sum": 1},
+                    "revenue": {"$sum": {"$cond": [
+                        {"$eq": [{"$ifNull": ["$total", None]}, None]},
+                        {"$sum": {"$map": {"input": "$lineItems", "as": "item", "in": _line_total("$$item")}}},
+                        _number("$total"),
+                    ]}},
+                }},
+                {"$project": {"_id": 0, "date": "$_id", "orders": 1, "revenue": 1}},
+            ],
+            "topItems": [
+                {"$unwind": "$lineItems"},
+                {"$group": {
+                    "_id": {"$toString": {"$ifNull": ["$lineItems.name", "Item"]}},
+                    "count": {"$sum": {"$cond": [in_current_week, _line_quantity("$lineItems"), 0]}},
+                    "revenue": {"$sum": {"$cond": [in_current_week, _line_total("$lineItems"), 0]}},
+                    "prevCount": {"$sum": {"$cond": [in_current_week, 0, _line_quantity("$lineItems")]}},
+                }},
+                {"$match": {"count": {"$gt": 0}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": TOP_ITEMS_LIMIT},
+            ],
+        }},
+    ]
+
+
+def shape_weekly_result(week_start: datetime, today: datetime, facet: dict) -> dict:
+    """Turn the $facet output into the /analytics/weekly response"""
+    daily_buckets = {}
+    for offset in range(7):
+        key = (week_start + timedelta(days=offset)).strftime("%Y-%m-%d")
+        daily_buckets[key] = {"date": key, "orders": 0, "revenue": 0.0}
+
+    for row in facet.get("daily", []):
+        if row["date"] in daily_buckets:
+            daily_buckets[row["date"]]["orders"] += row.get("orders", 0)
+            daily_buckets[row["date"]]["revenue"] += row.get("revenue", 0)
+
+    def trend(curr_count, prev):
+        if not prev:
+            return 0
+        return round(((curr_count - prev) / prev) * 100)
+
+    return {
+        "startDate": week_start.isoformat()[:10],
+        "endDate": today.isoformat()[:10],
+        "daily": [
+            {"date": row["date"], "orders": row["orders"], "revenue": round(row["revenue"], 2)}
+            for row in [daily_buckets[k] for k in sorted(daily_buckets.keys())]
+        ],
+        "topItems": [{
+            "name": row["_id"],
+            "count": row["count"],
+            "revenue": round(row["revenue"], 2),
+            "trend": trend(row["count"], row.get("prevCount", 0)),
+        } for row in facet.get("topItems", [])],
+    }
@@ -0,0 +1,178 @@
+"""
+Prep Time Metrics Module
+Kitchen stage durations recorded when an order changes status, kept as
+compact histograms so /kitchen/stats can report percentiles without
+reading orders.
+
+Stages (seconds between the two status changes):
+- wait:   placed → preparing
+- prep:   preparing → ready
+- pickup: ready → served
+- ticket: placed → ready (order created to ready)
+
+Each duration is added to one histogram per hour, stage and dimension
+('all', 'station:<station>', 'item:<name>') in `prep_time_histograms`.
+A histogram is a set of log-spaced buckets (each HISTOGRAM_GROWTH times
+wider than the previous), so a percentile read from it is within about
+±10% of the exact value, and a document stays a few hundred bytes however
+many orders it counts. Station and item histograms use the order's
+durations (the kitchen moves whole orders between statuses).
+
+A window of N hours reads N documents per stage and dimension.
+"""
+
+import math
+import os
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from .db import get_db
+from .indexes import declare_index
+from .rollups import parse_datetime
+
+HISTOGRAMS_COLLECTION = 'prep_time_histograms'
+RETENTION_DAYS = int(os.getenv('PREP_METRICS_RETENTION_DAYS', '30'))
+
+HISTOGRAM_GROWTH = 1.2
+# Durations above this are kept in the last bucket (orders left open overnight)
+MAX_SECONDS = 6 * 3600
+
+STAGES = {
+    ('placed', 'preparing'): 'wait',
+    ('preparing', 'ready'): 'prep',
+    ('ready', 'served'): 'pickup',
+}
+TICKET_STAGE = 'ticket'
+STAGE_NAMES = ['wait', 'prep', 'pickup', TICKET_STAGE]
+PERCENTILES = (50, 90, 99)
+
+declare_index(HISTOGRAMS_COLLECTION, [('stage', 1), ('dim', 1), ('hour', 1)])
+declare_index(HISTOGRAMS_COLLECTION, [('hour', 1)], name='hour_ttl', expireAfterSeconds=RETENTION_DAYS * 86400)
+
+
+def _bucket(seconds: float) -> int:
+    """Histogram bucket of a duration; bucket i holds [GROWTH^i, GROWTH^(i+1)) seconds"""
+    seconds = min(max(seconds, 1.0), MAX_SECONDS)
+    return int(math.log(seconds) / math.log(HISTOGRAM_GROWTH))
+
+
+def _bucket_value(index: int) -> float:
+    """Representative duration of a bucket (its geometric midpoint)"""
+    return HISTOGRAM_GROWTH ** (index + 0.5)
+
+
+def _key(value) -> str:
+    return str(value).replace('.', '_').replace('$', '_').strip() or 'unknown'
+
+
+def dimension(kind: str, value) -> str:
+    """Histogram dimension name, e.g. dimension('station', 'Grill') -> 'station:Grill'"""
+    return f"{kind}:{_key(value)}"
+
+
+def order_dimensions(order: dict) -> list:
+    """Histogram dimensions an order's durations are recorded under"""
+    dims = {'all'}
+    for item in order.get('items') or []:
+        if not isinstance(item, dict):
+            continue
+        if item.get('name'):
+            dims.add(dimension('item', item['name']))
+        station = item.get('station') or item.get('category')
+        if station:
+            dims.add(dimension('station', station))
+    return sorted(dims)
+
+
+def _hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def stage_durations(order: dict, previous_status: str, status: str, now: datetime) -> dict:
+    """{stage: seconds} completed by moving `order` from previous_status to status"""
+    durations = {}
+    stage = STAGES.get((previous_status, status))
+    entered = parse_datetime(order.get('statusUpdatedAt')) or parse_datetime(order.get('createdAt'))
+    if stage and entered and now >= entered:
+        durations[stage] = (now - entered).total_seconds()
+    created = parse_datetime(order.get('createdAt'))
+    if status == 'ready' and previous_status != 'ready' and created and now >= created:
+        durations[TICKET_STAGE] = (now - created).total_seconds()
+    return durations
+
+
+async def record_transition_time(order: dict, previous_status: str, status: str, now: datetime = None):
+    """Add the stage durations of a status change to this hour's histograms; never raises"""
+    now = now or datetime.utcnow()
+    durations = stage_durations(order, previous_status, status, now)
+    if not durations:
+        return
+    hour = _hour(now)
+    operations = []
+    for stage, seconds in durations.items():
+        for dim in order_dimensions(order):
+            operations.append(UpdateOne(
+                {'_id': f"{hour.strftime('%Y%m%d%H')}|{stage}|{dim}"},
+                {
+                    '$inc': {'count': 1, 'sum': seconds, f"buckets.{_bucket(seconds)}": 1},
+                    '$min': {'min': seconds},
+                    '$max': {'max': seconds},
+                    '$setOnInsert': {'hour': hour, 'stage': stage, 'dim': dim},
+                },
+                upsert=True,
+            ))
+    try:
+        await get_db().get_collection(HISTOGRAMS_COLLECTION).bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"[PrepMetrics] Could not record durations for order {order.get('_id')}: {e}")
+
+
+# ============ READERS ============
+
+def _summarise(docs: list) -> dict:
+    """Merge histograms and read count, mean and percentiles (seconds)"""
+    counts = {}
+    total = 0
+    duration_sum = 0.0
+    low, high = None, None
+    for doc in docs:
+        total += doc.get('count', 0)
+        duration_sum += doc.get('sum', 0)
+        low = doc['min'] if low is None else min(low, doc['min'])
+        high = doc['max'] if high is None else max(high, doc['max'])
+        for index, count in (doc.get('buckets') or {}).items():
+            counts[int(index)] = counts.get(int(index), 0) + count
+
+    summary = {
+        'count': total,
+        'mean': None,
+        'min': round(low, 1) if low is not None else None,
+        'max': round(high, 1) if high is not None else None,
+    }
+    summary.update({f"p{p}": None for p in PERCENTILES})
+    if not total:
+        return summary
+    summary['mean'] = round(duration_sum / total, 1)
+
+    ordered = sorted(counts.items())
+    for p in PERCENTILES:
+        rank = math.ceil(total * p / 100)
+        seen = 0
+        for index, count in ordered:
+            seen += count
+            if seen >= rank:
+                # Clamp to what was actually observed
+                summary[f"p{p}"] = round(min(max(_bucket_value(index), low), high), 1)
+                break
+    return summary
+
+
+async def get_prep_time_stats(window_hours: int = 1, dim: str = 'all') -> dict:
+    """Per-stage duration summary for the last `window_hours` hours (including this one)"""
+    since = _hour(datetime.utcnow()) - timedelta(hours=max(window_hours, 1) - 1)
+    docs = await get_db().get_collection(HISTOGRAMS_COLLECTION).find(
+        {'stage': {'$in': STAGE_NAMES}, 'dim': dim, 'hour': {'$gte': since}}
+    ).to_list(None)
+    by_stage = {stage: [] for stage in STAGE_NAMES}
+    for doc in docs:
+        by_stage[doc['stage']].append(doc)
+    return {stage: _summarise(stage_docs) for stage, stage_docs in by_stage.items()}
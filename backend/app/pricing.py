@@ -0,0 +1,345 @@
+"""
+Pricing Module
+Prices orders and bills (subtotal, charges, tax lines, discounts, grand
+total) from an in-process copy of the pricing configuration, so pricing a
+bill reads nothing from the database.
+
+Sources, loaded together and compiled into evaluators:
+- tax_config 'main_tax_config' (Settings → Tax & Service): GST (split into
+  CGST/SGST when those rates are set), service charge on dine-in orders,
+  flat packaging charge on takeaway/delivery orders. Without a saved
+  configuration bills get the plain 5% GST they always had.
+- settings 'tax_settings' (billing): roundingEnabled rounds the grand total
+  to the rupee with a round-off line.
+- discount_rules: applied only when the order/bill names them in
+  discountRuleIds (they are cashier-selected, not automatic); each rule
+  has a minimum order amount and an optional cap.
+- membership_plans: an active plan's discountPercent applies to orders
+  carrying its membershipTier.
+When several discounts apply, the customer gets the largest one.
+
+Writers of those collections call invalidate_pricing(), which reloads this
+worker and bumps the shared 'pricing' version in cache_versions; other
+workers compare versions every PRICING_CHECK_SECONDS (0: on every call).
+Every breakdown records the pricingVersion it was computed with.
+reprice_open_bills() re-prices unpaid bills in bulk after a change.
+"""
+
+import asyncio
+import math
+import os
+import time
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from .db import get_db
+from .catalog_cache import VERSIONS_COLLECTION
+from .rollups import normalize_order_type
+
+PRICING_VERSION_ID = 'pricing'
+CHECK_SECONDS = float(os.getenv('PRICING_CHECK_SECONDS', '5'))
+REPRICE_BATCH_SIZE = int(os.getenv('PRICING_REPRICE_BATCH', '500'))
+
+# Applied when no tax configuration has been saved
+LEGACY_TAX_CONFIG = {'gstEnabled': True, 'gstRate': 5.0}
+PACKAGED_ORDER_TYPES = {'takeaway', 'delivery'}
+# Collections the engine is compiled from
+PRICING_COLLECTIONS = {'tax_config', 'settings', 'discount_rules', 'membership_plans'}
+ORDER_TYPE_FIELDS = ('type', 'orderType', 'order_type')
+
+_state = {'engine': None, 'version': None, 'checkedAt': 0.0, 'generation': 0}
+_stats = {'loads': 0, 'versionChecks': 0, 'invalidations': 0, 'priced': 0}
+_lock = asyncio.Lock()
+
+
+def _money(value: float) -> float:
+    return round(value + 1e-9, 2)
+
+
+def _number(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def order_subtotal(doc: dict) -> float:
+    """Pre-tax amount of an order or bill"""
+    for field in ('subtotal', 'total'):
+        if doc.get(field) is not None:
+            return _number(doc[field])
+    return sum(
+        _number(item.get('price')) * _number(item.get('quantity'), 1)
+        for item in doc.get('items') or [] if isinstance(item, dict)
+    )
+
+
+# ============ COMPILERS ============
+
+def _compile_taxes(config: dict):
+    """Tax lines as (name, rate) pairs"""
+    if not config.get('gstEnabled', True):
+        return []
+    cgst = _number(config.get('cgstRate'))
+    sgst = _number(config.get('sgstRate'))
+    if cgst or sgst:
+        return [(name, rate) for name, rate in (('CGST', cgst), ('SGST', sgst)) if rate]
+    gst = _number(config.get('gstRate'))
+    return [('GST', gst)] if gst else []
+
+
+def _compile_charges(config: dict):
+    """Charge evaluators: (order type, subtotal) -> line or None"""
+    charges = []
+    if config.get('serviceChargeEnabled'):
+        rate = _number(config.get('serviceChargeRate'))
+        if rate:
+            charges.append(lambda order_type, subtotal: {
+                'name': 'Service Charge', 'rate': rate, 'amount': _money(subtotal * rate / 100)
+            } if order_type == 'dine-in' else None)
+    if config.get('packagingChargeEnabled'):
+        amount = _number(config.get('packagingChargeRate'))
+        if amount:
+            charges.append(lambda order_type, subtotal: {
+                'name': 'Packaging Charge', 'amount': _money(amount)
+            } if order_type in PACKAGED_ORDER_TYPES else None)
+    return charges
+
+
+def _compile_discount(name: str, kind: str, value: float, min_amount: float, cap: float):
+    """Discount evaluator: subtotal -> amount (0 when not applicable)"""
+    def evaluate(subtotal: float) -> float:
+        if subtotal <= 0 or subtotal < min_amount:
+            return 0.0
+        amount = subtotal * value / 100 if kind == 'percentage' else value
+        if cap > 0:
+            amount = min(amount, cap)
+        return _money(min(max(amount, 0.0), subtotal))
+    evaluate.label = name
+    return evaluate
+
+
+def _compile_rules(rules: list) -> dict:
+    compiled = {}
+    for rule in rules:
+        if not rule.get('enabled', True):
+            continue
+        compiled[str(rule['_id'])] = _compile_discount(
+            rule.get('name') or 'Discount',
+            rule.get('type', 'percentage'),
+            _number(rule.get('value')),
+            _number(rule.get('minOrderAmount')),
+            _number(rule.get('maxDiscount')),
+        )
+    return compiled
+
+
+def _compile_memberships(plans: list) -> dict:
+    compiled = {}
+    for plan in plans:
+        tier = str(plan.get('tier') or '').strip().lower()
+        percent = _number(plan.get('discountPercent'))
+        if not tier or not percent or str(plan.get('status', 'active')).lower() != 'active':
+            continue
+        compiled[tier] = _compile_discount(
+            f"{tier.title()} Membership", 'percentage', percent,
+            _number(plan.get('minOrderAmount')), _number(plan.get('maxDiscount')),
+        )
+    return compiled
+
+
+class PricingEngine:
+    """Compiled pricing configuration; price() is pure and never touches the database"""
+
+    def __init__(self, version, tax_config: dict, tax_settings: dict, rules: list, plans: list):
+        self.version = version or 0
+        self.taxes = _compile_taxes(tax_config)
+        self.charges = _compile_charges(tax_config)
+        self.rules = _compile_rules(rules)
+        self.memberships = _compile_memberships(plans)
+        self.rounding = bool(tax_settings.get('roundingEnabled', False))
+        self.loaded_at = datetime.utcnow()
+
+    def price(self, order: dict, discount_rule_ids=None, membership_tier: str = None) -> dict:
+        """
+        Price breakdown of an order or bill.
+
+        discount_rule_ids / membership_tier default to the document's
+        discountRuleIds / membershipTier.
+        """
+        subtotal = _money(order_subtotal(order))
+        rule_ids = order.get('discountRuleIds') if discount_rule_ids is None else discount_rule_ids
+        tier = str(membership_tier or order.get('membershipTier') or '').strip().lower()
+
+        candidates = []
+        for rule_id in rule_ids or []:
+            evaluate = self.rules.get(str(rule_id))
+            if evaluate:
+                candidates.append({'source': 'rule', 'id': str(rule_id), 'name': evaluate.label,
+                                   'amount': evaluate(subtotal)})
+        if tier in self.memberships:
+            evaluate = self.memberships[tier]
+            candidates.append({'source': 'membership', 'id': tier, 'name': evaluate.label,
+                               'amount': evaluate(subtotal)})
+        best = max((c for c in candidates if c['amount'] > 0), key=lambda c: c['amount'], default=None)
+        discounts = [best] if best else []
+        discount_amount = best['amount'] if best else 0.0
+
+        net = _money(subtotal - discount_amount)
+        # Bills default to dine-in, like billing_entry_for_order
+        order_type = normalize_order_type(order) if any(order.get(f) for f in ORDER_TYPE_FIELDS) else 'dine-in'
+        charges = [line for line in (charge(order_type, net) for charge in self.charges) if line]
+        taxable = _money(net + sum(line['amount'] for line in charges))
+        tax_lines = [{'name': name, 'rate': rate, 'amount': _money(taxable * rate / 100)}
+                     for name, rate in self.taxes]
+        tax_amount = _money(sum(line['amount'] for line in tax_lines))
+
+        total = _money(taxable + tax_amount)
+        grand_total = float(math.floor(total + 0.5)) if self.rounding else total
+        _stats['priced'] += 1
+        return {
+            'subtotal': subtotal,
+            'discounts': discounts,
+            'discountAmount': discount_amount,
+            'charges': charges,
+            'taxableAmount': taxable,
+            'taxLines': tax_lines,
+            'taxRate': _money(sum(rate for _, rate in self.taxes)),
+            'taxAmount': tax_amount,
+            'roundOff': _money(grand_total - total),
+            'grandTotal': grand_total,
+            'pricingVersion': self.version,
+        }
+
+    def describe(self) -> dict:
+        return {
+            'version': self.version,
+            'loadedAt': self.loaded_at.isoformat() + 'Z',
+            'taxes': [{'name': name, 'rate': rate} for name, rate in self.taxes],
+            'charges': len(self.charges),
+            'discountRules': {rule_id: evaluate.label for rule_id, evaluate in self.rules.items()},
+            'membershipTiers': sorted(self.memberships),
+            'rounding': self.rounding,
+        }
+
+
+# ============ LOADING ============
+
+async def _remote_version(db):
+    doc = await db.get_collection(VERSIONS_COLLECTION).find_one({'_id': PRICING_VERSION_ID})
+    return doc.get('value') if doc else None
+
+
+async def _load(db, version) -> PricingEngine:
+    tax_config, tax_settings, rules, plans = await asyncio.gather(
+        db.get_collection('tax_config').find_one({'_id': 'main_tax_config'}),
+        db.settings.find_one({'key': 'tax_settings'}),
+        db.get_collection('discount_rules').find().to_list(None),
+        db.membership_plans.find().to_list(None),
+    )
+    _stats['loads'] += 1
+    return PricingEngine(
+        version,
+        tax_config or LEGACY_TAX_CONFIG,
+        (tax_settings or {}).get('value') or {},
+        rules,
+        plans,
+    )
+
+
+async def get_pricing_engine() -> PricingEngine:
+    """The current engine; reloads when this or another worker changed the configuration"""
+    now = time.monotonic()
+    if _state['engine'] is not None and now - _state['checkedAt'] < CHECK_SECONDS:
+        return _state['engine']
+
+    async with _lock:
+        db = get_db()
+        now = time.monotonic()
+        engine = _state['engine']
+        if engine is not None and now - _state['checkedAt'] < CHECK_SECONDS:
+            return engine
+        _stats['versionChecks'] += 1
+        version = await _remote_version(db)
+        _state['checkedAt'] = now
+        if engine is not None and version == _state['version']:
+            return engine
+        while True:
+            generation = _state['generation']
+            engine = await _load(db, version)
+            # Invalidated while loading: the data may predate the write, read again
+            if generation == _state['generation']:
+                break
+            version = await _remote_version(db)
+        _state['engine'] = engine
+        _state['version'] = version
+        return engine
+
+
+async def invalidate_pricing():
+    """Reload the pricing configuration here and in every other worker"""
+    _stats['invalidations'] += 1
+    _state['generation'] += 1
+    _state['engine'] = None
+    try:
+        await get_db().get_collection(VERSIONS_COLLECTION).update_one(
+            {'_id': PRICING_VERSION_ID},
+            {'$inc': {'value': 1}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"[Pricing] Could not bump pricing version: {e}")
+
+
+# ============ RE-PRICING ============
+
+REPRICE_FIELDS = ['subtotal', 'discounts', 'discountAmount', 'charges', 'taxableAmount',
+                  'taxLines', 'taxRate', 'taxAmount', 'roundOff', 'grandTotal', 'pricingVersion']
+
+
+async def reprice_open_bills(billing_ids: list = None) -> dict:
+    """
+    Re-price unpaid bills (status pending_payment) with the current
+    configuration, optionally only the given ones. Bills already priced
+    the same way are not written; bills paid meanwhile are skipped.
+    """
+    db = get_db()
+    engine = await get_pricing_engine()
+    query = {'status': 'pending_payment'}
+    if billing_ids is not None:
+        query['_id'] = {'$in': [ObjectId(b) for b in billing_ids if ObjectId.is_valid(b)]}
+
+    projection = {field: 1 for field in REPRICE_FIELDS + list(ORDER_TYPE_FIELDS) +
+                  ['items', 'membershipTier', 'discountRuleIds']}
+    result = {'matched': 0, 'repriced': 0, 'unchanged': 0, 'pricingVersion': engine.version}
+    now = datetime.utcnow().isoformat() + 'Z'
+    operations = []
+
+    async def flush():
+        if operations:
+            written = await db.billing.bulk_write(operations, ordered=False)
+            result['repriced'] += written.modified_count
+            operations.clear()
+
+    async for bill in db.billing.find(query, projection):
+        result['matched'] += 1
+        priced = engine.price(bill)
+        if all(bill.get(field) == priced[field] for field in REPRICE_FIELDS):
+            result['unchanged'] += 1
+            continue
+        operations.append(UpdateOne(
+            {'_id': bill['_id'], 'status': 'pending_payment'},
+            {'$set': {**priced, 'repricedAt': now}}
+        ))
+        if len(operations) >= REPRICE_BATCH_SIZE:
+            await flush()
+    await flush()
+    return result
+
+
+def get_pricing_stats() -> dict:
+    engine = _state['engine']
+    return {
+        **_stats,
+        'engine': engine.describe() if engine else None,
+    }
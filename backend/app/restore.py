@@ -0,0 +1,339 @@
+"""
+Restore Engine Module
+Restores a backup collection by collection while streaming its chunks:
+
+- documents are inserted in batches of RESTORE_BATCH_SIZE with ordered=False
+- up to RESTORE_CONCURRENCY collections are restored at the same time
+- mode 'direct' empties the live collection and loads into it (old behaviour)
+- mode 'staging' loads into a temporary collection, copies the live indexes
+  and swaps it in with renameCollection, so the live collection is never
+  empty or half-loaded while the restore runs
+
+Incremental backups are restored by replaying their chain: the full base is
+inserted, each incremental is applied as upserts, and documents missing from
+the last incremental's `_id` list are deleted.
+
+Each restore is a job in `restore_jobs` whose progress is updated after every
+batch and can be polled from the API.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from bson import ObjectId
+from pymongo import IndexModel, ReplaceOne
+from pymongo.errors import BulkWriteError
+from .db import get_db
+from .backups import is_chunked_backup, iter_backup_chunks
+from .status_counters import reconcile_counters
+from .audit_storage import migrate_legacy_audit_dates, rebuild_audit_stats
+from .pricing import PRICING_COLLECTIONS, invalidate_pricing
+from .coupons import invalidate_coupons, prepare_coupons
+
+RESTORE_JOBS_COLLECTION = 'restore_jobs'
+
+BATCH_SIZE = int(os.getenv('RESTORE_BATCH_SIZE', '1000'))
+CONCURRENCY = int(os.getenv('RESTORE_CONCURRENCY', '4'))
+RESTORE_MODES = ('direct', 'staging')
+
+# Keep references so running jobs are not garbage collected
+_running = set()
+
+
+def _staging_name(collection: str, job_id) -> str:
+    return f"{collection}__restore_{job_id}"
+
+
+def _legacy_id(doc: dict) -> dict:
+    """Inline backups stored ObjectIds as strings"""
+    if isinstance(doc.get('_id'), str) and ObjectId.is_valid(doc['_id']):
+        doc['_id'] = ObjectId(doc['_id'])
+    return doc
+
+
+def _backup_counts(backup: dict) -> dict:
+    if is_chunked_backup(backup):
+        return {c: m.get('count', 0) for c, m in (backup.get('manifest') or {}).items()}
+    data = backup.get('backupData')
+    if not data and backup.get('content'):
+        data = backup.get('content', {}).get('data')
+    return {c: len(docs) for c, docs in (data or {}).items()}
+
+
+def backup_collections(chain: list) -> dict:
+    """
+    {collection: documents to write} for a backup chain (a single full or
+    inline backup is a chain of one). Only collections in the base count.
+    """
+    counts = _backup_counts(chain[0])
+    for delta in chain[1:]:
+        for collection, count in _backup_counts(delta).items():
+            if collection in counts:
+                counts[collection] += count
+    return counts
+
+
+async def _iter_batches(backup: dict, collection: str, batch_size: int):
+    """Yield bounded lists of documents for one collection"""
+    if is_chunked_backup(backup):
+        async for docs in iter_backup_chunks(backup, collection):
+            for start in range(0, len(docs), batch_size):
+                yield docs[start:start + batch_size]
+        return
+
+    data = backup.get('backupData')
+    if not data and backup.get('content'):
+        data = backup.get('content', {}).get('data')
+    docs = (data or {}).get(collection) or []
+    for start in range(0, len(docs), batch_size):
+        yield [_legacy_id(dict(doc)) for doc in docs[start:start + batch_size]]
+
+
+async def _copy_indexes(source, target):
+    """Recreate the live collection's indexes on the staging collection"""
+    try:
+        info = await source.index_information()
+    except Exception:
+        return
+    models = []
+    for name, spec in info.items():
+        if name == '_id_':
+            continue
+        options = {k: v for k, v in spec.items() if k not in ('key', 'v', 'ns')}
+        models.append(IndexModel(spec['key'], name=name, **options))
+    if models:
+        await target.create_indexes(models)
+
+
+async def _apply_upserts(target, batch: list) -> tuple:
+    try:
+        await target.bulk_write([ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in batch], ordered=False)
+        return len(batch), []
+    except BulkWriteError as e:
+        write_errors = e.details.get('writeErrors', [])
+        return len(batch) - len(write_errors), [err.get('errmsg') for err in write_errors[:5]]
+
+
+async def _delete_missing(target, backup: dict, collection: str, job_id, batch_size: int) -> int:
+    """Delete documents whose _id is not in the incremental backup's _id list"""
+    db = get_db()
+    keep = db.get_collection(f"{collection}__keep_{job_id}")
+    await keep.drop()
+    try:
+        async for ids in iter_backup_chunks(backup, collection, part='ids'):
+            for start in range(0, len(ids), batch_size):
+                await keep.insert_many(ids[start:start + batch_size], ordered=False)
+
+        removed = 0
+        pending = []
+        # The anti-join runs on the server; only the ids to delete come back
+        async for doc in target.aggregate([
+            {'$project': {'_id': 1}},
+            {'$lookup': {'from': keep.name, 'localField': '_id', 'foreignField': '_id', 'as': 'kept'}},
+            {'$match': {'kept': {'$size': 0}}},
+            {'$project': {'_id': 1}},
+        ]):
+            pending.append(doc['_id'])
+            if len(pending) >= batch_size:
+                removed += (await target.delete_many({'_id': {'$in': pending}})).deleted_count
+                pending = []
+        if pending:
+            removed += (await target.delete_many({'_id': {'$in': pending}})).deleted_count
+        return removed
+    finally:
+        await keep.drop()
+
+
+async def _restore_collection(job_id, chain: list, collection: str, expected: int, mode: str, batch_size: int):
+    db = get_db()
+    jobs = db.get_collection(RESTORE_JOBS_COLLECTION)
+    prefix = f"collections.{collection}"
+    live = db.get_collection(collection)
+
+    if mode == 'staging':
+        target = db.get_collection(_staging_name(collection, job_id))
+        await target.drop()
+    else:
+        target = live
+        await live.delete_many({})
+
+    await jobs.update_one({'_id': job_id}, {'$set': {f"{prefix}.status": 'running'}})
+
+    restored = 0
+    errors = []
+    for position, backup in enumerate(chain):
+        async for batch in _iter_batches(backup, collection, batch_size):
+            if position == 0:
+                try:
+                    result = await target.insert_many(batch, ordered=False)
+                    inserted = len(result.inserted_ids)
+                except BulkWriteError as e:
+                    # ordered=False: everything but the failing documents went in
+                    inserted = e.details.get('nInserted', 0)
+                    errors.extend(err.get('errmsg') for err in e.details.get('writeErrors', [])[:5])
+            else:
+                inserted, batch_errors = await _apply_upserts(target, batch)
+                errors.extend(batch_errors)
+            restored += inserted
+            await jobs.update_one({'_id': job_id}, {'$inc': {
+                f"{prefix}.restored": inserted,
+                'restoredDocuments': inserted,
+            }})
+
+    last = chain[-1]
+    if len(chain) > 1 and (last.get('manifest') or {}).get(collection, {}).get('ids'):
+        removed = await _delete_missing(target, last, collection, job_id, batch_size)
+        await jobs.update_one({'_id': job_id}, {'$set': {f"{prefix}.deleted": removed}})
+
+    if mode == 'staging':
+        if restored:
+            await _copy_indexes(live, target)
+            await target.rename(collection, dropTarget=True)
+        else:
+            # Nothing could be loaded: keep the live collection as it is
+            await target.drop()
+
+    status = 'completed' if restored == expected and not errors else 'partial'
+    await jobs.update_one({'_id': job_id}, {'$set': {
+        f"{prefix}.status": status,
+        f"{prefix}.errors": errors[:20] or None,
+    }})
+    return restored, errors
+
+
+async def run_restore_job(job_id, chain: list, mode: str = 'direct', concurrency: int = None,
+                          batch_size: int = None, actor: dict = None) -> dict:
+    """Restore every collection of a backup chain and record the outcome on the job"""
+    from .audit import log_audit
+
+    db = get_db()
+    jobs = db.get_collection(RESTORE_JOBS_COLLECTION)
+    semaphore = asyncio.Semaphore(max(1, concurrency or CONCURRENCY))
+    expected = backup_collections(chain)
+    backup = chain[-1]
+
+    async def restore_one(collection: str, count: int):
+        async with semaphore:
+            try:
+                restored, errors = await _restore_collection(
+                    job_id, chain, collection, count, mode, batch_size or BATCH_SIZE
+                )
+                return collection, restored, [f"{collection}: {e}" for e in errors]
+            except Exception as e:
+                print(f"[Restore] Error restoring {collection}: {e}")
+                await jobs.update_one({'_id': job_id}, {'$set': {
+                    f"collections.{collection}.status": 'failed',
+                    f"collections.{collection}.errors": [str(e)],
+                }})
+                if mode == 'staging':
+                    await db.get_collection(_staging_name(collection, job_id)).drop()
+                return collection, 0, [f"{collection}: {str(e)}"]
+
+    results = await asyncio.gather(*(
+        restore_one(collection, count) for collection, count in expected.items() if count
+    ))
+
+    collections_restored = [c for c, restored, _ in results if restored]
+    total_restored = sum(restored for _, restored, _ in results)
+    errors = [e for _, _, errs in results for e in errs]
+    await jobs.update_one({'_id': job_id}, {'$set': {
+        'status': 'completed' if not errors else 'partial',
+        'finishedAt': datetime.utcnow().isoformat(),
+        'errors': errors or None,
+    }})
+
+    # Restored collections bypass the write paths that maintain the counters
+    try:
+        await reconcile_counters()
+    except Exception as e:
+        print(f"[Restore] Could not reconcile status counters: {e}")
+    if 'audit_logs' in collections_restored:
+        try:
+            await migrate_legacy_audit_dates()
+            await rebuild_audit_stats()
+        except Exception as e:
+            print(f"[Restore] Could not rebuild audit stats: {e}")
+    if PRICING_COLLECTIONS & set(collections_restored):
+        await invalidate_pricing()
+    if 'coupons' in collections_restored:
+        try:
+            await prepare_coupons()
+        except Exception as e:
+            print(f"[Restore] Could not add coupon validity dates: {e}")
+        await invalidate_coupons()
+
+    actor = actor or {}
+    await log_audit(
+        action='restore_backup',
+        resource='backup',
+        resourceId=str(backup['_id']),
+        userId=actor.get('userId'),
+        userName=actor.get('userName'),
+        details={
+            'backup_name': backup.get('name'),
+            'jobId': str(job_id),
+            'mode': mode,
+            'chain': [str(b['_id']) for b in chain],
+            'collections_restored': collections_restored,
+            'total_documents': total_restored,
+            'errors': errors
+        },
+        ip=actor.get('ip')
+    )
+    return {
+        'jobId': str(job_id),
+        'collectionsRestored': collections_restored,
+        'totalRestored': total_restored,
+        'errors': errors,
+    }
+
+
+async def create_restore_job(chain: list, mode: str = 'direct', concurrency: int = None) -> ObjectId:
+    db = get_db()
+    counts = backup_collections(chain)
+    backup = chain[-1]
+    job = {
+        'backupId': str(backup['_id']),
+        'backupName': backup.get('name'),
+        'chain': [str(b['_id']) for b in chain],
+        'mode': mode,
+        'concurrency': concurrency or CONCURRENCY,
+        'status': 'running',
+        'totalDocuments': sum(counts.values()),
+        'restoredDocuments': 0,
+        'collections': {
+            c: {'status': 'pending' if n else 'skipped', 'total': n, 'restored': 0}
+            for c, n in counts.items()
+        },
+        'startedAt': datetime.utcnow().isoformat(),
+    }
+    res = await db.get_collection(RESTORE_JOBS_COLLECTION).insert_one(job)
+    return res.inserted_id
+
+
+def start_restore_job(job_id, chain: list, **kwargs):
+    """Run a restore job in the background"""
+    async def runner():
+        try:
+            await run_restore_job(job_id, chain, **kwargs)
+        except Exception as e:
+            print(f"[Restore] Job {job_id} failed: {e}")
+            await get_db().get_collection(RESTORE_JOBS_COLLECTION).update_one({'_id': job_id}, {'$set': {
+                'status': 'failed', 'error': str(e), 'finishedAt': datetime.utcnow().isoformat(),
+            }})
+
+    task = asyncio.create_task(runner())
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def get_restore_job(job_id: str):
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = await get_db().get_collection(RESTORE_JOBS_COLLECTION).find_one({'_id': ObjectId(job_id)})
+    if job:
+        job['_id'] = str(job['_id'])
+        total = job.get('totalDocuments') or 0
+        job['progress'] = round(job.get('restoredDocuments', 0) / total * 100, 1) if total else 100.0
+    return job
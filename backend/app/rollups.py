@@ -0,0 +1,420 @@
+"""
+Analytics Rollups Module
+Maintains pre-aggregated hourly/daily order buckets so the analytics
+endpoints read O(days) rollup documents instead of scanning `orders`.
+
+Buckets live in the `analytics_rollups` collection:
+- day:  one document per calendar day (orders, revenue, per-status/type counts)
+- hour: one document per hour (same counters, used by /analytics/daily)
+- item: one document per day and menu item name (quantity and revenue)
+
+Buckets are keyed by the order's creation time and are updated with `$inc`
+as orders are created, edited and change status. To rebuild them from history:
+
+Usage:
+    cd backend
+    python -m app.rollups
+
+A rebuild replaces each bucket with its recomputed totals, stamped with the
+rebuild's id, and then drops the older buckets it did not rewrite. Live
+`$inc` updates are not paused meanwhile: one landing between the order scan
+and the replace of its bucket is overwritten (or, for an order created after
+the scan, missing). Rebuild while orders are quiet (e.g. after closing) or
+run it a second time; rebuilds themselves are serialized per worker.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from pymongo import UpdateOne, ReplaceOne
+from .db import get_db
+from .indexes import declare_index
+
+ROLLUPS_COLLECTION = 'analytics_rollups'
+
+declare_index(ROLLUPS_COLLECTION, [("kind", 1), ("bucket", 1)])
+
+ACTIVE_STATUSES = ["pending", "confirmed", "preparing", "ready"]
+
+# Fields whose change moves an order's contribution between or within buckets
+ROLLUP_FIELDS = ("createdAt", "created_at", "status", "items", "total", "type", "orderType", "order_type")
+
+_rebuild_lock = asyncio.Lock()
+
+
+# -------------------------
+# Order Helpers
+# -------------------------
+
+def to_number(value, default: float = 0.0) -> float:
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        cleaned = value.replace(",", "").strip()
+        if cleaned == "":
+            return default
+        try:
+            return float(cleaned)
+        except ValueError:
+            return default
+    return default
+
+
+def parse_datetime(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    if isinstance(value, str):
+        text = value.strip()
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        try:
+            parsed = datetime.fromisoformat(text)
+            if parsed.tzinfo:
+                return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            return parsed
+        except ValueError:
+            return None
+    return None
+
+
+def normalize_status(value) -> str:
+    return str(value or "").strip().lower()
+
+
+def normalize_order_type(order: dict) -> str:
+    raw = str(order.get("type") or order.get("orderType") or order.get("order_type") or "unknown").strip().lower()
+    if raw in {"dinein", "dine-in", "dine_in"}:
+        return "dine-in"
+    if raw in {"pickup", "take away", "take-away"}:
+        return "takeaway"
+    return raw or "unknown"
+
+
+def extract_items(order: dict):
+    items = []
+    raw_items = order.get("items") or []
+
+    for raw in raw_items:
+        if isinstance(raw, dict):
+            quantity = int(to_number(raw.get("quantity") or 1, 1))
+            name = raw.get("name") or "Item"
+            price = to_number(raw.get("price"), 0)
+            items.append({
+                "name": name,
+                "quantity": quantity,
+                "price": price
+            })
+    return items
+
+
+def get_order_datetime(order: dict):
+    """Creation time of an order as a naive UTC datetime"""
+    return parse_datetime(order.get("createdAt") or order.get("created_at"))
+
+
+def get_order_total(order: dict) -> float:
+    """Order total, falling back to the sum of its line items"""
+    if order.get("total") is not None:
+        return to_number(order.get("total"), 0)
+    return sum(item["price"] * item["quantity"] for item in extract_items(order))
+
+
+def get_items_revenue(order: dict) -> float:
+    return sum(item["price"] * item["quantity"] for item in extract_items(order))
+
+
+# -------------------------
+# Bucket Keys
+# -------------------------
+
+def _field_key(value) -> str:
+    """Make a value safe to use as a sub-document key"""
+    key = str(value or "").replace(".", "_").replace("$", "_").strip()
+    return key or "unknown"
+
+
+def day_start(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def hour_start(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket_id(dt: datetime) -> str:
+    return f"day:{dt.strftime('%Y-%m-%d')}"
+
+
+def hour_bucket_id(dt: datetime) -> str:
+    return f"hour:{dt.strftime('%Y-%m-%dT%H')}"
+
+
+def item_bucket_id(dt: datetime, name: str) -> str:
+    return f"item:{dt.strftime('%Y-%m-%d')}:{name}"
+
+
+# -------------------------
+# Live Updates
+# -------------------------
+
+def _creation_increments(order: dict, sign: int = 1) -> dict:
+    status = normalize_status(order.get("status"))
+    inc = {
+        "orders": sign,
+        "revenue": sign * get_order_total(order),
+        f"byStatus.{_field_key(status)}": sign,
+        f"byType.{_field_key(normalize_order_type(order))}": sign,
+    }
+    if status == "completed":
+        inc["completedRevenue"] = sign * get_items_revenue(order)
+    if status == "cancelled":
+        inc["cancelledRevenue"] = sign * get_order_total(order)
+    return inc
+
+
+def _creation_operations(order: dict, sign: int = 1) -> list:
+    """Bucket updates adding (sign=1) or removing (sign=-1) an order"""
+    order_dt = get_order_datetime(order)
+    if not order_dt:
+        return []
+
+    inc = _creation_increments(order, sign)
+    day = day_start(order_dt)
+    hour = hour_start(order_dt)
+    upsert = sign > 0
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"_id": day_bucket_id(day)},
+            {"$inc": inc, "$setOnInsert": {"kind": "day", "bucket": day, "firstSeenAt": now}},
+            upsert=upsert,
+        ),
+        UpdateOne(
+            {"_id": hour_bucket_id(hour)},
+            {"$inc": inc, "$setOnInsert": {"kind": "hour", "bucket": hour, "firstSeenAt": now}},
+            upsert=upsert,
+        ),
+    ]
+
+    item_totals = {}
+    for item in extract_items(order):
+        name = str(item["name"])
+        count, revenue = item_totals.get(name, (0, 0.0))
+        item_totals[name] = (count + item["quantity"], revenue + item["price"] * item["quantity"])
+
+    for name, (count, revenue) in item_totals.items():
+        operations.append(UpdateOne(
+            {"_id": item_bucket_id(day, name)},
+            {
+                "$inc": {"count": sign * count, "revenue": sign * revenue},
+                "$setOnInsert": {"kind": "item", "bucket": day, "name": name, "firstSeenAt": now},
+            },
+            upsert=upsert,
+        ))
+    return operations
+
+
+async def record_order_created(order: dict):
+    """Add a newly created order to its day, hour and item buckets"""
+    try:
+        operations = _creation_operations(order)
+        if operations:
+            db = get_db()
+            await db.get_collection(ROLLUPS_COLLECTION).bulk_write(operations, ordered=False)
+    except Exception as e:
+        # Rollups can be rebuilt from history, never fail the order itself
+        print(f"[Rollups] Could not record order {order.get('_id')}: {e}")
+
+
+async def record_orders_created(orders: list):
+    """record_order_created() for a batch of orders, in one bulk write"""
+    try:
+        operations = [op for order in orders for op in _creation_operations(order)]
+        if operations:
+            db = get_db()
+            await db.get_collection(ROLLUPS_COLLECTION).bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"[Rollups] Could not record {len(orders)} bulk-created orders: {e}")
+
+
+async def record_status_change(order: dict, previous_status, new_status):
+    """Move an order between status counters in its day and hour buckets"""
+    previous = normalize_status(previous_status)
+    current = normalize_status(new_status)
+    if previous == current:
+        return
+
+    order_dt = get_order_datetime(order)
+    if not order_dt:
+        return
+
+    inc = {
+        f"byStatus.{_field_key(previous)}": -1,
+        f"byStatus.{_field_key(current)}": 1,
+    }
+    if "completed" in (previous, current):
+        revenue = get_items_revenue(order)
+        inc["completedRevenue"] = revenue if current == "completed" else -revenue
+    if "cancelled" in (previous, current):
+        total = get_order_total(order)
+        inc["cancelledRevenue"] = total if current == "cancelled" else -total
+
+    try:
+        db = get_db()
+        await db.get_collection(ROLLUPS_COLLECTION).bulk_write([
+            UpdateOne({"_id": day_bucket_id(order_dt)}, {"$inc": inc}),
+            UpdateOne({"_id": hour_bucket_id(order_dt)}, {"$inc": inc}),
+        ], ordered=False)
+    except Exception as e:
+        print(f"[Rollups] Could not record status change for order {order.get('_id')}: {e}")
+
+
+async def record_order_updated(before: dict, after: dict):
+    """
+    Apply an arbitrary order edit (items, total, status, type, creation time)
+    to the rollups: take the old order out of its buckets and add the new one.
+    """
+    if not before or not after:
+        return
+    if all(before.get(field) == after.get(field) for field in ROLLUP_FIELDS):
+        return
+    try:
+        operations = _creation_operations(before, -1) + _creation_operations(after)
+        if operations:
+            db = get_db()
+            await db.get_collection(ROLLUPS_COLLECTION).bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"[Rollups] Could not record update of order {after.get('_id')}: {e}")
+
+
+# -------------------------
+# Backfill
+# -------------------------
+
+def _accumulate(buckets: dict, order: dict):
+    order_dt = get_order_datetime(order)
+    if not order_dt:
+        return
+
+    day = day_start(order_dt)
+    hour = hour_start(order_dt)
+    inc = _creation_increments(order)
+
+    for bucket_id, kind, bucket in (
+        (day_bucket_id(day), "day", day),
+        (hour_bucket_id(hour), "hour", hour),
+    ):
+        doc = buckets.setdefault(bucket_id, {
+            "_id": bucket_id, "kind": kind, "bucket": bucket,
+            "orders": 0, "revenue": 0.0, "completedRevenue": 0.0, "cancelledRevenue": 0.0,
+            "byStatus": {}, "byType": {},
+        })
+        for field, value in inc.items():
+            if "." in field:
+                group, key = field.split(".", 1)
+                doc[group][key] = doc[group].get(key, 0) + value
+            else:
+                doc[field] += value
+
+    for item in extract_items(order):
+        name = str(item["name"])
+        bucket_id = item_bucket_id(day, name)
+        doc = buckets.setdefault(bucket_id, {
+            "_id": bucket_id, "kind": "item", "bucket": day, "name": name,
+            "count": 0, "revenue": 0.0,
+        })
+        doc["count"] += item["quantity"]
+        doc["revenue"] += item["price"] * item["quantity"]
+
+
+async def rebuild_rollups(batch_size: int = 1000) -> dict:
+    """
+    Rebuild every rollup bucket from the orders collection.
+
+    Orders are streamed from a cursor, so memory is bounded by the number of
+    buckets (days x items), not by the number of orders. Rebuilt buckets carry
+    this run's rebuildId; buckets left from before the run without it are
+    dropped. See the module docstring for the race with live updates.
+    """
+    async with _rebuild_lock:
+        return await _rebuild(batch_size)
+
+
+async def _rebuild(batch_size: int) -> dict:
+    db = get_db()
+    coll = db.get_collection(ROLLUPS_COLLECTION)
+    projection = {
+        "createdAt": 1, "created_at": 1, "status": 1, "items": 1, "total": 1,
+        "type": 1, "orderType": 1, "order_type": 1,
+    }
+
+    rebuild_id = uuid.uuid4().hex
+    started_at = datetime.utcnow()
+    buckets = {}
+    orders_scanned = 0
+    async for order in db.orders.find({}, projection).batch_size(batch_size):
+        _accumulate(buckets, order)
+        orders_scanned += 1
+
+    operations = [
+        ReplaceOne({"_id": bucket_id}, {**doc, "rebuildId": rebuild_id, "rebuiltAt": started_at}, upsert=True)
+        for bucket_id, doc in buckets.items()
+    ]
+    for start in range(0, len(operations), batch_size):
+        await coll.bulk_write(operations[start:start + batch_size], ordered=False)
+
+    # Drop buckets that no longer have any orders behind them. Buckets a live
+    # update created during this run are newer than started_at and are kept.
+    stale = await coll.delete_many({
+        "rebuildId": {"$ne": rebuild_id},
+        "$or": [{"firstSeenAt": {"$exists": False}}, {"firstSeenAt": {"$lt": started_at}}],
+    })
+
+    return {
+        "rebuildId": rebuild_id,
+        "ordersScanned": orders_scanned,
+        "buckets": len(buckets),
+        "staleRemoved": stale.deleted_count,
+    }
+
+
+# -------------------------
+# Readers
+# -------------------------
+
+async def get_buckets(kinds: list, start: datetime, end: datetime) -> list:
+    """Fetch rollup documents of the given kinds with start <= bucket < end"""
+    db = get_db()
+    return await db.get_collection(ROLLUPS_COLLECTION).find({
+        "kind": {"$in": kinds},
+        "bucket": {"$gte": start, "$lt": end},
+    }).to_list(length=None)
+
+
+async def get_day_bucket(dt: datetime):
+    """The day rollup document for the day containing `dt`, if any"""
+    db = get_db()
+    return await db.get_collection(ROLLUPS_COLLECTION).find_one({"_id": day_bucket_id(dt)})
+
+
+async def main():
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from .db import init_db
+
+    load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+    init_db()
+    print("🔄 Rebuilding analytics rollups...")
+    result = await rebuild_rollups()
+    print(f"✅ Rebuilt {result['buckets']} buckets from {result['ordersScanned']} orders "
+          f"({result['staleRemoved']} stale buckets removed)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""
+Admin Routes
+- Index registry report
+- In-process cache statistics
+- Durable timers
+- Event bus (kitchen display push)
+- Materialized status counters
+- Outbox dispatcher
+- Buffered audit writer
+- Idempotency keys
+"""
+
+from fastapi import APIRouter, Query
+from ..indexes import index_report, ensure_indexes
+from ..catalog_cache import get_cache_stats, invalidate_catalog
+from ..stats_cache import get_stats_cache_stats
+from ..pricing import get_pricing_stats
+from ..coupons import get_coupon_stats
+from ..timers import get_timer_stats, fire_due_timers
+from ..events import get_event_stats
+from ..status_counters import get_all_counters, reconcile_counters
+from ..outbox import get_outbox_stats, drain_outbox, requeue_failed
+from ..audit import get_audit_writer_stats, flush_audit
+from ..idempotency import get_idempotency_stats
+
+router = APIRouter(tags=["Admin"])
+
+
+@router.get("/indexes")
+async def get_index_report(profile_sample: int = Query(1000, ge=0, le=10000)):
+    """
+    Compare declared indexes with the live ones.
+    Lists missing and unused indexes, and profiled query shapes that
+    run as collection scans without a supporting index.
+    """
+    return await index_report(profile_sample=profile_sample)
+
+
+@router.post("/indexes/ensure")
+async def apply_indexes():
+    """Create any declared index that is missing (idempotent)"""
+    result = await ensure_indexes()
+    return {"success": not result["errors"], **result}
+
+
+@router.get("/cache")
+async def get_cache_report():
+    """Counters of the in-process caches: menu/recipe catalog, stats, pricing engine, coupon index"""
+    return {
+        "catalog": get_cache_stats(),
+        "stats": get_stats_cache_stats(),
+        "pricing": get_pricing_stats(),
+        "coupons": get_coupon_stats(),
+    }
+
+
+@router.post("/cache/invalidate")
+async def clear_catalog_cache():
+    """Force every worker to reload the catalog cache"""
+    await invalidate_catalog()
+    return {"success": True}
+
+
+@router.get("/timers")
+async def get_timers_report():
+    """Pending/running/failed timer counts and the next one due"""
+    return await get_timer_stats()
+
+
+@router.post("/timers/fire")
+async def fire_timers_now():
+    """Fire due timers immediately instead of waiting for the poller"""
+    return await fire_due_timers()
+
+
+@router.get("/events")
+async def get_events():
+    """Event bus broker, connected subscribers and delivery counters"""
+    return get_event_stats()
+
+
+@router.get("/counters")
+async def get_status_counters():
+    """Materialized per-status counters for orders, tables and notifications"""
+    return await get_all_counters()
+
+
+@router.post("/counters/reconcile")
+async def reconcile_status_counters():
+    """Recompute the counters now; returns the drift that was corrected"""
+    return {"success": True, "drift": await reconcile_counters()}
+
+
+@router.get("/outbox")
+async def get_outbox_report():
+    """Outbox backlog by status, dispatch lag and delivery latency"""
+    return await get_outbox_stats()
+
+
+@router.post("/outbox/drain")
+async def drain_outbox_now(max_events: int = Query(1000, ge=1, le=10000)):
+    """Deliver due outbox events in this request instead of waiting for the dispatcher"""
+    return {"delivered": await drain_outbox(max_events)}
+
+
+@router.post("/outbox/requeue")
+async def requeue_failed_events(topic: str = None):
+    """Retry events that exhausted their attempts"""
+    return {"requeued": await requeue_failed(topic)}
+
+
+@router.get("/audit-writer")
+async def get_audit_writer_report():
+    """Audit buffer depth, drops and flush latency"""
+    return get_audit_writer_stats()
+
+
+@router.post("/audit-writer/flush")
+async def flush_audit_writer():
+    """Write buffered audit entries now"""
+    return {"flushed": await flush_audit()}
+
+
+@router.get("/idempotency")
+async def get_idempotency_report():
+    """Requests executed, replayed and waited on through Idempotency-Key"""
+    return get_idempotency_stats()
@@ -2,92 +2,20 @@
 Analytics Routes
 """
 
-from fastapi import APIRouter
-from datetime import datetime, timedelta, timezone
-import re
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from datetime import datetime, timedelta
 from ..db import get_db
+from ..rollups import (
+    to_number, normalize_status, get_buckets, rebuild_rollups, ACTIVE_STATUSES, ROLLUPS_COLLECTION,
+)
+from ..pipelines import (
+    weekly_rollups_pipeline, weekly_orders_pipeline, shape_weekly_result,
+)
 
 router = APIRouter(tags=["Analytics"])
 
 
-# -------------------------
-# Helper Functions
-# -------------------------
-
-def to_number(value, default: float = 0.0) -> float:
-    if value is None:
-        return default
-    if isinstance(value, (int, float)):
-        return float(value)
-    if isinstance(value, str):
-        cleaned = value.replace(",", "").strip()
-        if cleaned == "":
-            return default
-        try:
-            return float(cleaned)
-        except ValueError:
-            return default
-    return default
-
-
-def parse_datetime(value):
-    if value is None:
-        return None
-    if isinstance(value, datetime):
-        if value.tzinfo:
-            return value.astimezone(timezone.utc).replace(tzinfo=None)
-        return value
-    if isinstance(value, str):
-        text = value.strip()
-        if text.endswith("Z"):
-            text = text[:-1] + "+00:00"
-        try:
-            parsed = datetime.fromisoformat(text)
-            if parsed.tzinfo:
-                return parsed.astimezone(timezone.utc).replace(tzinfo=None)
-            return parsed
-        except ValueError:
-            return None
-    return None
-
-
-def normalize_status(value) -> str:
-    return str(value or "").strip().lower()
-
-
-def _safe_int(value, default: int = 0) -> int:
-    """Safely convert a value to int"""
-    try:
-        return int(value)
-    except (TypeError, ValueError):
-        return default
-
-
-def normalize_order_type(order: dict) -> str:
-    raw = str(order.get("type") or order.get("orderType") or order.get("order_type") or "unknown").strip().lower()
-    if raw in {"dinein", "dine-in", "dine_in"}:
-        return "dine-in"
-    if raw in {"pickup", "take away", "take-away"}:
-        return "takeaway"
-    return raw or "unknown"
-
-def extract_items(order: dict):
-    items = []
-    raw_items = order.get("items") or []
-
-    for raw in raw_items:
-        if isinstance(raw, dict):
-            quantity = int(to_number(raw.get("quantity") or 1, 1))
-            name = raw.get("name") or "Item"
-            price = to_number(raw.get("price"), 0)
-            items.append({
-                "name": name,
-                "quantity": quantity,
-                "price": price
-            })
-    return items
-
-
 # -------------------------
 # Main Analytics
 # -------------------------
@@ -95,18 +23,21 @@ def extract_items(order: dict):
 @router.get("")
 async def get_analytics():
     db = get_db()
-    all_orders = await db.orders.find({}).to_list(50000)
-
-    # Total orders
-    total_orders = len(all_orders)
-    completed_orders = sum(1 for o in all_orders if normalize_status(o.get("status")) == "completed")
-    active_orders = sum(1 for o in all_orders if normalize_status(o.get("status")) in ["pending", "confirmed", "preparing", "ready"])
-
-    total_revenue = sum(
-        sum(item["price"] * item["quantity"] for item in extract_items(order))
-        for order in all_orders
-        if normalize_status(order.get("status")) == "completed"
-    )
+    day_buckets = await db.get_collection(ROLLUPS_COLLECTION).find(
+        {"kind": "day"},
+        {"orders": 1, "byStatus": 1, "completedRevenue": 1}
+    ).to_list(length=None)
+
+    total_orders = 0
+    completed_orders = 0
+    active_orders = 0
+    total_revenue = 0.0
+    for bucket in day_buckets:
+        by_status = bucket.get("byStatus") or {}
+        total_orders += bucket.get("orders", 0)
+        completed_orders += by_status.get("completed", 0)
+        active_orders += sum(by_status.get(s, 0) for s in ACTIVE_STATUSES)
+        total_revenue += bucket.get("completedRevenue", 0)
 
     avg_order_value = round(total_revenue / completed_orders, 2) if completed_orders else 0
 
@@ -121,6 +52,33 @@ async def get_analytics():
         }
     }
 
+
+@router.get("/daily")
+async def get_daily_analytics(date: Optional[str] = None):
+    """Get hourly analytics for a single day"""
+    if date:
+        try:
+            target_date = datetime.fromisoformat(date[:10])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    else:
+        target_date = datetime.utcnow()
+    target_date = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    hour_rows = await get_buckets(["hour"], target_date, target_date + timedelta(days=1))
+
+    hourly_buckets = {hour: {"hour": hour, "orders": 0, "revenue": 0.0} for hour in range(24)}
+    total_orders = 0
+    total_revenue = 0.0
+    completed_count = 0
+    for row in hour_rows:
+        hour = row["bucket"].hour
+        hourly_buckets[hour]["orders"] += row.get("orders", 0)
+        hourly_buckets[hour]["revenue"] += row.get("revenue", 0)
+        total_orders += row.get("orders", 0)
+        total_revenue += row.get("revenue", 0)
+        completed_count += (row.get("byStatus") or {}).get("completed", 0)
+
     hourly_result = [hourly_buckets[hour] for hour in sorted(hourly_buckets.keys())]
     
     return {
@@ -132,81 +90,36 @@ async def get_analytics():
     }
 
 
+def _week_window():
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=6), today
+
+
 @router.get("/weekly")
-async def get_weekly_analytics():
-    """Get analytics for the past week"""
+async def get_weekly_analytics(source: str = Query("rollups", pattern="^(rollups|orders)$")):
+    """
+    Get analytics for the past week.
+
+    `source=rollups` (default) aggregates the pre-computed buckets;
+    `source=orders` aggregates raw orders, e.g. before a rollup backfill.
+    """
     db = get_db()
+    week_start, today = _week_window()
 
-    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    week_start = today - timedelta(days=6)
+    if source == "orders":
+        cursor = db.orders.aggregate(weekly_orders_pipeline(week_start, today))
+    else:
+        cursor = db.get_collection(ROLLUPS_COLLECTION).aggregate(weekly_rollups_pipeline(week_start, today))
+    facet = await cursor.to_list(1)
 
-    all_orders = await db.orders.find({}).to_list(50000)
+    return shape_weekly_result(week_start, today, facet[0] if facet else {})
 
-    current_week_orders = []
-    previous_week_orders = []
-    prev_week_start = week_start - timedelta(days=7)
-    for order in all_orders:
-        order_dt = get_order_datetime(order)
-        if not order_dt:
-            continue
-        if week_start <= order_dt < (today + timedelta(days=1)):
-            current_week_orders.append(order)
-        elif prev_week_start <= order_dt < week_start:
-            previous_week_orders.append(order)
-
-    daily_buckets = {}
-    for offset in range(7):
-        d = week_start + timedelta(days=offset)
-        key = d.strftime("%Y-%m-%d")
-        daily_buckets[key] = {"date": key, "orders": 0, "revenue": 0.0}
-
-    for order in current_week_orders:
-        order_dt = get_order_datetime(order)
-        if not order_dt:
-            continue
-        key = order_dt.strftime("%Y-%m-%d")
-        if key in daily_buckets:
-            daily_buckets[key]["orders"] += 1
-            daily_buckets[key]["revenue"] += get_order_total(order)
-
-    daily_result = [
-        {"date": row["date"], "orders": row["orders"], "revenue": round(row["revenue"], 2)}
-        for row in [daily_buckets[k] for k in sorted(daily_buckets.keys())]
-    ]
-
-    current_item_counts = {}
-    current_item_revenue = {}
-    for order in current_week_orders:
-        for item in extract_items(order):
-            name = item["name"]
-            current_item_counts[name] = current_item_counts.get(name, 0) + item["quantity"]
-            current_item_revenue[name] = current_item_revenue.get(name, 0.0) + (item["price"] * item["quantity"])
-
-    prev_counts = {}
-    for order in previous_week_orders:
-        for item in extract_items(order):
-            name = item["name"]
-            prev_counts[name] = prev_counts.get(name, 0) + item["quantity"]
-
-    top_items = sorted(current_item_counts.items(), key=lambda row: row[1], reverse=True)[:10]
-
-    def trend(item_name, curr_count):
-        prev = prev_counts.get(str(item_name), 0)
-        if prev == 0:
-            return 0
-        return round(((curr_count - prev) / prev) * 100)
 
-    return {
-        "startDate": week_start.isoformat()[:10],
-        "endDate": today.isoformat()[:10],
-        "daily": daily_result,
-        "topItems": [{
-            "name": name,
-            "count": count,
-            "revenue": round(current_item_revenue.get(name, 0.0), 2),
-            "trend": trend(name, count)
-        } for name, count in top_items]
-    }
+@router.post("/rollups/rebuild")
+async def rebuild_analytics_rollups(batch_size: int = Query(1000, ge=100, le=10000)):
+    """Rebuild the pre-aggregated analytics buckets from order history"""
+    result = await rebuild_rollups(batch_size=batch_size)
+    return {"success": True, **result}
 
 
 @router.get("/staff-performance")
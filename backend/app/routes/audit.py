@@ -1,11 +1,34 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
 from ..db import init_db, get_db
 from datetime import datetime, timedelta
 from typing import Optional
 from bson import ObjectId
+from ..indexes import declare_index
+from ..pagination import paginate, page_meta
+from ..rollups import parse_datetime
+from ..exports import BATCH_ROWS as EXPORT_BATCH_ROWS, export_response
+from ..audit_storage import AUDIT_COLLECTION, STATS_COLLECTION, get_audit_summary, rebuild_audit_stats, migrate_legacy_audit_dates
 
 router = APIRouter()
 
+declare_index('audit_logs', [('createdAt', -1), ('_id', -1)])
+declare_index('audit_logs', [('action', 1), ('createdAt', -1)])
+declare_index('audit_logs', [('userId', 1), ('createdAt', -1)])
+
+AUDIT_EXPORT_COLUMNS = [
+    ('ID', '_id'),
+    ('Time', 'createdAt'),
+    ('Action', 'action'),
+    ('Resource', 'resource'),
+    ('Resource ID', 'resourceId'),
+    ('User ID', 'userId'),
+    ('User Name', 'userName'),
+    ('Status', 'status'),
+    ('IP', 'ip'),
+    ('Device', 'device'),
+    ('Details', 'details'),
+]
+
 
 def serialize_doc(doc):
     """Convert MongoDB document to JSON-serializable dict"""
@@ -36,6 +59,25 @@ def to_object_id(id_str: str):
         return id_str
 
 
+def created_range(date_from: str = None, date_to: str = None) -> dict:
+    """createdAt filter for ISO date/datetime bounds; a bare date_to includes that whole day"""
+    created = {}
+    if date_from:
+        start = parse_datetime(date_from)
+        if start is None:
+            raise HTTPException(status_code=400, detail='Invalid date_from')
+        created['$gte'] = start
+    if date_to:
+        end = parse_datetime(date_to)
+        if end is None:
+            raise HTTPException(status_code=400, detail='Invalid date_to')
+        if len(date_to.strip()) == 10:
+            created['$lt'] = end + timedelta(days=1)
+        else:
+            created['$lte'] = end
+    return {'createdAt': created} if created else {}
+
+
 @router.on_event('startup')
 async def startup_db():
     init_db()
@@ -50,11 +92,13 @@ async def list_audit(
     date_from: str = None,
     date_to: str = None,
     limit: int = 100,
-    skip: int = 0
+    skip: int = 0,
+    cursor: str = None,
+    total_mode: str = 'exact'
 ):
-    """List audit logs with optional filters"""
+    """List audit logs with optional filters, newest first (keyset paginated via `cursor`)"""
     db = get_db()
-    coll = db.get_collection('audit_logs')
+    coll = db.get_collection(AUDIT_COLLECTION)
     filt = {}
     
     if action:
@@ -65,20 +109,13 @@ async def list_audit(
         filt['resource'] = resource
     if status:
         filt['status'] = status
-    if date_from:
-        filt['createdAt'] = {'$gte': date_from}
-    if date_to:
-        if 'createdAt' in filt:
-            filt['createdAt']['$lte'] = date_to
-        else:
-            filt['createdAt'] = {'$lte': date_to}
+    filt.update(created_range(date_from, date_to))
     
-    docs = await coll.find(filt).sort('createdAt', -1).skip(skip).limit(min(limit, 1000)).to_list(1000)
-    total = await coll.count_documents(filt)
+    page = await paginate(coll, filt, 'createdAt', -1, min(limit, 1000), cursor=cursor, skip=skip, total_mode=total_mode)
     
     return {
-        'data': serialize_doc(docs),
-        'total': total,
+        'data': serialize_doc(page['docs']),
+        **page_meta(page),
         'skip': skip,
         'limit': limit
     }
@@ -86,62 +123,29 @@ async def list_audit(
 
 @router.get('/stats', tags=['audit'])
 async def get_audit_stats():
-    """Get audit log statistics"""
-    db = get_db()
-    coll = db.get_collection('audit_logs')
-    
-    # Get counts by action
-    action_pipeline = [
-        {'$group': {'_id': '$action', 'count': {'$sum': 1}}},
-        {'$sort': {'count': -1}},
-        {'$limit': 10}
-    ]
-    by_action = await coll.aggregate(action_pipeline).to_list(10)
-    
-    # Get counts by resource
-    resource_pipeline = [
-        {'$group': {'_id': '$resource', 'count': {'$sum': 1}}},
-        {'$sort': {'count': -1}},
-        {'$limit': 10}
-    ]
-    by_resource = await coll.aggregate(resource_pipeline).to_list(10)
-    
-    # Get counts by user
-    user_pipeline = [
-        {'$group': {'_id': '$userName', 'count': {'$sum': 1}}},
-        {'$sort': {'count': -1}},
-        {'$limit': 10}
-    ]
-    by_user = await coll.aggregate(user_pipeline).to_list(10)
-    
-    # Get counts by status
-    status_pipeline = [
-        {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
-    ]
-    by_status = await coll.aggregate(status_pipeline).to_list(10)
-    
-    # Total count
-    total = await coll.count_documents({})
-    
-    # Today's count
-    today = datetime.utcnow().strftime('%Y-%m-%d')
-    today_count = await coll.count_documents({'createdAt': {'$regex': f'^{today}'}})
-    
-    return {
-        'total': total,
-        'today': today_count,
-        'byAction': {r['_id']: r['count'] for r in by_action if r['_id']},
-        'byResource': {r['_id']: r['count'] for r in by_resource if r['_id']},
-        'byUser': {r['_id']: r['count'] for r in by_user if r['_id']},
-        'byStatus': {r['_id']: r['count'] for r in by_status if r['_id']}
-    }
+    """Get audit log statistics (from the daily stats buckets)"""
+    return await get_audit_summary()
+
+
+@router.post('/stats/rebuild', tags=['audit'])
+async def rebuild_stats():
+    """Recompute the daily stats buckets from the audit log"""
+    return {'success': True, 'buckets': await rebuild_audit_stats()}
+
+
+@router.post('/migrate', tags=['audit'])
+async def migrate_legacy_dates(chunk_size: int = 1000):
+    """Convert string createdAt values left from older releases, then rebuild the stats"""
+    migrated = await migrate_legacy_audit_dates(max(1, min(chunk_size, 10000)))
+    buckets = await rebuild_audit_stats() if migrated else 0
+    return {'success': True, 'migrated': migrated, 'buckets': buckets}
 
 
 @router.get('/actions', tags=['audit'])
 async def get_unique_actions():
     """Get list of unique actions in audit logs"""
     db = get_db()
-    coll = db.get_collection('audit_logs')
+    coll = db.get_collection(AUDIT_COLLECTION)
     actions = await coll.distinct('action')
     return actions
 
@@ -150,16 +154,44 @@ async def get_unique_actions():
 async def get_unique_resources():
     """Get list of unique resources in audit logs"""
     db = get_db()
-    coll = db.get_collection('audit_logs')
+    coll = db.get_collection(AUDIT_COLLECTION)
     resources = await coll.distinct('resource')
     return resources
 
 
+@router.get('/export', tags=['audit'])
+async def export_audit_logs(
+    format: str = 'json',
+    date_from: str = None,
+    date_to: str = None,
+    limit: Optional[int] = Query(None, ge=1),
+    gzip: bool = False
+):
+    """
+    Export audit logs for download, newest first, streamed from the cursor.
+    format: json ({"data": [...], "count": n}), ndjson or csv; no row limit unless given.
+    """
+    db = get_db()
+    coll = db.get_collection(AUDIT_COLLECTION)
+    filt = created_range(date_from, date_to)
+    
+    cursor = coll.find(filt).sort('createdAt', -1).batch_size(EXPORT_BATCH_ROWS)
+    if limit:
+        cursor = cursor.limit(limit)
+    
+    stamp = datetime.utcnow()
+    return export_response(
+        cursor, format, f"audit-logs-{stamp.strftime('%Y-%m-%d')}.{format}", gzip=gzip,
+        columns=AUDIT_EXPORT_COLUMNS,
+        envelope={'format': format, 'exportedAt': stamp.isoformat()}
+    )
+
+
 @router.get('/{id}', tags=['audit'])
 async def get_audit(id: str):
     """Get a specific audit log by ID"""
     db = get_db()
-    coll = db.get_collection('audit_logs')
+    coll = db.get_collection(AUDIT_COLLECTION)
     doc = await coll.find_one({'_id': to_object_id(id)})
     if not doc:
         raise HTTPException(status_code=404, detail='Not found')
@@ -170,43 +202,23 @@ async def get_audit(id: str):
 async def cleanup_old_logs(days: int = 90, request: Request = None):
     """Delete audit logs older than specified days"""
     db = get_db()
-    coll = db.get_collection('audit_logs')
+    coll = db.get_collection(AUDIT_COLLECTION)
     
-    cutoff_date = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    result = await coll.delete_many({'createdAt': {'$lt': cutoff_date}})
+    cutoff_date = datetime.utcnow() - timedelta(days=days)
+    result = await coll.delete_many({'$or': [
+        {'createdAt': {'$lt': cutoff_date}},
+        # Entries not migrated yet
+        {'createdAt': {'$lt': cutoff_date.isoformat(), '$type': 'string'}},
+    ]})
+    
+    # Drop the buckets of deleted days and recount the day the cutoff falls in
+    stats = db.get_collection(STATS_COLLECTION)
+    day = datetime(cutoff_date.year, cutoff_date.month, cutoff_date.day)
+    await stats.delete_many({'date': {'$lt': day}})
+    await rebuild_audit_stats(since=day, until=day + timedelta(days=1))
     
     return {
         'success': True,
         'deleted_count': result.deleted_count,
         'message': f'Deleted {result.deleted_count} logs older than {days} days'
     }
-
-
-@router.get('/export', tags=['audit'])
-async def export_audit_logs(
-    format: str = 'json',
-    date_from: str = None,
-    date_to: str = None,
-    limit: int = 10000
-):
-    """Export audit logs for download"""
-    db = get_db()
-    coll = db.get_collection('audit_logs')
-    filt = {}
-    
-    if date_from:
-        filt['createdAt'] = {'$gte': date_from}
-    if date_to:
-        if 'createdAt' in filt:
-            filt['createdAt']['$lte'] = date_to
-        else:
-            filt['createdAt'] = {'$lte': date_to}
-    
-    docs = await coll.find(filt).sort('createdAt', -1).limit(limit).to_list(limit)
-    
-    return {
-        'data': serialize_doc(docs),
-        'count': len(docs),
-        'format': format,
-        'exportedAt': datetime.utcnow().isoformat()
-    }
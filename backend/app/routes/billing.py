@@ -2,18 +2,43 @@
 Billing & Payment Routes
 - Payments processing
 - Payment history
+- Pricing (tax, charges, discounts) and re-pricing of open bills
 - Reports
 """
 
-from fastapi import APIRouter, HTTPException, Query
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Header
 from typing import Optional, List
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
 from ..db import get_db
-from ..audit import log_audit
+from ..audit import log_audit, audit_event
+from ..outbox import enqueue_many, notify_committed
+from ..rollups import record_status_change, get_day_bucket
+from ..sequences import next_transaction_id, next_refund_id, next_invoice_number
+from ..indexes import declare_index
+from ..pagination import paginate, page_meta
+from ..status_counters import record_insert, record_update, tracked_update
+from ..stats_cache import cached_stats, invalidate_stats
+from ..idempotency import run_idempotent
+from ..order_lifecycle import run_in_transaction
+from ..pricing import get_pricing_engine, invalidate_pricing, reprice_open_bills
+from .orders import publish_order_status
+from .customers import order_completed_event
 
 router = APIRouter(tags=["Billing"])
 
+declare_index("billing", [("status", 1), ("createdAt", -1)])
+declare_index("billing", [("createdAt", -1), ("_id", -1)])
+declare_index("payments", [("orderId", 1)])
+declare_index("payments", [("status", 1), ("createdAt", -1)])
+declare_index("payments", [("createdAt", -1), ("_id", -1)])
+declare_index("invoices", [("createdAt", -1)])
+
+# Stats cache namespace; every write to `payments` invalidates it
+BILLING_STATS = "billing"
+
 
 def serialize_doc(doc):
     """Convert MongoDB document to JSON-serializable dict"""
@@ -32,8 +57,10 @@ async def list_billing_entries(
     date_to: Optional[str] = None,
     limit: int = Query(100, le=500),
     skip: int = 0,
+    cursor: Optional[str] = None,
+    total_mode: str = "exact",
 ):
-    """Get all billing entries (served orders ready for payment)"""
+    """Get all billing entries (served orders ready for payment), newest first"""
     db = get_db()
     query = {}
     
@@ -47,10 +74,9 @@ async def list_billing_entries(
         else:
             query["createdAt"] = {"$lte": datetime.fromisoformat(date_to)}
     
-    billing_entries = await db.billing.find(query).sort("createdAt", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.billing.count_documents(query)
+    page = await paginate(db.billing, query, "createdAt", -1, limit, cursor=cursor, skip=skip, total_mode=total_mode)
     
-    return {"data": [serialize_doc(entry) for entry in billing_entries], "total": total}
+    return {"data": [serialize_doc(entry) for entry in page["docs"]], **page_meta(page)}
 
 
 @router.get("/entries/{billing_id}")
@@ -64,8 +90,21 @@ async def get_billing_entry(billing_id: str):
 
 
 @router.post("/process-payment")
-async def process_order_payment(data: dict):
-    """Process payment for a billing entry"""
+async def process_billing_payment(
+    data: dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Process payment for a billing entry (send an Idempotency-Key header to make retries safe)"""
+    return await run_idempotent(idempotency_key, "billing.process-payment", data,
+                                lambda: _pay_billing_entry(data))
+
+
+async def _pay_billing_entry(data: dict):
+    """
+    Pay a billing entry. The payment, the billing entry, the order's
+    completion and the outbox events (audit, customer stats) are written in
+    one transaction where supported.
+    """
     db = get_db()
     
     required_fields = ["billingId", "method", "amount"]
@@ -84,9 +123,9 @@ async def process_order_payment(data: dict):
         raise HTTPException(status_code=404, detail="Billing entry not found")
     
     # Create payment record
-    count = await db.payments.count_documents({})
     payment_data = {
-        "transactionId": f"TXN-{datetime.utcnow().strftime('%Y%m%d')}-{count + 1001}",
+        "_id": ObjectId(),
+        "transactionId": await next_transaction_id(),
         "billingId": billing_id,
         "orderId": billing.get("orderId"),
         "orderNumber": billing.get("orderNumber"),
@@ -99,51 +138,161 @@ async def process_order_payment(data: dict):
         "status": "completed",
         "createdAt": datetime.utcnow(),
     }
+    paid_at = datetime.utcnow().isoformat() + 'Z'
     
-    payment_result = await db.payments.insert_one(payment_data)
-    
-    # Update billing entry
-    await db.billing.update_one(
-        {"_id": ObjectId(billing_id)},
-        {"$set": {
-            "status": "paid",
-            "paymentId": str(payment_result.inserted_id),
-            "paymentMethod": payment_method,
-            "paidAt": datetime.utcnow().isoformat() + 'Z',
-            "paidAmount": amount,
-            "tips": tips,
-        }}
-    )
-    
-    # Update order status to completed
-    if billing.get("orderId"):
-        await db.orders.update_one(
-            {"_id": ObjectId(billing["orderId"])},
+    async def work(session):
+        await db.payments.insert_one(payment_data, session=session)
+        
+        # Update billing entry
+        await db.billing.update_one(
+            {"_id": ObjectId(billing_id)},
             {"$set": {
-                "status": "completed",
-                "paymentStatus": "paid",
+                "status": "paid",
+                "paymentId": str(payment_data["_id"]),
                 "paymentMethod": payment_method,
-                "paidAt": datetime.utcnow().isoformat() + 'Z',
-                "completedAt": datetime.utcnow().isoformat() + 'Z'
-            }}
+                "paidAt": paid_at,
+                "paidAmount": amount,
+                "tips": tips,
+            }},
+            session=session
         )
-    
-    await log_audit("payment_processed", "billing", billing_id, {
-        "amount": amount,
-        "method": payment_method,
-        "transactionId": payment_data["transactionId"]
-    })
-    
-    # Get created payment
-    created_payment = await db.payments.find_one({"_id": payment_result.inserted_id})
+        
+        # Update order status to completed
+        previous_order = None
+        if billing.get("orderId"):
+            previous_order = await db.orders.find_one_and_update(
+                {"_id": ObjectId(billing["orderId"])},
+                {"$set": {
+                    "status": "completed",
+                    "paymentStatus": "paid",
+                    "paymentMethod": payment_method,
+                    "paidAt": paid_at,
+                    "completedAt": paid_at
+                }},
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+        
+        # Audit entry and customer stats are delivered from the outbox
+        events = [audit_event("payment_processed", "billing", billing_id, details={
+            "amount": amount,
+            "method": payment_method,
+            "transactionId": payment_data["transactionId"]
+        })]
+        if previous_order and previous_order.get("status") != "completed" and previous_order.get("customerId"):
+            events.append(order_completed_event(str(previous_order["customerId"]), billing["orderId"], previous_order.get("total")))
+        await enqueue_many(events, session=session)
+        return previous_order
+    
+    previous_order = await run_in_transaction(db, work)
+    notify_committed()
+    invalidate_stats(BILLING_STATS)
+    
+    if previous_order:
+        previous_status = previous_order.get("status")
+        results = await asyncio.gather(
+            record_update("orders", previous_order, {"$set": {"status": "completed"}}),
+            record_status_change(previous_order, previous_status, "completed"),
+            publish_order_status(previous_order, previous_status, "completed"),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"[Billing] Payment side effect failed for order {billing['orderId']}: {result}")
     
     return {
         "success": True,
-        "payment": serialize_doc(created_payment),
+        "payment": serialize_doc(payment_data),
         "transactionId": payment_data["transactionId"]
     }
 
 
+# ============ TAX SETTINGS ============
+
+@router.get("/tax-settings")
+async def get_tax_settings():
+    """Get tax configuration"""
+    db = get_db()
+    
+    settings = await db.settings.find_one({"key": "tax_settings"})
+    if not settings:
+        # Return defaults
+        return {
+            "gstEnabled": True,
+            "cgstRate": 2.5,
+            "sgstRate": 2.5,
+            "serviceChargeEnabled": True,
+            "serviceChargeRate": 5,
+            "roundingEnabled": True,
+        }
+    
+    return settings.get("value", {})
+
+
+@router.post("/tax-settings")
+async def update_tax_settings(data: dict):
+    """Update tax settings"""
+    db = get_db()
+    
+    await db.settings.update_one(
+        {"key": "tax_settings"},
+        {"$set": {
+            "key": "tax_settings",
+            "value": data,
+            "updatedAt": datetime.utcnow()
+        }},
+        upsert=True
+    )
+    await invalidate_pricing()
+    
+    await log_audit("update", "tax_settings", "tax_settings")
+    
+    return {"success": True, "settings": data}
+
+
+# ============ PRICING ============
+
+@router.get("/pricing")
+async def get_pricing_config():
+    """Tax lines, charges, discount rules and membership tiers the bills are priced with"""
+    engine = await get_pricing_engine()
+    return engine.describe()
+
+
+@router.post("/price")
+async def price_order(data: dict):
+    """
+    Price an order without saving anything.
+    
+    Request body: an order (items and/or total, type) plus optional
+    discountRuleIds and membershipTier.
+    """
+    engine = await get_pricing_engine()
+    return engine.price(data)
+
+
+@router.post("/reprice")
+async def reprice_bills(data: Optional[dict] = None):
+    """
+    Re-price open (unpaid) bills with the current tax and discount
+    configuration, e.g. after a tax change.
+    
+    Request body (optional): {"billingIds": ["..."]} to limit it to some bills
+    """
+    billing_ids = (data or {}).get("billingIds")
+    if billing_ids is not None and not isinstance(billing_ids, list):
+        raise HTTPException(status_code=400, detail="billingIds must be a list")
+    
+    result = await reprice_open_bills(billing_ids)
+    if result["repriced"]:
+        invalidate_stats(BILLING_STATS)
+        await log_audit("reprice", "billing", "open_bills", {
+            "repriced": result["repriced"],
+            "pricingVersion": result["pricingVersion"]
+        })
+    return {"success": True, **result}
+
+
 # ============ PAYMENTS ============
 
 @router.get("")
@@ -154,8 +303,10 @@ async def list_payments(
     date_to: Optional[str] = None,
     limit: int = Query(100, le=500),
     skip: int = 0,
+    cursor: Optional[str] = None,
+    total_mode: str = "exact",
 ):
-    """Get all payments"""
+    """Get all payments, newest first"""
     db = get_db()
     query = {}
     
@@ -171,69 +322,75 @@ async def list_payments(
         else:
             query["createdAt"] = {"$lte": datetime.fromisoformat(date_to)}
     
-    payments = await db.payments.find(query).sort("createdAt", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.payments.count_documents(query)
+    page = await paginate(db.payments, query, "createdAt", -1, limit, cursor=cursor, skip=skip, total_mode=total_mode)
     
-    return {"data": [serialize_doc(p) for p in payments], "total": total}
+    return {"data": [serialize_doc(p) for p in page["docs"]], **page_meta(page)}
 
 
-@router.get("/stats")
-async def get_payment_stats():
-    """Get payment statistics"""
+def _method_totals(rows: list) -> dict:
+    return {m["_id"]: {"total": m["total"], "count": m["count"]} for m in rows if m["_id"]}
+
+
+async def _load_payment_stats() -> dict:
     db = get_db()
     
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     week_ago = today - timedelta(days=7)
     month_start = today.replace(day=1)
-    
-    # Today's revenue
-    today_pipeline = [
-        {"$match": {"createdAt": {"$gte": today}, "status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
-    ]
-    today_result = await db.payments.aggregate(today_pipeline).to_list(1)
-    today_revenue = today_result[0]["total"] if today_result else 0
-    today_count = today_result[0]["count"] if today_result else 0
-    
-    # This week's revenue
-    week_pipeline = [
-        {"$match": {"createdAt": {"$gte": week_ago}, "status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]
-    week_result = await db.payments.aggregate(week_pipeline).to_list(1)
-    week_revenue = week_result[0]["total"] if week_result else 0
-    
-    # This month's revenue
-    month_pipeline = [
-        {"$match": {"createdAt": {"$gte": month_start}, "status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]
-    month_result = await db.payments.aggregate(month_pipeline).to_list(1)
-    month_revenue = month_result[0]["total"] if month_result else 0
-    
-    # By payment method
-    method_pipeline = [
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": "$method", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+    since = min(week_ago, month_start)
+    
+    def revenue_since(start):
+        return [
+            {"$match": {"status": "completed", "createdAt": {"$gte": start}}},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+        ]
+    
+    # One pass over the indexed createdAt range plus the pending/failed payments
+    pipeline = [
+        {"$match": {"$or": [
+            {"createdAt": {"$gte": since}},
+            {"status": {"$in": ["pending", "failed"]}}
+        ]}},
+        {"$facet": {
+            "today": revenue_since(today),
+            "week": revenue_since(week_ago),
+            "month": revenue_since(month_start),
+            "byMethod": [
+                {"$match": {"status": "completed", "createdAt": {"$gte": month_start}}},
+                {"$group": {"_id": "$method", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+            ],
+            "byStatus": [
+                {"$match": {"status": {"$in": ["pending", "failed"]}}},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+            ],
+        }}
     ]
-    method_result = await db.payments.aggregate(method_pipeline).to_list(10)
-    by_method = {m["_id"]: {"total": m["total"], "count": m["count"]} for m in method_result if m["_id"]}
+    result = (await db.payments.aggregate(pipeline).to_list(1))[0]
     
-    # Pending payments
-    pending = await db.payments.count_documents({"status": "pending"})
-    failed = await db.payments.count_documents({"status": "failed"})
+    def first(name, field):
+        return result[name][0][field] if result[name] else 0
     
+    by_status = {row["_id"]: row["count"] for row in result["byStatus"]}
     return {
-        "todayRevenue": today_revenue,
-        "todayTransactions": today_count,
-        "weekRevenue": week_revenue,
-        "monthRevenue": month_revenue,
-        "byMethod": by_method,
-        "pending": pending,
-        "failed": failed,
+        "todayRevenue": first("today", "total"),
+        "todayTransactions": first("today", "count"),
+        "weekRevenue": first("week", "total"),
+        "monthRevenue": first("month", "total"),
+        "byMethod": _method_totals(result["byMethod"]),
+        "pending": by_status.get("pending", 0),
+        "failed": by_status.get("failed", 0),
     }
 
 
+@router.get("/stats")
+async def get_payment_stats():
+    """
+    Get payment statistics (byMethod covers the current month).
+    Served from a short-lived cache that payment writes invalidate.
+    """
+    return await cached_stats(BILLING_STATS, "stats", _load_payment_stats)
+
+
 @router.get("/{payment_id}")
 async def get_payment(payment_id: str):
     """Get single payment"""
@@ -250,12 +407,12 @@ async def create_payment(data: dict):
     db = get_db()
     
     # Generate transaction ID
-    count = await db.payments.count_documents({})
-    data["transactionId"] = f"TXN-{datetime.utcnow().strftime('%Y%m%d')}-{count + 1001}"
+    data["transactionId"] = await next_transaction_id()
     data["createdAt"] = datetime.utcnow()
     data["status"] = data.get("status", "completed")
     
     result = await db.payments.insert_one(data)
+    invalidate_stats(BILLING_STATS)
     created = await db.payments.find_one({"_id": result.inserted_id})
     
     # Handle payment status
@@ -289,7 +446,7 @@ async def create_payment(data: dict):
             customer_name = order.get("customerName", "Customer")
             total = order.get("total", 0)
             
-            await db.notifications.insert_one({
+            notification = {
                 "type": "payment-failed",
                 "title": f"Payment Failed - Order {order_number}",
                 "message": f"{customer_name}, your payment of ₹{total:.2f} failed. Order reserved for 15 minutes. Please retry.",
@@ -300,7 +457,9 @@ async def create_payment(data: dict):
                 "paymentId": str(result.inserted_id),
                 "expiresAt": reservation_expires,
                 "created_at": datetime.utcnow(),
-            })
+            }
+            await db.notifications.insert_one(notification)
+            await record_insert("notifications", notification)
     
     await log_audit("create", "payment", str(result.inserted_id), {
         "amount": data.get("amount"),
@@ -323,6 +482,7 @@ async def update_payment_status(payment_id: str, status: str):
         {"_id": ObjectId(payment_id)},
         {"$set": {"status": status, "updatedAt": datetime.utcnow()}}
     )
+    invalidate_stats(BILLING_STATS)
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Payment not found")
@@ -333,8 +493,17 @@ async def update_payment_status(payment_id: str, status: str):
 
 
 @router.post("/{payment_id}/retry")
-async def retry_payment(payment_id: str, method: Optional[str] = None):
-    """Retry a failed payment"""
+async def retry_payment(
+    payment_id: str,
+    method: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Retry a failed payment (send an Idempotency-Key header to make retries safe)"""
+    return await run_idempotent(idempotency_key, "billing.retry", {"paymentId": payment_id, "method": method},
+                                lambda: _retry_payment(payment_id, method))
+
+
+async def _retry_payment(payment_id: str, method: Optional[str]):
     db = get_db()
     
     payment = await db.payments.find_one({"_id": ObjectId(payment_id)})
@@ -354,16 +523,16 @@ async def retry_payment(payment_id: str, method: Optional[str] = None):
         reserved_until = order.get("reservedUntil")
         if reserved_until and datetime.utcnow() > reserved_until:
             # Cancel the order
-            await db.orders.update_one(
+            await tracked_update(
+                "orders",
                 {"_id": ObjectId(order_id)},
                 {"$set": {"status": "cancelled", "cancelledAt": datetime.utcnow(), "cancelReason": "Payment timeout"}}
             )
             raise HTTPException(status_code=400, detail="Order reservation expired. Order has been cancelled.")
     
     # Create new payment attempt
-    count = await db.payments.count_documents({})
     new_payment = {
-        "transactionId": f"TXN-{datetime.utcnow().strftime('%Y%m%d')}-{count + 1001}",
+        "transactionId": await next_transaction_id(),
         "orderId": order_id,
         "amount": payment.get("amount"),
         "method": method or payment.get("method"),
@@ -373,6 +542,7 @@ async def retry_payment(payment_id: str, method: Optional[str] = None):
     }
     
     result = await db.payments.insert_one(new_payment)
+    invalidate_stats(BILLING_STATS)
     created = await db.payments.find_one({"_id": result.inserted_id})
     
     await log_audit("retry", "payment", str(result.inserted_id), {"originalPaymentId": payment_id})
@@ -406,9 +576,8 @@ async def refund_payment(payment_id: str, amount: Optional[float] = None, reason
     )
     
     # Create refund record
-    count = await db.payments.count_documents({})
     refund_record = {
-        "transactionId": f"REF-{datetime.utcnow().strftime('%Y%m%d')}-{count + 1}",
+        "transactionId": await next_refund_id(),
         "originalPaymentId": payment_id,
         "amount": -refund_amount,
         "method": payment.get("method"),
@@ -418,6 +587,7 @@ async def refund_payment(payment_id: str, amount: Optional[float] = None, reason
         "createdAt": datetime.utcnow()
     }
     await db.payments.insert_one(refund_record)
+    invalidate_stats(BILLING_STATS)
     
     await log_audit("refund", "payment", payment_id, {"amount": refund_amount})
     
@@ -454,8 +624,7 @@ async def create_invoice(data: dict):
     db = get_db()
     
     # Generate invoice number
-    count = await db.invoices.count_documents({})
-    data["invoiceNumber"] = f"INV-{datetime.utcnow().strftime('%Y%m%d')}-{count + 1001}"
+    data["invoiceNumber"] = await next_invoice_number()
     data["createdAt"] = datetime.utcnow()
     
     result = await db.invoices.insert_one(data)
@@ -464,99 +633,58 @@ async def create_invoice(data: dict):
     return serialize_doc(created)
 
 
-# ============ TAX SETTINGS ============
-
-@router.get("/tax-settings")
-async def get_tax_settings():
-    """Get tax configuration"""
-    db = get_db()
-    
-    settings = await db.settings.find_one({"key": "tax_settings"})
-    if not settings:
-        # Return defaults
-        return {
-            "gstEnabled": True,
-            "cgstRate": 2.5,
-            "sgstRate": 2.5,
-            "serviceChargeEnabled": True,
-            "serviceChargeRate": 5,
-            "roundingEnabled": True,
-        }
-    
-    return settings.get("value", {})
-
+# ============ DAILY REPORTS ============
 
-@router.post("/tax-settings")
-async def update_tax_settings(data: dict):
-    """Update tax settings"""
+async def _load_daily_report(start: datetime) -> dict:
     db = get_db()
+    end = start + timedelta(days=1)
     
-    await db.settings.update_one(
-        {"key": "tax_settings"},
-        {"$set": {
-            "key": "tax_settings",
-            "value": data,
-            "updatedAt": datetime.utcnow()
-        }},
-        upsert=True
+    pipeline = [
+        {"$match": {"createdAt": {"$gte": start, "$lt": end}, "status": "completed"}},
+        {"$facet": {
+            "revenue": [{"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}],
+            "byMethod": [{"$group": {"_id": "$method", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}],
+        }}
+    ]
+    payments, day_bucket = await asyncio.gather(
+        db.payments.aggregate(pipeline).to_list(1),
+        # Order counts come from the analytics day rollup instead of scanning orders
+        get_day_bucket(start)
     )
+    result = payments[0]
+    revenue = result["revenue"][0] if result["revenue"] else {}
     
-    await log_audit("update", "tax_settings", "tax_settings")
-    
-    return {"success": True, "settings": data}
+    return {
+        "date": start.isoformat()[:10],
+        "revenue": revenue.get("total", 0),
+        "transactions": revenue.get("count", 0),
+        "ordersByStatus": {k: v for k, v in ((day_bucket or {}).get("byStatus") or {}).items() if v},
+        "byPaymentMethod": _method_totals(result["byMethod"]),
+    }
 
 
-# ============ DAILY REPORTS ============
-
 @router.get("/reports/daily")
 async def get_daily_report(date: Optional[str] = None):
     """Get daily financial report"""
-    db = get_db()
-    
     if date:
         start = datetime.fromisoformat(date)
     else:
         start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     
-    end = start + timedelta(days=1)
-    
-    # Revenue
-    revenue_pipeline = [
-        {"$match": {"createdAt": {"$gte": start, "$lt": end}, "status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
-    ]
-    revenue_result = await db.payments.aggregate(revenue_pipeline).to_list(1)
-    
-    # Orders
-    orders_pipeline = [
-        {"$match": {"createdAt": {"$gte": start, "$lt": end}}},
-        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-    ]
-    orders_result = await db.orders.aggregate(orders_pipeline).to_list(10)
-    
-    # By payment method
-    method_pipeline = [
-        {"$match": {"createdAt": {"$gte": start, "$lt": end}, "status": "completed"}},
-        {"$group": {"_id": "$method", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
-    ]
-    method_result = await db.payments.aggregate(method_pipeline).to_list(10)
-    
-    return {
-        "date": start.isoformat()[:10],
-        "revenue": revenue_result[0]["total"] if revenue_result else 0,
-        "transactions": revenue_result[0]["count"] if revenue_result else 0,
-        "ordersByStatus": {o["_id"]: o["count"] for o in orders_result if o["_id"]},
-        "byPaymentMethod": {m["_id"]: {"total": m["total"], "count": m["count"]} for m in method_result if m["_id"]},
-    }
+    return await cached_stats(BILLING_STATS, f"daily:{start.isoformat()}", lambda: _load_daily_report(start))
 
 
 # ============ ORDER-BILLING INTEGRATION ============
 
 @router.post("/process-order-payment")
-async def process_order_payment(data: dict):
+async def process_order_payment(
+    data: dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """
     Process payment for an order.
     Creates payment record and updates order payment status.
+    Send an Idempotency-Key header to make retries safe.
     
     Expected data:
     {
@@ -566,6 +694,16 @@ async def process_order_payment(data: dict):
         "tips": 50.00  // optional
     }
     """
+    return await run_idempotent(idempotency_key, "billing.process-order-payment", data,
+                                lambda: _pay_for_order(data))
+
+
+async def _pay_for_order(data: dict):
+    """
+    Pay an order. The order is claimed with a conditional update (not paid
+    yet), and the payment, its billing entry and the audit event are written
+    with it in one transaction where supported.
+    """
     db = get_db()
     
     order_id = data.get("orderId")
@@ -575,56 +713,64 @@ async def process_order_payment(data: dict):
     
     if not order_id or not amount:
         raise HTTPException(status_code=400, detail="orderId and amount are required")
-    
-    # Get order details
-    order = await db.orders.find_one({"_id": ObjectId(order_id)})
-    if not order:
+    if not ObjectId.is_valid(order_id):
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Check if already paid
-    if order.get("paymentStatus") == "paid":
-        raise HTTPException(status_code=400, detail="Order already paid")
-    
     # Generate transaction ID
-    count = await db.payments.count_documents({})
-    transaction_id = f"TXN-{datetime.utcnow().strftime('%Y%m%d')}-{count + 1001}"
-    
-    # Create payment record
-    payment_data = {
-        "orderId": order_id,
-        "orderNumber": order.get("orderNumber"),
-        "tableNumber": order.get("tableNumber"),
-        "transactionId": transaction_id,
-        "amount": amount,
-        "tips": tips,
-        "total": amount + tips,
-        "method": method,
-        "status": "completed",
-        "createdAt": datetime.utcnow()
-    }
-    
-    result = await db.payments.insert_one(payment_data)
-    
-    # Update order payment status
-    await db.orders.update_one(
-        {"_id": ObjectId(order_id)},
-        {"$set": {
-            "paymentStatus": "paid",
-            "paymentMethod": method,
-            "paidAt": datetime.utcnow(),
-            "paymentId": str(result.inserted_id)
-        }}
-    )
-    
-    await log_audit("payment", "order", order_id, {
-        "amount": amount,
-        "method": method,
-        "transactionId": transaction_id
-    })
+    transaction_id = await next_transaction_id()
+    payment_id = ObjectId()
+    now = datetime.utcnow()
+    
+    async def work(session):
+        # Update order payment status, unless it is already paid
+        order = await db.orders.find_one_and_update(
+            {"_id": ObjectId(order_id), "paymentStatus": {"$ne": "paid"}},
+            {"$set": {
+                "paymentStatus": "paid",
+                "paymentMethod": method,
+                "paidAt": now,
+                "paymentId": str(payment_id)
+            }},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if order is None:
+            return None
+        
+        # Create payment record
+        await db.payments.insert_one({
+            "_id": payment_id,
+            "orderId": order_id,
+            "orderNumber": order.get("orderNumber"),
+            "tableNumber": order.get("tableNumber"),
+            "transactionId": transaction_id,
+            "amount": amount,
+            "tips": tips,
+            "total": amount + tips,
+            "method": method,
+            "status": "completed",
+            "createdAt": now
+        }, session=session)
+        await _settle_order_bill(db, order_id, str(payment_id), method, amount, tips, now, session)
+        
+        await enqueue_many([audit_event("payment", "order", order_id, details={
+            "amount": amount,
+            "method": method,
+            "transactionId": transaction_id
+        })], session=session)
+        return order
+    
+    order = await run_in_transaction(db, work)
+    if order is None:
+        if await db.orders.count_documents({"_id": ObjectId(order_id)}, limit=1):
+            raise HTTPException(status_code=400, detail="Order already paid")
+        raise HTTPException(status_code=404, detail="Order not found")
+    notify_committed()
+    invalidate_stats(BILLING_STATS)
     
     return {
         "success": True,
-        "paymentId": str(result.inserted_id),
+        "paymentId": str(payment_id),
         "transactionId": transaction_id,
         "amount": amount,
         "method": method
@@ -645,10 +791,14 @@ async def get_order_payment(order_id: str):
 
 
 @router.post("/checkout")
-async def checkout_order(data: dict):
+async def checkout_order(
+    data: dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """
     Complete checkout process for an order.
     Processes payment and marks order as completed in one call.
+    Send an Idempotency-Key header to make retries safe.
     
     Expected data:
     {
@@ -658,26 +808,128 @@ async def checkout_order(data: dict):
         "tips": 50.00  // optional
     }
     """
+    return await run_idempotent(idempotency_key, "billing.checkout", data, lambda: _checkout_order(data))
+
+
+def _checkout_update(method: str, payment_id: str, now: datetime) -> dict:
+    """Order fields set by checkout: paid and completed in the same write"""
+    return {"$set": {
+        "paymentStatus": "paid",
+        "paymentMethod": method,
+        "paidAt": now,
+        "paymentId": payment_id,
+        "status": "completed",
+        "statusUpdatedAt": now,
+        "completedAt": now,
+    }}
+
+
+async def _settle_order_bill(db, order_id: str, payment_id: str, method: str, amount, tips,
+                             now: datetime, session=None):
+    """Mark the order's billing entry paid, with the fields _pay_billing_entry sets"""
+    await db.billing.update_one(
+        {"orderId": order_id, "status": {"$ne": "paid"}},
+        {"$set": {
+            "status": "paid",
+            "paymentId": payment_id,
+            "paymentMethod": method,
+            "paidAt": now.isoformat() + 'Z',
+            "paidAmount": amount,
+            "tips": tips,
+        }},
+        session=session
+    )
+
+
+async def _checkout_order(data: dict):
+    """
+    Checkout fast path. One conditional find_one_and_update claims the order
+    (not paid yet) and completes it; the payment, the billing entry and the
+    outbox events (audit, customer stats) are written in the same
+    transaction where supported. The transaction number comes from the
+    sequence, never from a count.
+    """
     db = get_db()
     
-    # First process payment
-    payment_result = await process_order_payment(data)
-    
     order_id = data.get("orderId")
+    method = data.get("method", "cash")
+    amount = data.get("amount")
+    tips = data.get("tips", 0)
     
-    # Then mark order as completed
-    await db.orders.update_one(
-        {"_id": ObjectId(order_id)},
-        {"$set": {
+    if not order_id or not amount:
+        raise HTTPException(status_code=400, detail="orderId and amount are required")
+    if not ObjectId.is_valid(order_id):
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    transaction_id = await next_transaction_id()
+    payment_id = ObjectId()
+    now = datetime.utcnow()
+    
+    async def work(session):
+        order = await db.orders.find_one_and_update(
+            {"_id": ObjectId(order_id), "paymentStatus": {"$ne": "paid"}},
+            _checkout_update(method, str(payment_id), now),
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if order is None:
+            return None
+        
+        payment = {
+            "_id": payment_id,
+            "orderId": order_id,
+            "orderNumber": order.get("orderNumber"),
+            "tableNumber": order.get("tableNumber"),
+            "transactionId": transaction_id,
+            "amount": amount,
+            "tips": tips,
+            "total": amount + tips,
+            "method": method,
             "status": "completed",
-            "statusUpdatedAt": datetime.utcnow(),
-            "completedAt": datetime.utcnow()
-        }}
+            "createdAt": now
+        }
+        await db.payments.insert_one(payment, session=session)
+        await _settle_order_bill(db, order_id, str(payment_id), method, amount, tips, now, session)
+        
+        payment_result = {
+            "success": True,
+            "paymentId": str(payment_id),
+            "transactionId": transaction_id,
+            "amount": amount,
+            "method": method
+        }
+        # One audit entry for the whole checkout, carrying the payment
+        events = [audit_event("checkout", "order", order_id, details={
+            "paymentId": str(payment_id),
+            "amount": amount,
+            "tips": tips,
+            "method": method,
+            "transactionId": transaction_id,
+        })]
+        if order.get("status") != "completed" and order.get("customerId"):
+            events.append(order_completed_event(str(order["customerId"]), order_id, order.get("total")))
+        await enqueue_many(events, session=session)
+        return order, payment_result
+    
+    claimed = await run_in_transaction(db, work)
+    if claimed is None:
+        if await db.orders.count_documents({"_id": ObjectId(order_id)}, limit=1):
+            raise HTTPException(status_code=400, detail="Order already paid")
+        raise HTTPException(status_code=404, detail="Order not found")
+    previous_order, payment_result = claimed
+    notify_committed()
+    invalidate_stats(BILLING_STATS)
+    
+    previous_status = previous_order.get("status")
+    results = await asyncio.gather(
+        record_update("orders", previous_order, {"$set": {"status": "completed"}}),
+        record_status_change(previous_order, previous_status, "completed"),
+        publish_order_status(previous_order, previous_status, "completed"),
+        return_exceptions=True
     )
-    
-    await log_audit("checkout", "order", order_id, {
-        "payment": payment_result
-    })
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"[Billing] Checkout side effect failed for order {order_id}: {result}")
     
     return {
         "success": True,
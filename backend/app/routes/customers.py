@@ -11,9 +11,19 @@ from datetime import datetime
 from bson import ObjectId
 from ..db import get_db
 from ..audit import log_audit
+from ..indexes import declare_index
+from ..pagination import paginate, page_meta
+from ..outbox import register_outbox_handler
 
 router = APIRouter(tags=["Customers"])
 
+ORDER_COMPLETED_TOPIC = "customer.order_completed"
+# Order ids remembered per customer so a redelivered event is not counted twice
+RECENT_ORDER_IDS = 50
+
+declare_index("customers", [("name", 1), ("_id", 1)])
+declare_index("loyalty_transactions", [("customerId", 1), ("timestamp", -1)])
+
 
 def serialize_doc(doc):
     """Convert MongoDB document to JSON-serializable dict"""
@@ -32,6 +42,51 @@ def calculate_customer_type(total_orders: int, total_spend: float) -> str:
     return "New"
 
 
+def customer_type_expression(orders_expr, spend_expr) -> dict:
+    """Server-side version of calculate_customer_type"""
+    return {"$switch": {
+        "branches": [
+            {"case": {"$or": [{"$gte": [orders_expr, 30]}, {"$gte": [spend_expr, 20000]}]}, "then": "VIP"},
+            {"case": {"$or": [{"$gte": [orders_expr, 5]}, {"$gte": [spend_expr, 2000]}]}, "then": "Regular"},
+        ],
+        "default": "New",
+    }}
+
+
+def order_completed_event(customer_id: str, order_id: str, total: float) -> tuple:
+    """Outbox event that adds a completed order to the customer's stats"""
+    return ORDER_COMPLETED_TOPIC, {"customerId": customer_id, "orderId": order_id, "total": total or 0}
+
+
+async def _deliver_order_completed(payload: dict, event_id: str):
+    customer_id = payload.get("customerId")
+    if not customer_id or not ObjectId.is_valid(customer_id):
+        return
+    db = get_db()
+    orders = {"$add": [{"$ifNull": ["$totalOrders", 0]}, 1]}
+    spend = {"$add": [{"$ifNull": ["$totalSpend", 0]}, payload.get("total", 0)]}
+    # Matches nothing if this order was already counted
+    await db.customers.update_one(
+        {"_id": ObjectId(customer_id), "recentOrderIds": {"$ne": payload["orderId"]}},
+        [
+            {"$set": {
+                "type": customer_type_expression(orders, spend),
+                "totalOrders": orders,
+                "totalSpend": spend,
+                "lastVisit": datetime.utcnow().isoformat(),
+                "updatedAt": datetime.utcnow(),
+                "recentOrderIds": {"$slice": [
+                    {"$concatArrays": [{"$ifNull": ["$recentOrderIds", []]}, [payload["orderId"]]]},
+                    -RECENT_ORDER_IDS
+                ]},
+            }},
+        ]
+    )
+
+
+register_outbox_handler(ORDER_COMPLETED_TOPIC, _deliver_order_completed)
+
+
 # ============ CUSTOMERS ============
 
 @router.get("")
@@ -41,8 +96,10 @@ async def list_customers(
     search: Optional[str] = None,
     limit: int = Query(100, le=500),
     skip: int = 0,
+    cursor: Optional[str] = None,
+    total_mode: str = "exact",
 ):
-    """Get all customers"""
+    """Get all customers, by name"""
     db = get_db()
     query = {}
     
@@ -57,10 +114,9 @@ async def list_customers(
             {"phone": {"$regex": search, "$options": "i"}},
         ]
     
-    customers = await db.customers.find(query).sort("name", 1).skip(skip).limit(limit).to_list(limit)
-    total = await db.customers.count_documents(query)
+    page = await paginate(db.customers, query, "name", 1, limit, cursor=cursor, skip=skip, total_mode=total_mode)
     
-    return {"data": [serialize_doc(c) for c in customers], "total": total}
+    return {"data": [serialize_doc(c) for c in page["docs"]], **page_meta(page)}
 
 
 @router.get("/stats")
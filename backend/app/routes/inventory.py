@@ -12,6 +12,7 @@ from datetime import datetime
 from bson import ObjectId
 from ..db import get_db
 from ..audit import log_audit
+from ..deduction import apply_ingredient_deductions
 
 router = APIRouter(tags=["Inventory"])
 
@@ -365,20 +366,11 @@ async def create_deduction(data: dict):
     result = await db.deduction_logs.insert_one(data)
     
     # Deduct from ingredients
+    totals = {}
     for item in data.get("ingredients", []):
-        if item.get("ingredientId") and item.get("amount"):
-            ingredient = await db.ingredients.find_one({"_id": ObjectId(item["ingredientId"])})
-            if ingredient:
-                new_stock = max(0, ingredient.get("stockLevel", 0) - item["amount"])
-                status = calculate_status(new_stock, ingredient.get("minThreshold", 10))
-                await db.ingredients.update_one(
-                    {"_id": ObjectId(item["ingredientId"])},
-                    {"$set": {
-                        "stockLevel": new_stock,
-                        "status": status,
-                        "lastDeduction": datetime.utcnow()
-                    }}
-                )
+        if item.get("ingredientId") and item.get("amount") and ObjectId.is_valid(str(item["ingredientId"])):
+            totals[str(item["ingredientId"])] = totals.get(str(item["ingredientId"]), 0) + item["amount"]
+    await apply_ingredient_deductions(totals)
     
     created = await db.deduction_logs.find_one({"_id": result.inserted_id})
     return serialize_doc(created)
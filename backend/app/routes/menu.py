@@ -14,6 +14,7 @@ from bson.errors import InvalidId
 from ..db import get_db
 from ..audit import log_audit
 from ..schemas import MenuItemIn, MenuItemUpdate
+from ..catalog_cache import invalidate_catalog
 
 router = APIRouter(tags=["Menu"])
 
@@ -217,6 +218,7 @@ async def create_menu_item(data: MenuItemIn):
     menu_data["updatedAt"] = now
 
     result = await db.menu_items.insert_one(menu_data)
+    await invalidate_catalog()
     created = await db.menu_items.find_one({"_id": result.inserted_id})
 
     await log_audit("create", "menu", str(result.inserted_id), {
@@ -242,6 +244,7 @@ async def update_menu_item(item_id: str, data: MenuItemUpdate):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Menu item not found")
 
+    await invalidate_catalog()
     updated = await db.menu_items.find_one({"_id": obj_id})
 
     await log_audit("update", "menu", item_id, {
@@ -261,6 +264,7 @@ async def delete_menu_item(item_id: str):
         raise HTTPException(status_code=404, detail="Menu item not found")
 
     await db.menu_items.delete_one({"_id": obj_id})
+    await invalidate_catalog()
 
     await log_audit("delete", "menu", item_id, {
         "name": item.get("name")
@@ -292,6 +296,7 @@ async def toggle_availability(item_id: str, available: Optional[bool] = None):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Menu item not found")
 
+    await invalidate_catalog()
     return {"success": True, "available": available}
 
 
@@ -8,11 +8,37 @@ from fastapi import APIRouter, HTTPException, Query
 from typing import Optional
 from datetime import datetime
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from ..db import get_db
 from ..audit import log_audit
+from ..status_counters import record_insert, record_inserts, tracked_update, tracked_delete, reconcile_counters, get_counters
+from ..indexes import declare_index
+from ..outbox import register_outbox_handler
 
 router = APIRouter(tags=["Notifications"])
 
+declare_index("notifications", [("created_at", -1)])
+
+NOTIFICATION_TOPIC = "notification"
+
+
+def notification_event(notification: dict) -> tuple:
+    """Outbox event that inserts `notification`"""
+    return NOTIFICATION_TOPIC, notification
+
+
+async def _deliver_notification(payload: dict, event_id: str):
+    db = get_db()
+    notification = {**payload, "_id": ObjectId(event_id)}
+    try:
+        await db.notifications.insert_one(notification)
+    except DuplicateKeyError:
+        return  # delivered before
+    await record_insert("notifications", notification)
+
+
+register_outbox_handler(NOTIFICATION_TOPIC, _deliver_notification)
+
 
 # ==========================================================
 # Utility
@@ -75,16 +101,12 @@ async def list_notifications(
 
 @router.get("/stats")
 async def get_notification_stats():
-    db = get_db()
-
-    total = await db.notifications.count_documents({})
-    unread = await db.notifications.count_documents({"status": "unread"})
-    read = await db.notifications.count_documents({"status": "read"})
+    counters = await get_counters("notifications")
 
     return {
-        "total": total,
-        "unread": unread,
-        "read": read,
+        "total": counters["total"],
+        "unread": counters["counts"].get("unread", 0),
+        "read": counters["counts"].get("read", 0),
     }
 
 
@@ -120,6 +142,7 @@ async def create_notification(data: dict):
     }
 
     result = await db.notifications.insert_one(notification)
+    await record_insert("notifications", notification)
     created = await db.notifications.find_one(
         {"_id": result.inserted_id}
     )
@@ -138,7 +161,8 @@ async def send_notification(notification_id: Optional[str] = None, data: Optiona
         if not notification:
             raise HTTPException(status_code=404, detail="Notification not found")
 
-        await db.notifications.update_one(
+        await tracked_update(
+            "notifications",
             {"_id": ObjectId(notification_id)},
             {"$set": {
                 "status": "sent",
@@ -163,6 +187,7 @@ async def send_notification(notification_id: Optional[str] = None, data: Optiona
     data["sentAt"] = datetime.utcnow()
 
     result = await db.notifications.insert_one(data)
+    await record_insert("notifications", data)
     created = await db.notifications.find_one({"_id": result.inserted_id})
 
     await log_audit("send", "notification", str(result.inserted_id), {
@@ -183,7 +208,8 @@ async def retry_notification(notification_id: str):
         raise HTTPException(status_code=404, detail="Notification not found")
 
     # Simulate retry
-    await db.notifications.update_one(
+    await tracked_update(
+        "notifications",
         {"_id": ObjectId(notification_id)},
         {"$set": {
             "status": "sent",
@@ -198,16 +224,15 @@ async def retry_notification(notification_id: str):
 
 @router.delete("/{notification_id}")
 async def delete_notification(notification_id: str):
-    db = get_db()
-
     try:
-        result = await db.notifications.delete_one(
+        deleted = await tracked_delete(
+            "notifications",
             {"_id": ObjectId(notification_id)}
         )
     except:
         raise HTTPException(status_code=400, detail="Invalid ID")
 
-    if result.deleted_count == 0:
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Notification not found")
 
     return {"success": True}
@@ -219,9 +244,8 @@ async def delete_notification(notification_id: str):
 
 @router.patch("/{notification_id}/read")
 async def mark_as_read(notification_id: str):
-    db = get_db()
-
-    await db.notifications.update_one(
+    await tracked_update(
+        "notifications",
         {"_id": ObjectId(notification_id)},
         {"$set": {"status": "read"}}
     )
@@ -237,6 +261,7 @@ async def mark_all_read():
         {"status": "unread"},
         {"$set": {"status": "read"}}
     )
+    await reconcile_counters("notifications")
 
     return {"success": True}
 
@@ -271,6 +296,7 @@ async def send_broadcast(data: dict):
 
     if notifications:
         await db.notifications.insert_many(notifications)
+        await record_inserts("notifications", notifications)
 
     await log_audit("broadcast", "notification", None, {"count": len(recipients)})
 
@@ -1,20 +1,29 @@
 """
 Offers & Loyalty Routes
-- Coupons CRUD
+- Coupons CRUD, atomic redemption and best-coupon lookup
 - Membership plans
 - Loyalty configuration
 """
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
 from typing import Optional
 from datetime import datetime
 from bson import ObjectId
 from bson.errors import InvalidId
 from ..db import get_db
 from ..audit import log_audit
+from ..indexes import declare_index
+from ..pricing import invalidate_pricing
+from ..coupons import (
+    best_coupon, coupon_discount, invalidate_coupons, redeem_coupon, rejection_reason, window_fields,
+)
 
 router = APIRouter(tags=["Offers"])
 
+declare_index("coupons", [("code", 1)])
+declare_index("coupons", [("status", 1), ("createdAt", -1)])
+declare_index("coupons", [("status", 1), ("validUntilAt", 1)])
+
 ALLOWED_MEMBERSHIP_TIERS = {"silver", "gold", "platinum"}
 TIER_DISPLAY_NAMES = {
     "silver": "Silver",
@@ -72,17 +81,15 @@ async def list_coupons(
     if search:
         query["code"] = {"$regex": search, "$options": "i"}
     
-    coupons = await db.coupons.find(query).sort("createdAt", -1).to_list(200)
-    
     # Update expired status
-    now = datetime.utcnow().isoformat()[:10]
-    for coupon in coupons:
-        if coupon.get("status") == "active" and coupon.get("valid_to", "") < now:
-            coupon["status"] = "expired"
-            await db.coupons.update_one(
-                {"_id": coupon["_id"]},
-                {"$set": {"status": "expired"}}
-            )
+    expired = await db.coupons.update_many(
+        {"status": "active", "validUntilAt": {"$lte": datetime.utcnow()}},
+        {"$set": {"status": "expired"}}
+    )
+    if expired.modified_count:
+        await invalidate_coupons()
+    
+    coupons = await db.coupons.find(query).sort("createdAt", -1).to_list(200)
     
     return [serialize_doc(coupon) for coupon in coupons]
 
@@ -120,37 +127,84 @@ async def validate_coupon(code: str, order_total: float = 0):
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
     
-    now = datetime.utcnow().isoformat()[:10]
-    
-    if coupon.get("status") != "active":
-        raise HTTPException(status_code=400, detail="Coupon is not active")
-    
-    if coupon.get("valid_from", "") > now:
-        raise HTTPException(status_code=400, detail="Coupon is not yet valid")
-    
-    if coupon.get("valid_to", "") < now:
-        raise HTTPException(status_code=400, detail="Coupon has expired")
-    
-    if coupon.get("usage_count", 0) >= coupon.get("usage_limit", float("inf")):
-        raise HTTPException(status_code=400, detail="Coupon usage limit reached")
-    
-    if order_total < coupon.get("min_order", 0):
-        raise HTTPException(status_code=400, detail=f"Minimum order amount is ₹{coupon.get('min_order')}")
-    
-    # Calculate discount
-    if coupon.get("type") == "percentage":
-        discount = order_total * coupon.get("value", 0) / 100
-        if coupon.get("max_discount"):
-            discount = min(discount, coupon["max_discount"])
-    else:
-        discount = coupon.get("value", 0)
+    reason = rejection_reason(coupon, order_total)
+    if reason:
+        raise HTTPException(status_code=400, detail=reason)
     
     return {
         "valid": True,
         "code": coupon["code"],
         "type": coupon["type"],
         "value": coupon["value"],
-        "discount": round(discount, 2),
+        "discount": coupon_discount(coupon, order_total),
+    }
+
+
+@router.get("/coupons/best-coupon")
+async def get_best_coupon(order_total: float = Query(..., ge=0)):
+    """Active coupon giving the largest discount on an order total (served from memory)"""
+    coupon, discount = await best_coupon(order_total)
+    if coupon is None:
+        return {"found": False, "orderTotal": order_total, "discount": 0, "coupon": None}
+    return {
+        "found": True,
+        "orderTotal": order_total,
+        "discount": discount,
+        "coupon": {field: coupon.get(field) for field in (
+            "_id", "code", "type", "value", "min_order", "max_discount", "valid_to"
+        )},
+    }
+
+
+async def _redeem_or_raise(match: dict, order_total: float = None) -> dict:
+    """Redeem atomically; on failure, explain why with the coupon as it is now"""
+    coupon = await redeem_coupon(match, order_total)
+    if coupon is not None:
+        return coupon
+    current = await get_db().coupons.find_one(match)
+    if not current:
+        raise HTTPException(status_code=404, detail="Coupon not found")
+    reason = rejection_reason(current, order_total)
+    raise HTTPException(status_code=400 if reason else 409,
+                        detail=reason or "Coupon changed while redeeming, please retry")
+
+
+@router.post("/coupons/redeem")
+async def redeem_coupon_code(data: dict):
+    """
+    Validate a coupon code and count one use in a single atomic update.
+    
+    Request body:
+    {
+        "code": "SAVE10",
+        "orderTotal": 850.00,
+        "orderId": "..."  // optional, kept on the audit entry
+    }
+    """
+    code = str(data.get("code") or "").strip().upper()
+    if not code:
+        raise HTTPException(status_code=400, detail="code is required")
+    try:
+        order_total = float(data.get("orderTotal", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="orderTotal must be a number")
+    
+    coupon = await _redeem_or_raise({"code": code}, order_total)
+    discount = coupon_discount(coupon, order_total)
+    await log_audit("redeem", "coupon", str(coupon["_id"]), {
+        "code": code,
+        "orderId": data.get("orderId"),
+        "discount": discount
+    })
+    
+    return {
+        "success": True,
+        "code": code,
+        "type": coupon.get("type"),
+        "value": coupon.get("value"),
+        "discount": discount,
+        "usage_count": coupon.get("usage_count"),
+        "usage_limit": coupon.get("usage_limit"),
     }
 
 
@@ -180,8 +234,10 @@ async def create_coupon(data: dict, request: Request):
     data["createdAt"] = datetime.utcnow()
     data["status"] = data.get("status", "active")
     data["usage_count"] = 0
+    data.update(window_fields({"valid_from": data.get("valid_from"), "valid_to": data.get("valid_to")}))
     
     result = await db.coupons.insert_one(data)
+    await invalidate_coupons()
     created = await db.coupons.find_one({"_id": result.inserted_id})
     
     await log_audit("create", "coupon", str(result.inserted_id), {"code": data.get("code")})
@@ -200,6 +256,7 @@ async def update_coupon(coupon_id: str, data: dict, request: Request):
     
     if data.get("code"):
         data["code"] = data["code"].upper()
+    data.update(window_fields(data))
     
     result = await db.coupons.update_one(
         {"_id": ObjectId(coupon_id)},
@@ -208,6 +265,7 @@ async def update_coupon(coupon_id: str, data: dict, request: Request):
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Coupon not found")
+    await invalidate_coupons()
     
     updated = await db.coupons.find_one({"_id": ObjectId(coupon_id)})
     await log_audit("update", "coupon", coupon_id)
@@ -216,19 +274,14 @@ async def update_coupon(coupon_id: str, data: dict, request: Request):
 
 
 @router.post("/coupons/{coupon_id}/use")
-async def use_coupon(coupon_id: str):
-    """Increment coupon usage count"""
-    db = get_db()
-    
-    result = await db.coupons.update_one(
-        {"_id": ObjectId(coupon_id)},
-        {"$inc": {"usage_count": 1}}
-    )
-    
-    if result.matched_count == 0:
+async def use_coupon(coupon_id: str, order_total: Optional[float] = None):
+    """Count one use of a coupon, only while it is active, valid and under its usage limit"""
+    if not ObjectId.is_valid(coupon_id):
         raise HTTPException(status_code=404, detail="Coupon not found")
     
-    return {"success": True}
+    coupon = await _redeem_or_raise({"_id": ObjectId(coupon_id)}, order_total)
+    
+    return {"success": True, "usage_count": coupon.get("usage_count")}
 
 
 @router.delete("/coupons/{coupon_id}")
@@ -240,6 +293,7 @@ async def delete_coupon(coupon_id: str, request: Request):
     result = await db.coupons.delete_one({"_id": ObjectId(coupon_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Coupon not found")
+    await invalidate_coupons()
     
     await log_audit("delete", "coupon", coupon_id)
     
@@ -316,6 +370,7 @@ async def create_membership(data: dict, request: Request):
     data["status"] = data.get("status", "active")
     
     result = await db.membership_plans.insert_one(data)
+    await invalidate_pricing()
     created = await db.membership_plans.find_one({"_id": result.inserted_id})
     
     await log_audit("create", "membership", str(result.inserted_id))
@@ -354,6 +409,7 @@ async def update_membership(plan_id: str, data: dict, request: Request):
         {"_id": ObjectId(plan_id)},
         {"$set": data}
     )
+    await invalidate_pricing()
     
     updated = await db.membership_plans.find_one({"_id": ObjectId(plan_id)})
     return serialize_doc(updated)
@@ -368,6 +424,7 @@ async def delete_membership(plan_id: str, request: Request):
     result = await db.membership_plans.delete_one({"_id": ObjectId(plan_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Plan not found")
+    await invalidate_pricing()
     
     return {"success": True}
 
@@ -2,67 +2,51 @@
 Order Management Routes
 - CRUD for orders
 - Order status updates
+- Bulk ingestion for aggregator / online-channel feeds
 - Order statistics
+- Kitchen display push channel (SSE / WebSocket)
 """
 
-from fastapi import APIRouter, HTTPException, Query
+import asyncio
+import json
+import os
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from typing import Optional, List
-from datetime import datetime, timedelta
+from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 from ..db import get_db
-from ..audit import log_audit
+from ..audit import log_audit, audit_event
+from ..events import publish, subscribe
+from ..status_counters import record_insert, record_inserts, record_update, tracked_update, get_counters
+from ..rollups import (
+    record_order_created, record_orders_created, record_order_updated, record_status_change,
+    parse_datetime, get_day_bucket,
+)
+from ..sequences import next_order_number, reserve_order_numbers
+from ..prep_metrics import get_prep_time_stats, dimension as prep_dimension
+from ..indexes import declare_index
+from ..pagination import paginate, page_meta
+from ..order_lifecycle import ORDER_STATUSES, transition_order_status, run_in_transaction
+from ..outbox import enqueue_many, notify_committed
+from .notifications import notification_event
 
 
-# Helper function to create billing entry when order is served
-async def create_billing_entry_for_order(db, order_id: str, order: dict):
-    """Create a billing entry when order is marked as served"""
-    try:
-        # Check if billing entry already exists
-        existing_billing = await db.billing.find_one({"orderId": order_id})
-        if existing_billing:
-            return  # Already has billing entry
-        
-        # Create billing entry
-        billing_entry = {
-            "orderId": order_id,
-            "orderNumber": order.get("orderNumber", f"#ORD-{order_id[:8]}"),
-            "tableNumber": order.get("tableNumber"),
-            "customerName": order.get("customerName", "Customer"),
-            "items": order.get("items", []),
-            "subtotal": order.get("total", 0),
-            "taxRate": 5.0,  # Default GST rate
-            "taxAmount": order.get("total", 0) * 0.05,
-            "discountAmount": 0,
-            "grandTotal": order.get("total", 0) * 1.05,
-            "status": "pending_payment",
-            "type": order.get("type", "dine-in"),
-            "waiterId": order.get("waiterId"),
-            "waiterName": order.get("waiterName"),
-            "createdAt": datetime.utcnow().isoformat() + 'Z',
-            "servedAt": datetime.utcnow().isoformat() + 'Z',
-        }
-        
-        result = await db.billing.insert_one(billing_entry)
-        
-        # Update order with billing reference
-        await db.orders.update_one(
-            {"_id": ObjectId(order_id)},
-            {"$set": {
-                "billingId": str(result.inserted_id),
-                "paymentStatus": "pending_payment",
-                "servedAt": datetime.utcnow().isoformat() + 'Z'
-            }}
-        )
-        
-        print(f"Created billing entry {result.inserted_id} for order {order_id}")
-        
-    except Exception as e:
-        print(f"Error creating billing entry for order {order_id}: {e}")
-        # Don't fail the order status update if billing creation fails
-        pass
-
 router = APIRouter(tags=["Orders"])
 
+declare_index("orders", [("status", 1), ("createdAt", -1)])
+declare_index("orders", [("createdAt", -1), ("_id", -1)])
+declare_index("orders", [("status", 1), ("paymentStatus", 1), ("servedAt", -1)])
+declare_index("orders", [("customerId", 1), ("createdAt", -1)])
+declare_index("billing", [("orderId", 1)])
+# Client-supplied key of a bulk-ingested order (e.g. the aggregator's order id)
+declare_index("orders", [("idempotencyKey", 1)], unique=True,
+              partialFilterExpression={"idempotencyKey": {"$type": "string"}})
+
+ORDER_BULK_MAX = int(os.getenv("ORDER_BULK_MAX", "500"))
+
 
 def serialize_doc(doc):
     """Convert MongoDB document to JSON-serializable dict"""
@@ -110,8 +94,13 @@ async def list_orders(
     date_to: Optional[str] = None,
     limit: int = Query(100, le=500),
     skip: int = 0,
+    cursor: Optional[str] = None,
+    total_mode: str = "exact",
 ):
-    """Get all orders with optional filters"""
+    """
+    Get all orders with optional filters.
+    Pass the returned `nextCursor` as `cursor` for the next page; `skip` still works.
+    """
     db = get_db()
     query = {}
     
@@ -131,50 +120,33 @@ async def list_orders(
         else:
             query["createdAt"] = {"$lte": datetime.fromisoformat(date_to)}
     
-    orders = await db.orders.find(query).sort("createdAt", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.orders.count_documents(query)
+    page = await paginate(db.orders, query, "createdAt", -1, limit, cursor=cursor, skip=skip, total_mode=total_mode)
     
-    return {"data": [serialize_doc(order) for order in orders], "total": total}
+    return {"data": [serialize_doc(order) for order in page["docs"]], **page_meta(page)}
 
 
 @router.get("/stats")
 async def get_order_stats():
-    """Get order statistics"""
-    db = get_db()
-    
-    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    total_today = await db.orders.count_documents({"createdAt": {"$gte": today}})
-    pending = await db.orders.count_documents({"status": {"$in": ["placed", "preparing"]}})
-    ready = await db.orders.count_documents({"status": "ready"})
-    completed_today = await db.orders.count_documents({
-        "status": "completed",
-        "createdAt": {"$gte": today}
-    })
-    
-    # Revenue today
-    revenue_pipeline = [
-        {"$match": {"createdAt": {"$gte": today}, "status": {"$ne": "cancelled"}}},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}}}
-    ]
-    revenue_result = await db.orders.aggregate(revenue_pipeline).to_list(1)
-    revenue_today = revenue_result[0]["total"] if revenue_result else 0
-    
-    # Orders by type
-    type_pipeline = [
-        {"$match": {"createdAt": {"$gte": today}}},
-        {"$group": {"_id": "$type", "count": {"$sum": 1}}}
-    ]
-    type_result = await db.orders.aggregate(type_pipeline).to_list(10)
-    by_type = {t["_id"]: t["count"] for t in type_result if t["_id"]}
+    """
+    Get order statistics.
+    Live status counts come from the status counters, today's totals from
+    today's analytics rollup bucket: two document reads.
+    """
+    counters, today = await asyncio.gather(
+        get_counters("orders"),
+        get_day_bucket(datetime.utcnow())
+    )
+    counts = counters["counts"]
+    today = today or {}
+    by_status = today.get("byStatus") or {}
     
     return {
-        "totalToday": total_today,
-        "pending": pending,
-        "ready": ready,
-        "completedToday": completed_today,
-        "revenueToday": revenue_today,
-        "byType": by_type,
+        "totalToday": today.get("orders", 0),
+        "pending": counts.get("placed", 0) + counts.get("preparing", 0),
+        "ready": counts.get("ready", 0),
+        "completedToday": by_status.get("completed", 0),
+        "revenueToday": today.get("revenue", 0) - today.get("cancelledRevenue", 0),
+        "byType": {t: n for t, n in (today.get("byType") or {}).items() if n and t != "unknown"},
     }
 
 
@@ -205,14 +177,16 @@ async def create_order(data: dict):
         data["id"] = str(new_id)
 
         # Generate order number
-        count = await db.orders.count_documents({})
-        data["orderNumber"] = f"#ORD-{count + 1001}"
+        data["orderNumber"] = await next_order_number()
         data["createdAt"] = datetime.utcnow().isoformat() + 'Z'
         data["status"] = data.get("status", "placed")
         data["statusUpdatedAt"] = datetime.utcnow().isoformat() + 'Z'
 
         await db.orders.insert_one(data)
+        await record_order_created(data)
+        await record_insert("orders", data)
         created = await db.orders.find_one({"_id": new_id})
+        await publish_kitchen_event("order.placed", str(new_id), order=_kitchen_order(dict(created)))
         
         # Try to log audit but don't fail if it doesn't work
         try:
@@ -231,6 +205,185 @@ async def create_order(data: dict):
         raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
 
 
+def _bulk_order_error(data) -> Optional[str]:
+    """Why an order of a bulk batch is rejected, or None"""
+    if not isinstance(data, dict):
+        return "Order must be an object"
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return "items must be a non-empty list"
+    for item in items:
+        if not isinstance(item, dict) or not item.get("name"):
+            return "Every item needs a name"
+        quantity = item.get("quantity", 1)
+        if not isinstance(quantity, (int, float)) or quantity <= 0:
+            return f"Invalid quantity for '{item.get('name')}'"
+    total = data.get("total")
+    if total is not None and (not isinstance(total, (int, float)) or total < 0):
+        return "total must be a non-negative number"
+    if data.get("status", "placed") not in ORDER_STATUSES:
+        return f"Invalid status. Must be one of: {ORDER_STATUSES}"
+    key = data.get("idempotencyKey")
+    if key is not None and (not isinstance(key, str) or not key.strip()):
+        return "idempotencyKey must be a non-empty string"
+    return None
+
+
+@router.post("/bulk")
+async def create_orders_bulk(data: dict):
+    """
+    Create a batch of orders in one request: {"orders": [...]}.
+
+    Each order is validated on its own and gets a per-item result
+    (created / duplicate / invalid / failed), so one bad order does not
+    reject the batch. Orders carrying an `idempotencyKey` are created at most
+    once: a retried batch returns the existing orders as duplicates.
+    Order numbers are reserved in one block and the orders are written with
+    a single insert_many.
+    """
+    orders = data.get("orders")
+    if not isinstance(orders, list) or not orders:
+        raise HTTPException(status_code=400, detail="orders must be a non-empty list")
+    if len(orders) > ORDER_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {ORDER_BULK_MAX} orders per batch")
+
+    db = get_db()
+    results = [None] * len(orders)
+    pending = []
+    first_with_key = {}
+    for index, order in enumerate(orders):
+        error = _bulk_order_error(order)
+        if error:
+            results[index] = {"index": index, "status": "invalid", "error": error}
+            continue
+        key = order.get("idempotencyKey")
+        if key in first_with_key:
+            # Same key twice in one batch: resolved from the first one below
+            results[index] = {"index": index, "status": "duplicate", "idempotencyKey": key}
+            continue
+        if key is not None:
+            first_with_key[key] = index
+        pending.append(index)
+
+    def _duplicate(index: int, order: dict) -> dict:
+        return {
+            "index": index,
+            "status": "duplicate",
+            "id": str(order["_id"]),
+            "orderNumber": order.get("orderNumber"),
+            "idempotencyKey": order.get("idempotencyKey"),
+        }
+
+    async def _existing(keys) -> dict:
+        # A generator is truthy even when it yields nothing
+        keys = list(keys)
+        if not keys:
+            return {}
+        found = db.orders.find(
+            {"idempotencyKey": {"$in": keys}},
+            {"orderNumber": 1, "idempotencyKey": 1}
+        )
+        return {doc["idempotencyKey"]: doc async for doc in found}
+
+    # Orders already ingested by an earlier attempt of this batch
+    existing = await _existing(first_with_key)
+    for index in list(pending):
+        key = orders[index].get("idempotencyKey")
+        if key in existing:
+            results[index] = _duplicate(index, existing[key])
+            pending.remove(index)
+
+    docs = []
+    if pending:
+        numbers = await reserve_order_numbers(len(pending))
+        now = datetime.utcnow().isoformat() + 'Z'
+        for index, number in zip(pending, numbers):
+            doc = dict(orders[index])
+            doc.pop("id", None)
+            new_id = ObjectId()
+            doc.update({
+                "_id": new_id,
+                "id": str(new_id),
+                "orderNumber": number,
+                "createdAt": now,
+                "status": doc.get("status", "placed"),
+                "statusUpdatedAt": now,
+            })
+            docs.append(doc)
+
+    rejected = {}
+    if docs:
+        try:
+            await db.orders.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            rejected = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        except Exception as e:
+            print(f"[Orders] Bulk insert failed: {e}")
+            rejected = {position: {"errmsg": str(e)} for position in range(len(docs))}
+
+    # A concurrent retry may have inserted the same key first
+    raced = await _existing(
+        docs[position].get("idempotencyKey") for position, error in rejected.items()
+        if error.get("code") == 11000 and docs[position].get("idempotencyKey")
+    )
+    created = []
+    for position, doc in enumerate(docs):
+        index = pending[position]
+        error = rejected.get(position)
+        if error is None:
+            created.append(doc)
+            results[index] = {
+                "index": index,
+                "status": "created",
+                "id": str(doc["_id"]),
+                "orderNumber": doc["orderNumber"],
+                "idempotencyKey": doc.get("idempotencyKey"),
+            }
+        elif doc.get("idempotencyKey") in raced:
+            results[index] = _duplicate(index, raced[doc["idempotencyKey"]])
+        else:
+            results[index] = {"index": index, "status": "failed", "error": error.get("errmsg", "Insert failed")}
+
+    # In-batch repeats of a key point at whatever the first occurrence became
+    for index, result in enumerate(results):
+        if result["status"] == "duplicate" and "id" not in result:
+            first = results[first_with_key[result["idempotencyKey"]]]
+            if first.get("id"):
+                result.update(id=first["id"], orderNumber=first.get("orderNumber"))
+            else:
+                results[index] = {**first, "index": index}
+
+    if created:
+        side_effects = await asyncio.gather(
+            record_orders_created(created),
+            record_inserts("orders", created),
+            enqueue_many([
+                audit_event("create", "order", str(doc["_id"]), details={
+                    "orderNumber": doc["orderNumber"],
+                    "total": doc.get("total"),
+                    "idempotencyKey": doc.get("idempotencyKey"),
+                    "bulk": True,
+                })
+                for doc in created
+            ]),
+            *(publish_kitchen_event("order.placed", str(doc["_id"]), order=_kitchen_order(dict(doc)))
+              for doc in created),
+            return_exceptions=True
+        )
+        for result in side_effects:
+            if isinstance(result, Exception):
+                print(f"[Orders] Bulk side effect failed: {result}")
+
+    summary = {status: 0 for status in ("created", "duplicate", "invalid", "failed")}
+    for result in results:
+        summary[result["status"]] += 1
+    return {
+        "success": summary["invalid"] == 0 and summary["failed"] == 0,
+        **summary,
+        "results": results,
+    }
+
+
 @router.put("/{order_id}")
 async def update_order(order_id: str, data: dict):
     """Update order"""
@@ -240,29 +393,25 @@ async def update_order(order_id: str, data: dict):
     data.pop("_id", None)
     data.pop("id", None)  # Remove id field to prevent index conflicts
     
-    result = await db.orders.update_one(
+    previous = await tracked_update(
+        "orders",
         {"_id": ObjectId(order_id)},
         {"$set": data}
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Order not found")
     
     updated = await db.orders.find_one({"_id": ObjectId(order_id)})
+    await record_order_updated(previous, updated)
     await log_audit("update", "order", order_id)
     
     return serialize_doc(updated)
 
 
-# Helper function for inventory deduction (imported from recipes module)
-async def call_inventory_deduction(order_id: str, items: list):
-    """Helper to call inventory deduction from recipes module"""
-    from .recipes import deduct_inventory_for_order
-    return await deduct_inventory_for_order({"orderId": order_id, "items": items})
-
-
 @router.patch("/{order_id}/status")
-async def update_order_status(order_id: str, status: str, deduct_inventory: bool = True):
+async def update_order_status(order_id: str, status: str, deduct_inventory: bool = True,
+                              expected_status: Optional[str] = None):
     """
     Update order status with automatic flow integration.
     
@@ -272,80 +421,10 @@ async def update_order_status(order_id: str, status: str, deduct_inventory: bool
     - ready → served → completed: Updates billing/payment
     
     Query param `deduct_inventory` can be set to false to skip deduction (for re-printing etc.)
+    Query param `expected_status` makes the update conditional: 409 if the order has moved on.
+    The transition and its billing/payment effects commit atomically (see app/order_lifecycle.py).
     """
-    db = get_db()
-    
-    valid_statuses = ["placed", "preparing", "ready", "served", "completed", "cancelled"]
-    if status not in valid_statuses:
-        raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
-    
-    # Get current order to check previous status
-    order = await db.orders.find_one({"_id": ObjectId(order_id)})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    previous_status = order.get("status")
-    
-    # Update status
-    result = await db.orders.update_one(
-        {"_id": ObjectId(order_id)},
-        {"$set": {"status": status, "statusUpdatedAt": datetime.utcnow().isoformat() + 'Z'}}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # FLOW INTEGRATION: Trigger inventory deduction when order starts preparing
-    inventory_deducted = False
-    deduction_result = None
-    
-    if status == "preparing" and deduct_inventory:
-        items = order.get("items", [])
-        if items:
-            try:
-                deduction_result = await call_inventory_deduction(order_id, items)
-                inventory_deducted = True
-            except Exception as e:
-                # Log but don't fail the order update
-                print(f"Inventory deduction error: {e}")
-    
-    # FLOW INTEGRATION: Create notification for kitchen/waiter
-    if status == "ready":
-        notification = {
-            "type": "order_ready",
-            "orderId": order_id,
-            "orderNumber": order.get("orderNumber"),
-            "tableNumber": order.get("tableNumber"),
-            "message": f"Order {order.get('orderNumber')} is ready for serving",
-            "createdAt": datetime.utcnow().isoformat() + 'Z'
-        }
-        await db.notifications.insert_one(notification)
-    
-    # FLOW INTEGRATION: Create billing entry when order is served
-    if status == "served" and previous_status != "served":
-        # Create billing entry for the served order
-        await create_billing_entry_for_order(db, order_id, order)
-    
-    # FLOW INTEGRATION: Update payment when completed
-    if status == "completed" and order.get("paymentStatus") != "paid":
-        await db.orders.update_one(
-            {"_id": ObjectId(order_id)},
-            {"$set": {"paymentStatus": "settled", "completedAt": datetime.utcnow().isoformat() + 'Z'}}
-        )
-    
-    await log_audit("status_update", "order", order_id, {
-        "newStatus": status,
-        "previousStatus": previous_status,
-        "inventoryDeducted": inventory_deducted
-    })
-    
-    return {
-        "success": True, 
-        "status": status,
-        "previousStatus": previous_status,
-        "inventoryDeducted": inventory_deducted,
-        "deductionResult": deduction_result
-    }
+    return await transition_order_status(order_id, status, deduct_inventory, expected_status)
 
 
 @router.delete("/{order_id}")
@@ -353,48 +432,103 @@ async def delete_order(order_id: str):
     """Delete order (soft delete - mark as cancelled)"""
     db = get_db()
     
-    # Get order details before cancelling
-    order = await db.orders.find_one({"_id": ObjectId(order_id)})
+    async def work(session):
+        order = await db.orders.find_one_and_update(
+            {"_id": ObjectId(order_id)},
+            {"$set": {"status": "cancelled", "cancelledAt": datetime.utcnow().isoformat() + 'Z'}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if order is None:
+            return None
+        
+        # Notification and audit entry are delivered from the outbox
+        order_number = order.get("orderNumber", "N/A")
+        table_number = order.get("tableNumber", "N/A")
+        total = order.get("total", 0)
+        await enqueue_many([
+            notification_event({
+                "type": "order-cancelled",
+                "title": f"Order {order_number} Cancelled",
+                "message": f"Table {table_number} - Order cancelled (₹{total:.2f})",
+                "recipient": "Admin",
+                "channel": "system",
+                "status": "unread",
+                "created_at": datetime.utcnow(),
+            }),
+            audit_event("cancel", "order", order_id),
+        ], session=session)
+        return order
+    
+    order = await run_in_transaction(db, work)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    notify_committed()
     
-    result = await db.orders.update_one(
-        {"_id": ObjectId(order_id)},
-        {"$set": {"status": "cancelled", "cancelledAt": datetime.utcnow().isoformat() + 'Z'}}
+    await asyncio.gather(
+        record_update("orders", order, {"$set": {"status": "cancelled"}}),
+        record_status_change(order, order.get("status"), "cancelled"),
+        publish_kitchen_event("order.cancelled", order_id, previousStatus=order.get("status"))
     )
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Create notification for cancelled order
-    order_number = order.get("orderNumber", "N/A")
-    table_number = order.get("tableNumber", "N/A")
-    total = order.get("total", 0)
-    
-    await db.notifications.insert_one({
-        "type": "order-cancelled",
-        "title": f"Order {order_number} Cancelled",
-        "message": f"Table {table_number} - Order cancelled (₹{total:.2f})",
-        "recipient": "Admin",
-        "channel": "system",
-        "status": "unread",
-        "created_at": datetime.utcnow(),
-    })
-    
-    await log_audit("cancel", "order", order_id)
-    
     return {"success": True}
 
 
 # ============ KITCHEN DISPLAY ============
 
+KITCHEN_CHANNEL = "kitchen"
+KITCHEN_STATUSES = ["placed", "preparing", "ready"]
+KITCHEN_KEEPALIVE_SECONDS = 15
+
+
+def _kitchen_order(order: dict) -> dict:
+    """Serialized order with the timing info shown on kitchen screens"""
+    doc = serialize_doc(order)
+    created = parse_datetime(order.get("createdAt"))
+    if created:
+        elapsed = (datetime.utcnow() - created).total_seconds()
+        doc["elapsedMinutes"] = int(elapsed / 60)
+        # Add urgency flag
+        doc["isUrgent"] = elapsed > 600  # 10 minutes
+    return doc
+
+
+async def publish_kitchen_event(event_type: str, order_id: str, **fields):
+    """Push a change to every connected kitchen display"""
+    await publish(KITCHEN_CHANNEL, {
+        "type": event_type,
+        "orderId": order_id,
+        "at": datetime.utcnow().isoformat() + 'Z',
+        **fields
+    })
+
+
+async def publish_order_status(order: dict, previous_status: str, status: str):
+    """
+    Kitchen event for a status change. Carries the updated order so screens
+    can add orders entering the queue and drop the ones leaving it.
+    """
+    if previous_status == status:
+        return
+    if previous_status not in KITCHEN_STATUSES and status not in KITCHEN_STATUSES:
+        return
+    updated = {**order, "status": status, "statusUpdatedAt": datetime.utcnow().isoformat() + 'Z'}
+    await publish_kitchen_event(
+        "order.status",
+        str(order["_id"]),
+        status=status,
+        previousStatus=previous_status,
+        order=_kitchen_order(updated)
+    )
+
+
 @router.get("/kitchen/queue")
 async def get_kitchen_queue():
     """Get orders for kitchen display"""
     db = get_db()
     
     orders = await db.orders.find({
-        "status": {"$in": ["placed", "preparing", "ready"]}
+        "status": {"$in": KITCHEN_STATUSES}
     }).sort("createdAt", 1).to_list(50)
     
     return [serialize_doc(order) for order in orders]
@@ -413,6 +547,8 @@ async def update_item_status(order_id: str, item_index: int, status: str):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    await publish_kitchen_event("order.item_status", order_id, itemIndex=item_index, status=status)
+    
     return {"success": True}
 
 
@@ -453,68 +589,123 @@ async def complete_order_serving(order_id: str):
     return await update_order_status(order_id, "completed", deduct_inventory=False)
 
 
+async def _active_kitchen_orders(db):
+    orders = await db.orders.find({
+        "status": {"$in": KITCHEN_STATUSES}
+    }).sort([
+        ("status", 1),  # placed first, then preparing, then ready
+        ("createdAt", 1)  # oldest first within status
+    ]).to_list(100)
+    return [_kitchen_order(order) for order in orders]
+
+
 @router.get("/kitchen/active-orders")
 async def get_active_kitchen_orders():
     """
     Get all active orders for kitchen display.
     Returns orders in: placed, preparing, ready states
     """
+    return await _active_kitchen_orders(get_db())
+
+
+async def _kitchen_feed():
+    """
+    Snapshot of the active orders followed by every kitchen event.
+
+    Yields (event, data) pairs, or None when nothing happened for
+    KITCHEN_KEEPALIVE_SECONDS. The subscription is opened before the snapshot
+    is read so no change falls in between; a screen that falls too far behind
+    gets a fresh snapshot instead of the events it missed.
+    """
     db = get_db()
-    
-    orders = await db.orders.find({
-        "status": {"$in": ["placed", "preparing", "ready"]}
-    }).sort([
-        ("status", 1),  # placed first, then preparing, then ready
-        ("createdAt", 1)  # oldest first within status
-    ]).to_list(100)
-    
-    # Enhance with timing info
-    result = []
-    for order in orders:
-        doc = serialize_doc(order)
-        # Calculate time elapsed
-        created = order.get("createdAt")
-        if created:
-            elapsed = (datetime.utcnow() - created).total_seconds()
-            doc["elapsedMinutes"] = int(elapsed / 60)
-            # Add urgency flag
-            doc["isUrgent"] = elapsed > 600  # 10 minutes
-        result.append(doc)
-    
-    return result
+    while True:
+        subscription = subscribe(KITCHEN_CHANNEL)
+        try:
+            yield "snapshot", {"orders": await _active_kitchen_orders(db)}
+            while not subscription.overflowed:
+                message = await subscription.get(timeout=KITCHEN_KEEPALIVE_SECONDS)
+                if message is None:
+                    yield None
+                    continue
+                yield message["type"], message
+        finally:
+            subscription.close()
+
+
+@router.get("/kitchen/stream")
+async def stream_kitchen_orders():
+    """
+    Server-Sent Events feed for kitchen displays.
+    Sends a `snapshot` event with the active orders, then one event per change:
+    order.placed, order.status, order.item_status, order.cancelled.
+    """
+    async def events():
+        async for item in _kitchen_feed():
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            event, data = item
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.websocket("/kitchen/ws")
+async def kitchen_orders_socket(websocket: WebSocket):
+    """WebSocket variant of /kitchen/stream; messages are {"type": ..., "data": ...}"""
+    await websocket.accept()
+    feed = _kitchen_feed()
+    try:
+        async for item in feed:
+            if item is None:
+                await websocket.send_text(json.dumps({"type": "keepalive"}))
+                continue
+            event, data = item
+            await websocket.send_text(json.dumps({"type": event, "data": data}, default=str))
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await feed.aclose()
 
 
 @router.get("/kitchen/stats")
-async def get_kitchen_stats():
-    """Get kitchen statistics"""
-    db = get_db()
-    
-    placed = await db.orders.count_documents({"status": "placed"})
-    preparing = await db.orders.count_documents({"status": "preparing"})
-    ready = await db.orders.count_documents({"status": "ready"})
-    
-    # Average prep time (for completed orders in last hour)
-    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-    recent_completed = await db.orders.find({
-        "status": "completed",
-        "completedAt": {"$gte": one_hour_ago}
-    }).to_list(100)
-    
-    avg_time = 0
-    if recent_completed:
-        total_time = sum([
-            (o.get("completedAt") - o.get("createdAt")).total_seconds() 
-            for o in recent_completed 
-            if o.get("completedAt") and o.get("createdAt")
-        ])
-        avg_time = int(total_time / len(recent_completed) / 60) if total_time > 0 else 0
+async def get_kitchen_stats(
+    window_hours: int = Query(1, ge=1, le=168),
+    station: Optional[str] = None,
+    item: Optional[str] = None
+):
+    """
+    Get kitchen statistics.
+    `prepTime` has count, mean, min, max and p50/p90/p99 in seconds per stage
+    (wait: placed→preparing, prep: preparing→ready, pickup: ready→served,
+    ticket: placed→ready) over the last `window_hours`, for the whole
+    kitchen or one `station` / `item`.
+    """
+    counts = (await get_counters("orders"))["counts"]
+    placed = counts.get("placed", 0)
+    preparing = counts.get("preparing", 0)
+    ready = counts.get("ready", 0)
+    
+    dim = "all"
+    if item:
+        dim = prep_dimension("item", item)
+    elif station:
+        dim = prep_dimension("station", station)
+    prep_time = await get_prep_time_stats(window_hours, dim)
+    mean_prep = prep_time["prep"]["mean"]
     
     return {
         "pending": placed,
         "inProgress": preparing,
         "readyToServe": ready,
-        "avgPrepTimeMinutes": avg_time,
-        "totalActive": placed + preparing + ready
+        "avgPrepTimeMinutes": int(mean_prep / 60) if mean_prep else 0,
+        "totalActive": placed + preparing + ready,
+        "windowHours": window_hours,
+        "prepTime": prep_time
     }
 
 
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import StreamingResponse
 from ..db import init_db, get_db
 from ..schemas import (
     SettingIn, SystemConfigIn, BackupCreate, BackupConfig, 
@@ -8,7 +9,17 @@ from ..schemas import (
 )
 from ..utils import hash_password, verify_password
 from ..audit import log_audit
+from ..audit_storage import DEFAULT_RETENTION_DAYS, apply_audit_retention
+from ..pricing import invalidate_pricing
 from ..gdrive import gdrive_service
+from ..backups import (
+    BACKUP_MODES, create_streaming_backup, delete_backup_files, is_chunked_backup,
+    iter_backup_chunks, find_chain_parent, load_backup_chain, count_dependent_backups
+)
+from ..restore import (
+    RESTORE_MODES, backup_collections, create_restore_job,
+    run_restore_job, start_restore_job, get_restore_job
+)
 from datetime import datetime
 from typing import Optional
 from bson import ObjectId
@@ -153,7 +164,8 @@ async def get_system_config():
             'timezone': 'Asia/Kolkata',
             'language': 'English',
             'dateFormat': 'DD/MM/YYYY',
-            'timeFormat': '12-hour'
+            'timeFormat': '12-hour',
+            'auditRetentionDays': DEFAULT_RETENTION_DAYS
         }
     return serialize_doc(doc)
 
@@ -177,6 +189,13 @@ async def update_system_config(config: SystemConfigIn, request: Request):
         upsert=True
     )
     
+    if update_data.get('auditRetentionDays'):
+        # Move the audit TTL index to the new retention period
+        try:
+            await apply_audit_retention(update_data['auditRetentionDays'])
+        except Exception as e:
+            print(f"[Audit] Could not apply audit retention: {e}")
+    
     await log_audit(
         action='update_system_config',
         resource='system_config',
@@ -470,8 +489,8 @@ async def list_backups():
     """List all backups (excludes large backupData field for performance)"""
     db = get_db()
     coll = db.get_collection('backups')
-    # Exclude the large backupData field when listing
-    docs = await coll.find({}, {'backupData': 0}).sort('createdAt', -1).to_list(100)
+    # Exclude the large backupData field and chunk manifests when listing
+    docs = await coll.find({}, {'backupData': 0, 'manifest': 0}).sort('createdAt', -1).to_list(100)
     return serialize_doc(docs)
 
 
@@ -488,6 +507,8 @@ async def get_backup_config():
             'frequency': 'daily',
             'backupTime': '02:00',
             'retentionDays': 30,
+            'backupMode': 'full',
+            'fullBackupIntervalDays': 7,
             'backupLocation': 'local',
             'googleDriveEnabled': False,
             'googleDriveFolderId': None
@@ -550,56 +571,35 @@ async def create_backup(payload: BackupCreate, request: Request):
         'recipes', 'offers', 'notifications'
     ]
     
-    # Export actual data from each collection
-    backup_data = {}
-    metadata = {}
-    total_docs = 0
+    mode = payload.mode or 'full'
+    if mode not in BACKUP_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(BACKUP_MODES)}")
     
-    for coll_name in collection_names:
-        try:
-            collection = db.get_collection(coll_name)
-            docs = await collection.find().to_list(50000)
-            backup_data[coll_name] = serialize_doc(docs)
-            metadata[coll_name] = len(docs)
-            total_docs += len(docs)
-        except Exception as e:
-            print(f"[Backup] Warning: Could not backup collection {coll_name}: {e}")
-            backup_data[coll_name] = []
-            metadata[coll_name] = 0
+    # Incremental backups chain onto the latest backup of the same collections
+    parent = None
+    if mode == 'incremental':
+        interval = backup_config.get('fullBackupIntervalDays', 7) if backup_config else 7
+        parent = await find_chain_parent(collection_names, interval)
     
     now = datetime.utcnow()
-    backup_name = payload.name or f"{payload.type.title() if payload.type else 'Manual'} Backup - {now.strftime('%Y-%m-%d')}"
-    
-    # Calculate size of actual data
-    data_json = json.dumps(backup_data, default=str)
-    backup_size_bytes = len(data_json)
-    if backup_size_bytes > 1024 * 1024:
-        size_str = f"{backup_size_bytes / (1024 * 1024):.0f} MB"
-    else:
-        size_str = f"{backup_size_bytes / 1024:.2f} KB"
-    
-    # Create backup document WITH the actual data stored
-    backup_doc = {
-        'name': backup_name,
-        'type': payload.type or 'manual',
-        'collections': collection_names,
-        'documentCounts': metadata,
-        'totalDocuments': total_docs,
-        'size': size_str,
-        'date': now.strftime('%Y-%m-%d'),
-        'time': now.strftime('%H:%M:%S'),
-        'status': 'completed',
-        'createdAt': now.isoformat(),
-        # Store the actual backup data for restore
-        'backupData': backup_data
-    }
-    
-    res = await coll.insert_one(backup_doc)
+    kind = ' Incremental' if parent else ''
+    backup_name = payload.name or f"{payload.type.title() if payload.type else 'Manual'}{kind} Backup - {now.strftime('%Y-%m-%d')}"
+    
+    # Stream each collection into compressed chunks (see app/backups.py)
+    backup_doc = await create_streaming_backup(
+        collection_names,
+        name=backup_name,
+        backup_type=payload.type or 'manual',
+        parent=parent
+    )
+    res_id = backup_doc['_id']
+    total_docs = backup_doc['totalDocuments']
+    size_str = backup_doc['size']
     
     await log_audit(
         action='create_backup',
         resource='backup',
-        resourceId=str(res.inserted_id),
+        resourceId=str(res_id),
         userId=request.headers.get('x-user-id'),
         userName=request.headers.get('x-user-name'),
         details={
@@ -610,90 +610,88 @@ async def create_backup(payload: BackupCreate, request: Request):
         ip=request.client.host if request.client else None
     )
     
-    # Return without the large backupData field for response
-    result = serialize_doc(await coll.find_one({'_id': res.inserted_id}, {'backupData': 0}))
+    # Return without the chunk manifest for response
+    result = serialize_doc(await coll.find_one({'_id': res_id}, {'manifest': 0}))
     return result
 
 
 @router.post('/backups/{backup_id}/restore', tags=['backup'])
-async def restore_backup(backup_id: str, request: Request):
-    """Restore from a backup - replaces current data with backup data"""
+async def restore_backup(
+    backup_id: str,
+    request: Request,
+    mode: str = 'direct',
+    concurrency: Optional[int] = None,
+    wait: bool = True
+):
+    """
+    Restore from a backup - replaces current data with backup data.
+    
+    mode=staging loads into temporary collections and swaps them in, so the
+    live collections are never empty mid-restore. With wait=false the restore
+    runs in the background; poll /backups/restore-jobs/{jobId} for progress.
+    """
     db = get_db()
     coll = db.get_collection('backups')
     
+    if mode not in RESTORE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(RESTORE_MODES)}")
+    
     backup = await coll.find_one({'_id': to_object_id(backup_id)})
     if not backup:
         raise HTTPException(status_code=404, detail='Backup not found')
     
-    # Support both new format (backupData) and old format (content.data)
-    backup_data = backup.get('backupData')
-    if not backup_data and backup.get('content'):
-        backup_data = backup.get('content', {}).get('data')
+    try:
+        # Incremental backups are replayed on top of their full base
+        chain = await load_backup_chain(backup)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    if not backup_data:
+    if not any(backup_collections(chain).values()):
         raise HTTPException(status_code=400, detail='This backup does not contain restorable data. It may be an old backup created before the fix.')
     
-    collections_restored = []
-    total_restored = 0
-    errors = []
+    job_id = await create_restore_job(chain, mode=mode, concurrency=concurrency)
+    actor = {
+        'userId': request.headers.get('x-user-id'),
+        'userName': request.headers.get('x-user-name'),
+        'ip': request.client.host if request.client else None
+    }
     
-    # Restore each collection from backup
-    for coll_name, docs in backup_data.items():
-        if not docs:
-            continue
-        try:
-            collection = db.get_collection(coll_name)
-            
-            # Clear existing data in the collection
-            await collection.delete_many({})
-            
-            # Convert string IDs back to ObjectIds where needed
-            restored_docs = []
-            for doc in docs:
-                if '_id' in doc:
-                    try:
-                        doc['_id'] = ObjectId(doc['_id'])
-                    except:
-                        pass  # Keep as string if not valid ObjectId
-                restored_docs.append(doc)
-            
-            # Insert backup data
-            if restored_docs:
-                await collection.insert_many(restored_docs)
-                collections_restored.append(coll_name)
-                total_restored += len(restored_docs)
-        except Exception as e:
-            errors.append(f"{coll_name}: {str(e)}")
-            print(f"[Restore] Error restoring {coll_name}: {e}")
+    if not wait:
+        start_restore_job(job_id, chain, mode=mode, concurrency=concurrency, actor=actor)
+        return {
+            'success': True,
+            'message': f"Restore of '{backup.get('name')}' started.",
+            'jobId': str(job_id)
+        }
     
-    await log_audit(
-        action='restore_backup',
-        resource='backup',
-        resourceId=backup_id,
-        userId=request.headers.get('x-user-id'),
-        userName=request.headers.get('x-user-name'),
-        details={
-            'backup_name': backup.get('name'),
-            'collections_restored': collections_restored,
-            'total_documents': total_restored,
-            'errors': errors
-        },
-        ip=request.client.host if request.client else None
-    )
+    result = await run_restore_job(job_id, chain, mode=mode, concurrency=concurrency, actor=actor)
+    collections_restored = result['collectionsRestored']
+    total_restored = result['totalRestored']
     
-    if errors:
+    if result['errors']:
         return {
             'success': True, 
             'message': f"Backup '{backup.get('name')}' partially restored. {len(collections_restored)} collections, {total_restored} documents.",
-            'warnings': errors
+            'warnings': result['errors'],
+            'jobId': result['jobId']
         }
     
     return {
         'success': True, 
-        'message': f"Backup '{backup.get('name')}' restored successfully. {len(collections_restored)} collections, {total_restored} documents."
+        'message': f"Backup '{backup.get('name')}' restored successfully. {len(collections_restored)} collections, {total_restored} documents.",
+        'jobId': result['jobId']
     }
 
 
+@router.get('/backups/restore-jobs/{job_id}', tags=['backup'])
+async def get_restore_job_status(job_id: str):
+    """Progress of a restore job (per collection and overall)"""
+    job = await get_restore_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='Restore job not found')
+    return job
+
+
 @router.get('/backups/{backup_id}/download', tags=['backup'])
 async def download_backup(backup_id: str):
     """Download backup data as JSON - returns the actual stored backup data"""
@@ -704,7 +702,38 @@ async def download_backup(backup_id: str):
     if not backup:
         raise HTTPException(status_code=404, detail='Backup not found')
     
-    # Support both new format (backupData) and old format (content.data)
+    backup_info = {
+        'name': backup.get('name'),
+        'date': backup.get('date'),
+        'time': backup.get('time'),
+        'totalDocuments': backup.get('totalDocuments'),
+        'collections': backup.get('collections'),
+        'documentCounts': backup.get('documentCounts')
+    }
+    
+    if is_chunked_backup(backup):
+        # Same JSON layout as inline backups, streamed one chunk at a time
+        async def generate():
+            yield '{"backupInfo": ' + json.dumps(backup_info, default=str)
+            yield ', "collections": ' + json.dumps(backup.get('collections', []))
+            yield ', "data": {'
+            for index, coll_name in enumerate((backup.get('manifest') or {}).keys()):
+                yield (', ' if index else '') + json.dumps(coll_name) + ': ['
+                first = True
+                async for docs in iter_backup_chunks(backup, coll_name):
+                    for doc in docs:
+                        yield ('' if first else ', ') + json.dumps(serialize_doc(doc), default=str)
+                        first = False
+                yield ']'
+            yield '}, "exportedAt": ' + json.dumps(backup.get('createdAt')) + '}'
+        
+        return StreamingResponse(
+            generate(),
+            media_type='application/json',
+            headers={'Content-Disposition': f'attachment; filename="backup-{backup_id}.json"'}
+        )
+    
+    # Support both inline format (backupData) and old format (content.data)
     backup_data = backup.get('backupData')
     if not backup_data and backup.get('content'):
         backup_data = backup.get('content', {}).get('data')
@@ -714,14 +743,7 @@ async def download_backup(backup_id: str):
     
     # Return the stored backup data with metadata
     return {
-        'backupInfo': {
-            'name': backup.get('name'),
-            'date': backup.get('date'),
-            'time': backup.get('time'),
-            'totalDocuments': backup.get('totalDocuments'),
-            'collections': backup.get('collections'),
-            'documentCounts': backup.get('documentCounts')
-        },
+        'backupInfo': backup_info,
         'collections': backup.get('collections', []),
         'data': backup_data,
         'exportedAt': backup.get('createdAt')
@@ -777,10 +799,16 @@ async def delete_backup(backup_id: str, request: Request):
     db = get_db()
     coll = db.get_collection('backups')
     
-    res = await coll.delete_one({'_id': to_object_id(backup_id)})
-    if res.deleted_count == 0:
+    backup = await coll.find_one({'_id': to_object_id(backup_id)}, {'backupData': 0})
+    if not backup:
         raise HTTPException(status_code=404, detail='Backup not found')
     
+    if await count_dependent_backups(backup['_id']):
+        raise HTTPException(status_code=400, detail='Other incremental backups depend on this backup. Delete them first.')
+    
+    await delete_backup_files(backup)
+    await coll.delete_one({'_id': backup['_id']})
+    
     await log_audit(
         action='delete_backup',
         resource='backup',
@@ -893,6 +921,7 @@ async def update_tax_config(config: TaxConfigIn, request: Request):
         },
         upsert=True
     )
+    await invalidate_pricing()
     
     await log_audit(
         action='update_tax_config',
@@ -947,6 +976,7 @@ async def list_discount_rules():
             }
         ]
         res = await coll.insert_many(default_discounts)
+        await invalidate_pricing()
         docs = await coll.find().to_list(100)
     
     return serialize_doc(docs)
@@ -980,6 +1010,7 @@ async def create_discount_rule(discount: DiscountRuleIn, request: Request):
     }
     
     res = await coll.insert_one(doc)
+    await invalidate_pricing()
     
     await log_audit(
         action='create_discount_rule',
@@ -1021,6 +1052,7 @@ async def update_discount_rule(discount_id: str, discount: DiscountRuleUpdate, r
     update_data['updatedAt'] = datetime.utcnow().isoformat()
     
     await coll.update_one({'_id': to_object_id(discount_id)}, {'$set': update_data})
+    await invalidate_pricing()
     
     await log_audit(
         action='update_discount_rule',
@@ -1044,6 +1076,7 @@ async def delete_discount_rule(discount_id: str, request: Request):
     res = await coll.delete_one({'_id': to_object_id(discount_id)})
     if res.deleted_count == 0:
         raise HTTPException(status_code=404, detail='Discount rule not found')
+    await invalidate_pricing()
     
     await log_audit(
         action='delete_discount_rule',
@@ -1073,6 +1106,7 @@ async def toggle_discount_rule(discount_id: str, request: Request):
         {'_id': to_object_id(discount_id)},
         {'$set': {'enabled': new_enabled, 'updatedAt': datetime.utcnow().isoformat()}}
     )
+    await invalidate_pricing()
     
     await log_audit(
         action='toggle_discount_rule',
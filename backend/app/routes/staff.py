@@ -6,6 +6,7 @@ from ..schemas import (
 )
 from ..utils import hash_password, verify_password
 from ..audit import log_audit
+from ..exports import BATCH_ROWS as EXPORT_BATCH_ROWS, export_response
 from datetime import datetime, date
 from typing import Optional
 from bson import ObjectId
@@ -617,11 +618,24 @@ async def get_staff_performance_summary(staffId: str):
 
 
 # ============ EXPORT ENDPOINTS ============
+# CSV files streamed from the cursor (app/exports.py); gzip=true sends a .csv.gz
+
+def _date_range(date_from: Optional[str], date_to: Optional[str]) -> dict:
+    """Filter on the 'YYYY-MM-DD' date field"""
+    filt = {}
+    if date_from:
+        filt['date'] = {'$gte': date_from}
+    if date_to:
+        filt.setdefault('date', {})['$lte'] = date_to
+    return filt
+
+
 @router.get('/export/csv', tags=['export'])
 async def export_staff_csv(
     role: Optional[str] = None,
     active: Optional[bool] = None,
-    shift: Optional[str] = None
+    shift: Optional[str] = None,
+    gzip: bool = False
 ):
     """Export staff records as CSV"""
     db = get_db()
@@ -635,17 +649,19 @@ async def export_staff_csv(
     if shift:
         filt['shift'] = shift
     
-    docs = await coll.find(filt, {'password_hash': 0}).to_list(1000)
-    staff_list = serialize_doc(docs)
-    
-    # Generate CSV content
-    csv_lines = ["ID,Name,Email,Role,Phone,Shift,Department,Salary,Hire Date,Status"]
-    for s in staff_list:
-        hire_date = s.get('hireDate', '')
-        status = 'Active' if s.get('active', True) else 'Inactive'
-        csv_lines.append(f"{s.get('_id','')},{s.get('name','')},{s.get('email','')},{s.get('role','')},{s.get('phone','')},{s.get('shift','')},{s.get('department','')},{s.get('salary','')},{hire_date},{status}")
-    
-    return {"csv": "\n".join(csv_lines), "filename": "staff_export.csv"}
+    cursor = coll.find(filt, {'password_hash': 0}).batch_size(EXPORT_BATCH_ROWS)
+    return export_response(cursor, 'csv', 'staff_export.csv', gzip=gzip, columns=[
+        ('ID', '_id'),
+        ('Name', 'name'),
+        ('Email', 'email'),
+        ('Role', 'role'),
+        ('Phone', 'phone'),
+        ('Shift', 'shift'),
+        ('Department', 'department'),
+        ('Salary', 'salary'),
+        ('Hire Date', 'hireDate'),
+        ('Status', lambda s: 'Active' if s.get('active', True) else 'Inactive'),
+    ])
 
 
 @router.get('/attendance/export/csv', tags=['export'])
@@ -653,135 +669,90 @@ async def export_attendance_csv(
     staffId: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    gzip: bool = False
 ):
     """Export attendance records as CSV"""
     db = get_db()
     coll = db.get_collection('attendance')
-    filt = {}
+    filt = _date_range(date_from, date_to)
     if staffId:
         filt['staffId'] = staffId
-    if date_from:
-        filt['date'] = {'$gte': date_from}
-    if date_to:
-        if 'date' in filt:
-            filt['date']['$lte'] = date_to
-        else:
-            filt['date'] = {'$lte': date_to}
     if status:
         filt['status'] = status
     
-    docs = await coll.find(filt).sort('date', -1).to_list(1000)
-    attendance_list = serialize_doc(docs)
-    
-    # Generate CSV content
-    csv_lines = ["ID,Staff ID,Staff Name,Date,Status,Check In,Check Out,Hours Worked,Notes"]
-    for a in attendance_list:
-        csv_lines.append(f"{a.get('_id','')},{a.get('staffId','')},{a.get('staffName','')},{a.get('date','')},{a.get('status','')},{a.get('checkIn','')},{a.get('checkOut','')},{a.get('hoursWorked','')},{a.get('notes','')}")
-    
-    return {"csv": "\n".join(csv_lines), "filename": "attendance_export.csv"}
+    cursor = coll.find(filt).sort('date', -1).batch_size(EXPORT_BATCH_ROWS)
+    return export_response(cursor, 'csv', 'attendance_export.csv', gzip=gzip, columns=[
+        ('ID', '_id'),
+        ('Staff ID', 'staffId'),
+        ('Staff Name', 'staffName'),
+        ('Date', 'date'),
+        ('Status', 'status'),
+        ('Check In', 'checkIn'),
+        ('Check Out', 'checkOut'),
+        ('Hours Worked', 'hoursWorked'),
+        ('Notes', 'notes'),
+    ])
 
 
 @router.get('/shifts/export/csv', tags=['export'])
 async def export_shifts_csv(
     staffId: Optional[str] = None,
     date_from: Optional[str] = None,
-    date_to: Optional[str] = None
+    date_to: Optional[str] = None,
+    gzip: bool = False
 ):
     """Export shift assignments as CSV"""
     db = get_db()
     coll = db.get_collection('shifts')
-    filt = {}
+    filt = _date_range(date_from, date_to)
     if staffId:
         filt['staffId'] = staffId
-    if date_from:
-        filt['date'] = {'$gte': date_from}
-    if date_to:
-        if 'date' in filt:
-            filt['date']['$lte'] = date_to
-        else:
-            filt['date'] = {'$lte': date_to}
     
-    docs = await coll.find(filt).sort('date', -1).to_list(1000)
-    shifts_list = serialize_doc(docs)
-    
-    # Generate CSV content
-    csv_lines = ["ID,Staff ID,Staff Name,Date,Shift Type,Start Time,End Time,Notes"]
-    for s in shifts_list:
-        csv_lines.append(f"{s.get('_id','')},{s.get('staffId','')},{s.get('staffName','')},{s.get('date','')},{s.get('shiftType','')},{s.get('startTime','')},{s.get('endTime','')},{s.get('notes','')}")
-    
-    return {"csv": "\n".join(csv_lines), "filename": "shifts_export.csv"}
+    cursor = coll.find(filt).sort('date', -1).batch_size(EXPORT_BATCH_ROWS)
+    return export_response(cursor, 'csv', 'shifts_export.csv', gzip=gzip, columns=[
+        ('ID', '_id'),
+        ('Staff ID', 'staffId'),
+        ('Staff Name', 'staffName'),
+        ('Date', 'date'),
+        ('Shift Type', 'shiftType'),
+        ('Start Time', 'startTime'),
+        ('End Time', 'endTime'),
+        ('Notes', 'notes'),
+    ])
 
 
-@router.get('/payroll/export/csv', tags=['export'])
-async def export_payroll_csv(
-    date_from: Optional[str] = None,
-    date_to: Optional[str] = None
-):
-    """Export payroll report as CSV"""
-    db = get_db()
-    
-    # Get all staff
-    staff_coll = db.get_collection('staff')
-    all_staff = await staff_coll.find({}, {'password_hash': 0}).to_list(1000)
-    
-    # Get attendance records for the period
-    attendance_coll = db.get_collection('attendance')
-    att_filt = {}
-    if date_from:
-        att_filt['date'] = {'$gte': date_from}
-    if date_to:
-        if 'date' in att_filt:
-            att_filt['date']['$lte'] = date_to
-        else:
-            att_filt['date'] = {'$lte': date_to}
+async def _payroll_rows(db, date_from: Optional[str], date_to: Optional[str]):
+    """One payroll row per staff member; attendance and shifts are summed per staff in Mongo"""
+    period = _date_range(date_from, date_to)
     
-    attendance_records = await attendance_coll.find(att_filt).to_list(10000)
-    
-    # Group attendance by staff
+    # Attendance status counts by staff
     attendance_by_staff = {}
-    for att in attendance_records:
-        sid = att.get('staffId')
-        if sid not in attendance_by_staff:
-            attendance_by_staff[sid] = []
-        attendance_by_staff[sid].append(att)
-    
-    # Get shifts for overtime calculation
-    shifts_coll = db.get_collection('shifts')
-    shift_filt = {}
-    if date_from:
-        shift_filt['date'] = {'$gte': date_from}
-    if date_to:
-        if 'date' in shift_filt:
-            shift_filt['date']['$lte'] = date_to
-        else:
-            shift_filt['date'] = {'$lte': date_to}
-    
-    shifts = await shifts_coll.find(shift_filt).to_list(10000)
-    
-    # Group shifts by staff
-    shifts_by_staff = {}
-    for shift in shifts:
-        sid = shift.get('staffId')
-        if sid not in shifts_by_staff:
-            shifts_by_staff[sid] = []
-        shifts_by_staff[sid].append(shift)
-    
-    # Generate CSV content
-    csv_lines = ["Staff ID,Name,Role,Department,Salary,Days Present,Days Absent,Days Late,Total Hours,Regular Hours,Overtime Hours,Overtime Pay,Total Pay"]
-    
-    for staff in all_staff:
+    async for row in db.get_collection('attendance').aggregate([
+        {'$match': period},
+        {'$group': {
+            '_id': '$staffId',
+            'present': {'$sum': {'$cond': [{'$eq': ['$status', 'present']}, 1, 0]}},
+            'absent': {'$sum': {'$cond': [{'$eq': ['$status', 'absent']}, 1, 0]}},
+            'late': {'$sum': {'$cond': [{'$eq': ['$status', 'late']}, 1, 0]}},
+        }}
+    ]):
+        attendance_by_staff[row['_id']] = row
+    
+    # Shift hours for overtime calculation (8h when not recorded)
+    hours_by_staff = {}
+    async for row in db.get_collection('shifts').aggregate([
+        {'$match': period},
+        {'$group': {'_id': '$staffId', 'hours': {'$sum': {'$ifNull': ['$hoursWorked', 8]}}}}
+    ]):
+        hours_by_staff[row['_id']] = row['hours']
+    
+    async for staff in db.get_collection('staff').find({}, {'password_hash': 0}).batch_size(EXPORT_BATCH_ROWS):
         sid = str(staff.get('_id', ''))
-        att_records = attendance_by_staff.get(sid, [])
-        shift_records = shifts_by_staff.get(sid, [])
-        
-        # Calculate stats
-        days_present = len([a for a in att_records if a.get('status') == 'present'])
-        days_absent = len([a for a in att_records if a.get('status') == 'absent'])
-        days_late = len([a for a in att_records if a.get('status') == 'late'])
+        attendance = attendance_by_staff.get(sid, {})
         
         # Calculate hours
-        total_hours = sum([s.get('hoursWorked', 8) for s in shift_records])
+        total_hours = hours_by_staff.get(sid, 0)
         regular_hours = min(total_hours, 160)  # Assuming 8 hours/day * 20 days
         overtime_hours = max(0, total_hours - 160)
         
@@ -791,6 +762,28 @@ async def export_payroll_csv(
         overtime_pay = overtime_hours * hourly_rate * 1.5
         total_pay = monthly_salary + overtime_pay
         
-        csv_lines.append(f"{sid},{staff.get('name','')},{staff.get('role','')},{staff.get('department','')},{monthly_salary},{days_present},{days_absent},{days_late},{total_hours:.1f},{regular_hours:.1f},{overtime_hours:.1f},{overtime_pay:.2f},{total_pay:.2f}")
-    
-    return {"csv": "\n".join(csv_lines), "filename": "payroll_export.csv"}
+        yield [
+            sid, staff.get('name', ''), staff.get('role', ''), staff.get('department', ''),
+            monthly_salary,
+            attendance.get('present', 0), attendance.get('absent', 0), attendance.get('late', 0),
+            f"{total_hours:.1f}", f"{regular_hours:.1f}", f"{overtime_hours:.1f}",
+            f"{overtime_pay:.2f}", f"{total_pay:.2f}",
+        ]
+
+
+PAYROLL_COLUMNS = ["Staff ID", "Name", "Role", "Department", "Salary", "Days Present", "Days Absent",
+                   "Days Late", "Total Hours", "Regular Hours", "Overtime Hours", "Overtime Pay", "Total Pay"]
+
+
+@router.get('/payroll/export/csv', tags=['export'])
+async def export_payroll_csv(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    gzip: bool = False
+):
+    """Export payroll report as CSV"""
+    db = get_db()
+    return export_response(
+        _payroll_rows(db, date_from, date_to), 'csv', 'payroll_export.csv', gzip=gzip,
+        columns=[(title, lambda row, i=i: row[i]) for i, title in enumerate(PAYROLL_COLUMNS)]
+    )
@@ -11,6 +11,7 @@ from datetime import datetime, timedelta
 from bson import ObjectId
 from ..db import get_db
 from ..audit import log_audit
+from ..status_counters import record_insert, tracked_update, tracked_delete, reconcile_counters, get_counters
 
 router = APIRouter(tags=["Tables"])
 
@@ -50,33 +51,18 @@ async def list_tables(
 
 @router.get("/stats")
 async def get_table_stats():
-    """Get table statistics"""
-    db = get_db()
-    
-    total = await db.tables.count_documents({})
-    available = await db.tables.count_documents({"status": "available"})
-    occupied = await db.tables.count_documents({"status": "occupied"})
-    reserved = await db.tables.count_documents({"status": "reserved"})
-    cleaning = await db.tables.count_documents({"status": "cleaning"})
-    
-    # Get locations
-    locations = await db.tables.distinct("location")
-    
-    # Total capacity
-    capacity_pipeline = [
-        {"$group": {"_id": None, "total": {"$sum": "$capacity"}}}
-    ]
-    capacity_result = await db.tables.aggregate(capacity_pipeline).to_list(1)
-    total_capacity = capacity_result[0]["total"] if capacity_result else 0
+    """Get table statistics (from the materialized status counters)"""
+    counters = await get_counters("tables")
+    counts = counters["counts"]
     
     return {
-        "total": total,
-        "available": available,
-        "occupied": occupied,
-        "reserved": reserved,
-        "cleaning": cleaning,
-        "locations": locations,
-        "totalCapacity": total_capacity,
+        "total": counters["total"],
+        "available": counts.get("available", 0),
+        "occupied": counts.get("occupied", 0),
+        "reserved": counts.get("reserved", 0),
+        "cleaning": counts.get("cleaning", 0),
+        "locations": sorted(counters["groups"]),
+        "totalCapacity": counters["sums"].get("capacity", 0),
     }
 
 
@@ -108,6 +94,7 @@ async def create_table(data: dict):
         data["status"] = data.get("status", "available")
         
         result = await db.tables.insert_one(data)
+        await record_insert("tables", data)
         created = await db.tables.find_one({"_id": result.inserted_id})
         
         # Try to log audit but don't fail if it doesn't work
@@ -132,12 +119,13 @@ async def update_table(table_id: str, data: dict):
     data["updatedAt"] = datetime.utcnow()
     data.pop("_id", None)
     
-    result = await db.tables.update_one(
+    previous = await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": data}
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Table not found")
     
     updated = await db.tables.find_one({"_id": ObjectId(table_id)})
@@ -149,8 +137,6 @@ async def update_table(table_id: str, data: dict):
 @router.patch("/{table_id}/status")
 async def update_table_status(table_id: str, status: str, data: Optional[dict] = None, guests: Optional[int] = None):
     """Update table status"""
-    db = get_db()
-    
     valid_statuses = ["available", "occupied", "reserved", "cleaning", "eating", "order_accepted", "served", "checked_out", "walk-in-blocked"]
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
@@ -189,12 +175,13 @@ async def update_table_status(table_id: str, status: str, data: Optional[dict] =
             update_data["orders"] = []
             update_data["totalBill"] = 0
     
-    result = await db.tables.update_one(
+    previous = await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Table not found")
     
     await log_audit("status_update", "table", table_id, {"newStatus": status})
@@ -214,7 +201,7 @@ async def delete_table(table_id: str):
     if table.get("status") == "occupied":
         raise HTTPException(status_code=400, detail="Cannot delete occupied table")
     
-    await db.tables.delete_one({"_id": ObjectId(table_id)})
+    await tracked_delete("tables", {"_id": ObjectId(table_id)})
     await log_audit("delete", "table", table_id, {"name": table.get("name")})
     
     return {"success": True}
@@ -301,7 +288,8 @@ async def create_reservation(data: dict):
     
     # Update table status
     if data.get("tableId"):
-        await db.tables.update_one(
+        await tracked_update(
+            "tables",
             {"_id": ObjectId(data["tableId"])},
             {"$set": {"status": "reserved", "reservedFor": data.get("customerName")}}
         )
@@ -331,13 +319,15 @@ async def update_reservation(reservation_id: str, data: dict):
     if old_table_id != new_table_id:
         # Free old table
         if old_table_id:
-            await db.tables.update_one(
+            await tracked_update(
+                "tables",
                 {"_id": ObjectId(old_table_id)},
                 {"$set": {"status": "available", "reservedFor": None}}
             )
         # Reserve new table
         if new_table_id:
-            await db.tables.update_one(
+            await tracked_update(
+                "tables",
                 {"_id": ObjectId(new_table_id)},
                 {"$set": {"status": "reserved", "reservedFor": data.get("customerName")}}
             )
@@ -373,7 +363,8 @@ async def update_reservation_status(reservation_id: str, status: str):
     
     # If cancelled, free up the table
     if status in ["cancelled", "no-show", "completed"] and reservation.get("tableId"):
-        await db.tables.update_one(
+        await tracked_update(
+            "tables",
             {"_id": ObjectId(reservation["tableId"])},
             {"$set": {"status": "available", "reservedFor": None}}
         )
@@ -392,7 +383,8 @@ async def delete_reservation(reservation_id: str):
     
     # Free up the table
     if reservation.get("tableId"):
-        await db.tables.update_one(
+        await tracked_update(
+            "tables",
             {"_id": ObjectId(reservation["tableId"])},
             {"$set": {"status": "available", "reservedFor": None}}
         )
@@ -418,5 +410,6 @@ async def reset_all_tables():
         "cleaningEndTime": None,
     }
     result = await db.tables.update_many({}, {"$set": reset_data})
+    await reconcile_counters("tables")
     await log_audit("reset_all", "table", "all", {"modified": result.modified_count})
     return {"success": True, "modified": result.modified_count}
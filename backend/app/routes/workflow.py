@@ -3,19 +3,24 @@ Complete Workflow Integration - Tables to Orders to Kitchen to Billing
 Handles the full guest lifecycle from reservation/walk-in through check-out
 """
 
-from fastapi import APIRouter, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query
 from typing import Optional, List
 from datetime import datetime, timedelta
 from bson import ObjectId
 from ..db import get_db
 from ..audit import log_audit
+from ..timers import schedule_timer, cancel_timer, register_timer_handler
+from ..status_counters import tracked_update
 
 router = APIRouter(tags=["Workflow"])
 
+WALK_IN_RELEASE_TIMER = "walk_in_release"
+CLEANING_TIMER = "cleaning_complete"
+
 # ============ WORKFLOW ENDPOINTS ============
 
 @router.post("/workflow/guest-arrived/{table_id}")
-async def handle_guest_arrival(table_id: str, background_tasks: BackgroundTasks):
+async def handle_guest_arrival(table_id: str):
     """
     Handle guest arrival - transitions from 'reserved' or 'walk-in-blocked' to 'occupied'
     Sets up for waiter assignment and order taking
@@ -45,10 +50,12 @@ async def handle_guest_arrival(table_id: str, background_tasks: BackgroundTasks)
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
+    await cancel_timer(WALK_IN_RELEASE_TIMER, table_id)
     
     # Log the action
     await log_audit(
@@ -67,7 +74,7 @@ async def handle_guest_arrival(table_id: str, background_tasks: BackgroundTasks)
 
 
 @router.post("/workflow/walk-in-booking/{table_id}")
-async def handle_walk_in_booking(table_id: str, data: dict, background_tasks: BackgroundTasks):
+async def handle_walk_in_booking(table_id: str, data: dict):
     """
     Handle walk-in booking - blocks table for 15 minutes waiting for guest arrival
     If guest doesn't arrive in 15 minutes, automatically return to available
@@ -111,16 +118,18 @@ async def handle_walk_in_booking(table_id: str, data: dict, background_tasks: Ba
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
     
     # Schedule automatic status reset if guest doesn't arrive
-    background_tasks.add_task(
-        auto_release_walk_in_table,
+    await schedule_timer(
+        WALK_IN_RELEASE_TIMER,
         table_id,
-        blocking_until.isoformat()
+        blocking_until,
+        {"blockingUntil": blocking_until.isoformat() + 'Z'}
     )
     
     # Log the action
@@ -175,7 +184,8 @@ async def handle_waiter_assignment(table_id: str, data: dict):
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
@@ -279,7 +289,8 @@ async def handle_order_accepted(table_id: str, data: dict):
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
@@ -287,7 +298,8 @@ async def handle_order_accepted(table_id: str, data: dict):
     # Update the order as well (mark as sent to kitchen)
     if data.get("orderId"):
         try:
-            await db.orders.update_one(
+            await tracked_update(
+                "orders",
                 {"_id": ObjectId(data["orderId"])},
                 {
                     "$set": {
@@ -353,7 +365,8 @@ async def handle_order_preparing(table_id: str, data: dict):
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
@@ -361,7 +374,8 @@ async def handle_order_preparing(table_id: str, data: dict):
     # Update order status
     if data.get("orderId"):
         try:
-            await db.orders.update_one(
+            await tracked_update(
+                "orders",
                 {"_id": ObjectId(data["orderId"])},
                 {
                     "$set": {
@@ -422,7 +436,8 @@ async def handle_order_ready(table_id: str, data: dict):
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
@@ -430,7 +445,8 @@ async def handle_order_ready(table_id: str, data: dict):
     # Update order status to ready
     if data.get("orderId"):
         try:
-            await db.orders.update_one(
+            await tracked_update(
+                "orders",
                 {"_id": ObjectId(data["orderId"])},
                 {
                     "$set": {
@@ -488,7 +504,8 @@ async def handle_bill_generated(table_id: str, data: dict):
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
@@ -513,7 +530,7 @@ async def handle_bill_generated(table_id: str, data: dict):
 
 
 @router.post("/workflow/payment-completed/{table_id}")
-async def handle_payment_completed(table_id: str, data: dict, background_tasks: BackgroundTasks):
+async def handle_payment_completed(table_id: str, data: dict):
     """
     Handle payment completion - payment is done, start cleaning process
     Updates table status to 'checked_out', then schedules transition to 'cleaning'
@@ -545,7 +562,8 @@ async def handle_payment_completed(table_id: str, data: dict, background_tasks:
         "updatedAt": datetime.utcnow().isoformat() + 'Z'
     }
     
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {"$set": update_data}
     )
@@ -555,7 +573,8 @@ async def handle_payment_completed(table_id: str, data: dict, background_tasks:
     original_status = data.get("originalStatus", "available")
     
     # Immediately set to cleaning status
-    await db.tables.update_one(
+    await tracked_update(
+        "tables",
         {"_id": ObjectId(table_id)},
         {
             "$set": {
@@ -569,11 +588,11 @@ async def handle_payment_completed(table_id: str, data: dict, background_tasks:
     )
     
     # Schedule automatic status reset after cleaning
-    background_tasks.add_task(
-        auto_complete_cleaning,
+    await schedule_timer(
+        CLEANING_TIMER,
         table_id,
-        original_status,
-        cleaning_end_time.isoformat()
+        cleaning_end_time,
+        {"originalStatus": original_status}
     )
     
     # Log the action
@@ -598,117 +617,89 @@ async def handle_payment_completed(table_id: str, data: dict, background_tasks:
     }
 
 
-# ============ BACKGROUND TASKS ============
+# ============ TIMER HANDLERS ============
+# Run by the durable timer poller (app/timers.py) once the timer is due.
+# The status check is part of the update, so a handler that runs twice
+# (expired lease, retry) leaves the table untouched the second time.
 
-async def auto_release_walk_in_table(table_id: str, blocking_until_time: str):
+async def auto_release_walk_in_table(table_id: str, payload: dict):
     """
-    Background task: If walk-in guest doesn't arrive within 15 minutes,
+    If walk-in guest doesn't arrive within 15 minutes,
     automatically release the table back to 'available' status
     """
-    try:
-        db = get_db()
-        
-        # Parse the blocking time
-        blocking_until = datetime.fromisoformat(blocking_until_time.replace('Z', '+00:00'))
-        
-        # Wait until blocking time expires (or a bit more to be safe)
-        wait_seconds = (blocking_until - datetime.utcnow()).total_seconds()
-        
-        if wait_seconds > 0:
-            import asyncio
-            await asyncio.sleep(wait_seconds)
-        
-        # Check if guest has arrived
-        table = await db.tables.find_one({"_id": ObjectId(table_id)})
-        
-        if table and table.get("status") == "walk-in-blocked":
-            # Guest didn't arrive, release the table
-            await db.tables.update_one(
-                {"_id": ObjectId(table_id)},
-                {
-                    "$set": {
-                        "status": "available",
-                        "reservationType": None,
-                        "reservationStatus": "expired",
-                        "blockingTimeout": None,
-                        "customerName": None,
-                        "guestCount": None,
-                        "updatedAt": datetime.utcnow().isoformat() + 'Z'
-                    }
-                }
-            )
-            
-            # Log the auto-release
-            await log_audit(
-                "walk_in_timeout",
-                "table",
-                table_id,
-                {"reason": "Guest did not arrive within 15 minutes"}
-            )
-    except Exception as e:
-        print(f"Error in auto_release_walk_in_table: {e}")
+    previous = await tracked_update(
+        "tables",
+        {"_id": ObjectId(table_id), "status": "walk-in-blocked"},
+        {
+            "$set": {
+                "status": "available",
+                "reservationType": None,
+                "reservationStatus": "expired",
+                "blockingTimeout": None,
+                "customerName": None,
+                "guestCount": None,
+                "updatedAt": datetime.utcnow().isoformat() + 'Z'
+            }
+        }
+    )
+    
+    if previous:
+        # Log the auto-release
+        await log_audit(
+            "walk_in_timeout",
+            "table",
+            table_id,
+            {"reason": "Guest did not arrive within 15 minutes"}
+        )
 
 
-async def auto_complete_cleaning(table_id: str, original_status: str, cleaning_end_time: str):
+async def auto_complete_cleaning(table_id: str, payload: dict):
     """
-    Background task: After 5 minutes of cleaning, return table to original status
+    After 5 minutes of cleaning, return table to original status
     (usually 'available' or 'reserved')
     """
-    try:
-        db = get_db()
-        
-        # Parse the cleaning end time
-        end_time = datetime.fromisoformat(cleaning_end_time.replace('Z', '+00:00'))
-        
-        # Wait until cleaning time expires
-        wait_seconds = (end_time - datetime.utcnow()).total_seconds()
-        
-        if wait_seconds > 0:
-            import asyncio
-            await asyncio.sleep(wait_seconds)
-        
-        # Return table to original status
-        table = await db.tables.find_one({"_id": ObjectId(table_id)})
-        
-        if table and table.get("status") == "cleaning":
-            # Clear all order/guest data
-            final_status = original_status if original_status else "available"
-            
-            await db.tables.update_one(
-                {"_id": ObjectId(table_id)},
-                {
-                    "$set": {
-                        "status": final_status,
-                        "currentOrderId": None,
-                        "orders": [],
-                        "waiterId": None,
-                        "waiterName": None,
-                        "guestCount": None,
-                        "customerName": None,
-                        "billGenerated": False,
-                        "billId": None,
-                        "billAmount": None,
-                        "paymentId": None,
-                        "occupiedAt": None,
-                        "arrivalTime": None,
-                        "orderCreatedAt": None,
-                        "orderAcceptedAt": None,
-                        "preparationStartedAt": None,
-                        "orderReadyAt": None,
-                        "paymentCompletedAt": None,
-                        "cleaningStartedAt": None,
-                        "cleaningEndTime": None,
-                        "updatedAt": datetime.utcnow().isoformat() + 'Z'
-                    }
-                }
-            )
-            
-            # Log the cleaning completion
-            await log_audit(
-                "cleaning_completed",
-                "table",
-                table_id,
-                {"newStatus": final_status}
-            )
-    except Exception as e:
-        print(f"Error in auto_complete_cleaning: {e}")
+    # Clear all order/guest data
+    final_status = payload.get("originalStatus") or "available"
+    
+    previous = await tracked_update(
+        "tables",
+        {"_id": ObjectId(table_id), "status": "cleaning"},
+        {
+            "$set": {
+                "status": final_status,
+                "currentOrderId": None,
+                "orders": [],
+                "waiterId": None,
+                "waiterName": None,
+                "guestCount": None,
+                "customerName": None,
+                "billGenerated": False,
+                "billId": None,
+                "billAmount": None,
+                "paymentId": None,
+                "occupiedAt": None,
+                "arrivalTime": None,
+                "orderCreatedAt": None,
+                "orderAcceptedAt": None,
+                "preparationStartedAt": None,
+                "orderReadyAt": None,
+                "paymentCompletedAt": None,
+                "cleaningStartedAt": None,
+                "cleaningEndTime": None,
+                "updatedAt": datetime.utcnow().isoformat() + 'Z'
+            }
+        }
+    )
+    
+    if previous:
+        # Log the cleaning completion
+        await log_audit(
+            "cleaning_completed",
+            "table",
+            table_id,
+            {"newStatus": final_status}
+        )
+
+
+register_timer_handler(WALK_IN_RELEASE_TIMER, auto_release_walk_in_table)
+register_timer_handler(CLEANING_TIMER, auto_complete_cleaning)
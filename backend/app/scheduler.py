@@ -8,10 +8,13 @@ from datetime import datetime, timedelta
 from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import pytz
 
 scheduler: Optional[AsyncIOScheduler] = None
 backup_job_id = "automatic_backup_job"
+timers_job_id = "durable_timers_job"
+counters_job_id = "status_counters_reconcile_job"
 
 # Get local timezone - default to UTC if can't detect
 try:
@@ -60,72 +63,50 @@ async def run_automatic_backup():
             'notifications', 'billing'
         ]
         
-        # Export data from each collection  
-        backup_data = {}
-        document_counts = {}
-        total_docs = 0
+        # Stream each collection into compressed chunks
+        from .backups import create_streaming_backup, delete_backup_files, find_chain_parent
         
-        for coll_name in collection_names:
-            try:
-                coll = db.get_collection(coll_name)
-                docs = await coll.find().to_list(50000)
-                # Serialize ObjectId to string
-                serialized_docs = []
-                for doc in docs:
-                    serialized_doc = {}
-                    for key, value in doc.items():
-                        if hasattr(value, '__str__') and type(value).__name__ == 'ObjectId':
-                            serialized_doc[key] = str(value)
-                        else:
-                            serialized_doc[key] = value
-                    serialized_docs.append(serialized_doc)
-                backup_data[coll_name] = serialized_docs
-                document_counts[coll_name] = len(docs)
-                total_docs += len(docs)
-            except Exception as e:
-                print(f"[Scheduler] Error backing up {coll_name}: {e}")
-                backup_data[coll_name] = []
-                document_counts[coll_name] = 0
-        
-        # Calculate backup size
-        import json
-        backup_json = json.dumps(backup_data, default=str)
-        size_bytes = len(backup_json.encode('utf-8'))
-        if size_bytes < 1024:
-            size_str = f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            size_str = f"{size_bytes / 1024:.0f} KB"
-        else:
-            size_str = f"{size_bytes / (1024 * 1024):.0f} MB"
+        # Incremental mode: only changes since the previous backup, with a
+        # new full base every fullBackupIntervalDays
+        parent = None
+        if config.get('backupMode', 'full') == 'incremental':
+            parent = await find_chain_parent(collection_names, config.get('fullBackupIntervalDays', 7))
         
         now = datetime.now()
-        backup_doc = {
-            'name': f"Full Backup - {now.strftime('%Y-%m-%d')}",
-            'size': size_str,
-            'date': now.strftime('%Y-%m-%d'),
-            'time': now.strftime('%H:%M:%S'),
-            'status': 'completed',
-            'type': 'automatic',
-            'collections': collection_names,
-            'documentCounts': document_counts,
-            'totalDocuments': total_docs,
-            'createdAt': now.isoformat(),
-            # Store actual backup data for restore
-            'backupData': backup_data
-        }
-        
-        result = await backups_coll.insert_one(backup_doc)
-        print(f"[Scheduler] ✅ Automatic backup created: {result.inserted_id} ({total_docs} documents, {size_str})")
+        backup_doc = await create_streaming_backup(
+            collection_names,
+            name=f"{'Incremental' if parent else 'Full'} Backup - {now.strftime('%Y-%m-%d %H:%M')}",
+            backup_type='automatic',
+            parent=parent
+        )
+        print(f"[Scheduler] ✅ Automatic backup created: {backup_doc['_id']} ({backup_doc['totalDocuments']} documents, {backup_doc['size']})")
         
         # Clean up old backups based on retention period
         retention_days = config.get('retentionDays', 30)
-        cutoff_date = now - timedelta(days=retention_days)
-        delete_result = await backups_coll.delete_many({
-            'createdAt': {'$lt': cutoff_date},
-            'type': 'automatic'  # Only delete automatic backups
-        })
-        if delete_result.deleted_count > 0:
-            print(f"[Scheduler] 🗑️  Cleaned up {delete_result.deleted_count} old backups")
+        cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = 0
+        # createdAt is stored as an ISO string. Incremental backups are only
+        # removed together with their whole chain, once nothing in it is recent.
+        async for old_backup in backups_coll.find(
+            {
+                'createdAt': {'$lt': cutoff_date.isoformat()},
+                'type': 'automatic',  # Only delete automatic backups
+                'kind': {'$ne': 'incremental'}
+            },
+            {'backupData': 0}
+        ):
+            base_id = str(old_backup['_id'])
+            if await backups_coll.count_documents({'baseBackupId': base_id, 'createdAt': {'$gte': cutoff_date.isoformat()}}):
+                continue
+            async for increment in backups_coll.find({'baseBackupId': base_id}):
+                await delete_backup_files(increment)
+                await backups_coll.delete_one({'_id': increment['_id']})
+                deleted += 1
+            await delete_backup_files(old_backup)
+            await backups_coll.delete_one({'_id': old_backup['_id']})
+            deleted += 1
+        if deleted > 0:
+            print(f"[Scheduler] 🗑️  Cleaned up {deleted} old backups")
             
     except Exception as e:
         print(f"[Scheduler] ❌ Backup failed: {e}")
@@ -236,6 +217,62 @@ async def update_backup_schedule():
         traceback.print_exc()
 
 
+async def run_due_timers():
+    """Fire durable timers (walk-in release, cleaning completion, ...) that are due"""
+    from .timers import fire_due_timers
+    
+    try:
+        await fire_due_timers()
+    except Exception as e:
+        print(f"[Scheduler] Error firing timers: {e}")
+
+
+def schedule_timer_poller():
+    """Poll the timers collection; max_instances=1 keeps polls from overlapping"""
+    from .timers import POLL_SECONDS
+    
+    scheduler.add_job(
+        run_due_timers,
+        trigger=IntervalTrigger(seconds=POLL_SECONDS),
+        id=timers_job_id,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        name="Durable Timers"
+    )
+    print(f"[Scheduler] ⏱️  Timer poller running every {POLL_SECONDS:g}s")
+
+
+async def run_counter_reconcile():
+    """Recompute the materialized status counters to fix any drift"""
+    from .status_counters import reconcile_counters
+    
+    try:
+        drift = await reconcile_counters()
+        for entity, corrected in drift.items():
+            if corrected:
+                print(f"[Scheduler] Corrected {entity} counter drift: {corrected}")
+    except Exception as e:
+        print(f"[Scheduler] Error reconciling status counters: {e}")
+
+
+def schedule_counter_reconcile():
+    """Reconcile the status counters every COUNTER_RECONCILE_SECONDS"""
+    from .status_counters import RECONCILE_SECONDS
+    
+    scheduler.add_job(
+        run_counter_reconcile,
+        trigger=IntervalTrigger(seconds=RECONCILE_SECONDS),
+        id=counters_job_id,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        next_run_time=datetime.now(LOCAL_TZ),
+        name="Status Counters Reconcile"
+    )
+    print(f"[Scheduler] 🔢 Status counters reconciled every {RECONCILE_SECONDS}s")
+
+
 def init_scheduler():
     """Initialize the scheduler"""
     global scheduler
@@ -248,6 +285,8 @@ def init_scheduler():
 async def start_scheduler():
     """Start the scheduler and load initial config"""
     init_scheduler()
+    schedule_timer_poller()
+    schedule_counter_reconcile()
     await update_backup_schedule()
 
 
@@ -58,6 +58,7 @@ class SystemConfigIn(BaseModel):
     language: Optional[str] = "English"
     dateFormat: Optional[str] = "DD/MM/YYYY"
     timeFormat: Optional[str] = "12-hour"
+    auditRetentionDays: Optional[int] = Field(None, ge=1, le=3650)
 
 
 # ============ STAFF MANAGEMENT ============
@@ -172,6 +173,7 @@ class BackupCreate(BaseModel):
     name: Optional[str] = None
     type: Optional[str] = "manual"  # manual, automatic
     collections: Optional[List[str]] = None  # specific collections, or None for all
+    mode: Optional[str] = "full"  # full, incremental (changes since the previous backup)
 
 
 class BackupConfig(BaseModel):
@@ -179,6 +181,8 @@ class BackupConfig(BaseModel):
     frequency: Optional[str] = "daily"  # hourly, daily, weekly, monthly
     backupTime: Optional[str] = "02:00"  # HH:MM format for scheduled backups
     retentionDays: int = 30
+    backupMode: Optional[str] = "full"  # full, incremental
+    fullBackupIntervalDays: int = 7  # incremental mode: take a new full base this often
     backupLocation: Optional[str] = "local"  # local, google_drive, both
     googleDriveFolderId: Optional[str] = None
     googleDriveEnabled: bool = False
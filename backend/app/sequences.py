@@ -0,0 +1,137 @@
+"""
+Sequence Counters Module
+Atomic, gap-tolerant number generation for order numbers, transaction IDs
+and invoice numbers, backed by find_one_and_update + $inc on `sequences`.
+
+Sequences are keyed by prefix (e.g. "TXN") and can optionally be scoped per
+day ("TXN:20260101"). Setting SEQUENCE_BLOCK_SIZE > 1 makes each worker
+process reserve a block of numbers at a time, so most numbers are handed out
+without a database round trip. Numbers stay unique across workers but are no
+longer strictly increasing in creation order.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from pymongo import ReturnDocument
+from .db import get_db
+
+SEQUENCES_COLLECTION = 'sequences'
+
+BLOCK_SIZE = max(1, int(os.getenv('SEQUENCE_BLOCK_SIZE', '1')))
+
+# key -> [next value to hand out, last value of the reserved block]
+_blocks = {}
+_locks = {}
+# keys whose counter document is known to exist
+_initialized = set()
+
+
+def sequence_key(name: str, per_day: bool = False, day: datetime = None) -> str:
+    if not per_day:
+        return name
+    return f"{name}:{(day or datetime.utcnow()).strftime('%Y%m%d')}"
+
+
+async def _ensure_counter(coll, key: str, seed):
+    """
+    Create the counter on first use, starting after `await seed()` so numbers
+    continue from the ones that were generated before sequences existed.
+    """
+    if key in _initialized:
+        return
+    if seed is not None and not await coll.find_one({'_id': key}, {'_id': 1}):
+        base = await seed()
+        # $max keeps this safe when several workers seed at the same time
+        await coll.update_one({'_id': key}, {'$max': {'value': int(base)}}, upsert=True)
+    _initialized.add(key)
+
+
+async def _reserve(key: str, count: int, seed=None) -> int:
+    """Atomically reserve `count` values and return the last one"""
+    db = get_db()
+    coll = db.get_collection(SEQUENCES_COLLECTION)
+    await _ensure_counter(coll, key, seed)
+    doc = await coll.find_one_and_update(
+        {'_id': key},
+        {'$inc': {'value': count}, '$set': {'updatedAt': datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc['value']
+
+
+async def next_sequence(name: str, per_day: bool = False, seed=None, block_size: int = None) -> int:
+    """
+    Return the next value of a sequence.
+
+    Args:
+        name: Sequence name / prefix (e.g. 'orders', 'TXN')
+        per_day: Restart the sequence every UTC day
+        seed: Optional coroutine function returning the value to start after
+              when the sequence does not exist yet
+        block_size: Values reserved per round trip (defaults to SEQUENCE_BLOCK_SIZE)
+    """
+    key = sequence_key(name, per_day)
+    size = max(1, block_size or BLOCK_SIZE)
+    if size == 1:
+        return await _reserve(key, 1, seed)
+
+    lock = _locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        block = _blocks.get(key)
+        if block is None or block[0] > block[1]:
+            last = await _reserve(key, size, seed)
+            block = [last - size + 1, last]
+            _blocks[key] = block
+        value = block[0]
+        block[0] += 1
+        return value
+
+
+async def reserve_sequence_range(name: str, count: int, per_day: bool = False, seed=None) -> range:
+    """Reserve `count` consecutive values in one round trip (bypasses worker blocks)"""
+    key = sequence_key(name, per_day)
+    last = await _reserve(key, count, seed)
+    return range(last - count + 1, last + 1)
+
+
+# ============ NUMBER FORMATS ============
+
+def _count_seed(collection: str):
+    async def seed():
+        return await get_db().get_collection(collection).count_documents({})
+    return seed
+
+
+def format_order_number(value: int) -> str:
+    return f"#ORD-{value + 1000}"
+
+
+async def next_order_number() -> str:
+    """Order numbers: #ORD-1001, #ORD-1002, ..."""
+    return format_order_number(await next_sequence('orders', seed=_count_seed('orders')))
+
+
+async def reserve_order_numbers(count: int) -> list:
+    """`count` consecutive order numbers in one round trip (bulk ingestion)"""
+    values = await reserve_sequence_range('orders', count, seed=_count_seed('orders'))
+    return [format_order_number(value) for value in values]
+
+
+async def next_transaction_id() -> str:
+    """Payment transaction IDs: TXN-YYYYMMDD-1001, ..."""
+    value = await next_sequence('TXN', seed=_count_seed('payments'))
+    return f"TXN-{datetime.utcnow().strftime('%Y%m%d')}-{value + 1000}"
+
+
+async def next_refund_id() -> str:
+    """Refund transaction IDs: REF-YYYYMMDD-1, ..."""
+    value = await next_sequence('REF', seed=_count_seed('payments'))
+    return f"REF-{datetime.utcnow().strftime('%Y%m%d')}-{value}"
+
+
+async def next_invoice_number() -> str:
+    """Invoice numbers: INV-YYYYMMDD-1001, ..."""
+    value = await next_sequence('INV', seed=_count_seed('invoices'))
+    return f"INV-{datetime.utcnow().strftime('%Y%m%d')}-{value + 1000}"
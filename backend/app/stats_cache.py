@@ -0,0 +1,80 @@
+"""
+Stats Cache Module
+Short-lived in-process cache for dashboard aggregates (billing stats, daily
+reports) that screens poll every few seconds.
+
+- Entries live STATS_CACHE_SECONDS (default 10) and are grouped in
+  namespaces; writers call invalidate_stats(namespace) after changing the
+  underlying data, so this worker serves fresh numbers right away. Other
+  workers catch up when their entry expires.
+- Concurrent misses for the same key share one load instead of each
+  running the aggregation.
+
+Cached values are shared: treat them as read-only.
+"""
+
+import asyncio
+import os
+import time
+
+TTL_SECONDS = float(os.getenv('STATS_CACHE_SECONDS', '10'))
+
+# namespace -> {key: (expires at, value)}
+_entries = {}
+# namespace -> generation, bumped on invalidation so in-flight loads are not stored
+_generations = {}
+# (namespace, key) -> future of the load in progress
+_loading = {}
+_stats = {'hits': 0, 'misses': 0, 'sharedLoads': 0, 'invalidations': 0}
+
+
+async def cached_stats(namespace: str, key, loader, ttl: float = None):
+    """Value of `await loader()` for (namespace, key), cached for `ttl` seconds"""
+    ttl = TTL_SECONDS if ttl is None else ttl
+    now = time.monotonic()
+    entry = _entries.get(namespace, {}).get(key)
+    if entry and entry[0] > now:
+        _stats['hits'] += 1
+        return entry[1]
+
+    in_flight = _loading.get((namespace, key))
+    if in_flight is not None:
+        _stats['sharedLoads'] += 1
+        return await asyncio.shield(in_flight)
+
+    _stats['misses'] += 1
+    generation = _generations.get(namespace, 0)
+    future = asyncio.get_running_loop().create_future()
+    _loading[(namespace, key)] = future
+    try:
+        value = await loader()
+    except BaseException as e:
+        if isinstance(e, Exception):
+            future.set_exception(e)
+            # Waiters get the error; nobody else needs to retrieve it
+            future.exception()
+        else:
+            future.cancel()
+        raise
+    finally:
+        _loading.pop((namespace, key), None)
+
+    if ttl > 0 and generation == _generations.get(namespace, 0):
+        _entries.setdefault(namespace, {})[key] = (time.monotonic() + ttl, value)
+    future.set_result(value)
+    return value
+
+
+def invalidate_stats(namespace: str):
+    """Drop every cached value of a namespace"""
+    _generations[namespace] = _generations.get(namespace, 0) + 1
+    _entries.pop(namespace, None)
+    _stats['invalidations'] += 1
+
+
+def get_stats_cache_stats() -> dict:
+    return {
+        'ttlSeconds': TTL_SECONDS,
+        'entries': {namespace: len(entries) for namespace, entries in _entries.items()},
+        **_stats,
+    }
@@ -0,0 +1,237 @@
+"""
+Status Counters Module
+Materialized per-status counts for orders, tables and notifications, so the
+dashboard stats endpoints read one document instead of running a
+count_documents() per status.
+
+Each counted collection has one document in `status_counters`:
+
+    {'_id': 'tables', 'total': 12, 'counts': {'available': 8, ...},
+     'sums': {'capacity': 48}, 'groups': {'Patio': 4, ...}}
+
+The write paths keep it in step with `$inc`:
+- record_insert(entity, doc) after inserting a document
+- tracked_update(entity, filter, update) instead of update_one(); it returns
+  the document as it was before the update
+- tracked_delete(entity, filter) instead of delete_one()
+- record_inserts(entity, docs) after insert_many()
+- update_many() is followed by reconcile_counters(entity)
+
+reconcile_counters() recomputes every counter from the collection. The
+scheduler runs it every COUNTER_RECONCILE_SECONDS to fix any drift (writes
+made outside the API, a crash between a write and its `$inc`).
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from pymongo import ReturnDocument
+from .db import get_db
+
+COUNTERS_COLLECTION = 'status_counters'
+RECONCILE_SECONDS = int(os.getenv('COUNTER_RECONCILE_SECONDS', '300'))
+
+# What is counted per collection:
+# field: the status field; sums: numeric fields totalled; group: field counted by value
+COUNTED = {
+    'orders': {'field': 'status', 'sums': [], 'group': None},
+    'tables': {'field': 'status', 'sums': ['capacity'], 'group': 'location'},
+    'notifications': {'field': 'status', 'sums': [], 'group': None},
+}
+
+
+def _key(value) -> str:
+    """Make a value safe to use as a sub-document key"""
+    key = str(value if value is not None else '').replace('.', '_').replace('$', '_').strip()
+    return key or 'unknown'
+
+
+def _number(value) -> float:
+    """Numeric value as `$sum` sees it: anything that is not a number counts as 0"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+def _contribution(entity: str, doc: dict) -> dict:
+    """Counter increments one document adds to its entity's counters"""
+    if not doc:
+        return {}
+    spec = COUNTED[entity]
+    inc = {'total': 1, f"counts.{_key(doc.get(spec['field']))}": 1}
+    for field in spec['sums']:
+        inc[f"sums.{field}"] = _number(doc.get(field))
+    if spec['group'] and doc.get(spec['group']):
+        inc[f"groups.{_key(doc.get(spec['group']))}"] = 1
+    return inc
+
+
+def _after_update(before: dict, update) -> dict:
+    """Top-level fields of a document after a `$set`/`$unset` update"""
+    after = dict(before)
+    if isinstance(update, dict):
+        for field, value in (update.get('$set') or {}).items():
+            if '.' not in field:
+                after[field] = value
+        for field in (update.get('$unset') or {}):
+            after.pop(field, None)
+    return after
+
+
+async def _apply_increments(entity: str, inc: dict):
+    inc = {field: delta for field, delta in inc.items() if delta}
+    if not inc:
+        return
+    try:
+        await get_db().get_collection(COUNTERS_COLLECTION).update_one(
+            {'_id': entity},
+            {'$inc': inc, '$set': {'updatedAt': datetime.utcnow()}},
+            upsert=True
+        )
+    except Exception as e:
+        # The reconcile job fixes it; never fail the write itself
+        print(f"[Counters] Could not update {entity} counters: {e}")
+
+
+async def apply_counter_change(entity: str, before: dict = None, after: dict = None):
+    """Move a document's contribution from `before` to `after` (None = absent)"""
+    old = _contribution(entity, before)
+    new = _contribution(entity, after)
+    await _apply_increments(entity, {
+        field: new.get(field, 0) - old.get(field, 0) for field in set(old) | set(new)
+    })
+
+
+async def record_insert(entity: str, doc: dict):
+    await apply_counter_change(entity, None, doc)
+
+
+async def record_inserts(entity: str, docs: list):
+    """Counters for an insert_many(), in a single update"""
+    inc = {}
+    for doc in docs:
+        for field, value in _contribution(entity, doc).items():
+            inc[field] = inc.get(field, 0) + value
+    await _apply_increments(entity, inc)
+
+
+async def record_update(entity: str, before: dict, update):
+    """Counters for an update already applied to `before`"""
+    if before:
+        await apply_counter_change(entity, before, _after_update(before, update))
+
+
+async def tracked_update(entity: str, filter: dict, update, **kwargs):
+    """
+    update_one() that keeps the counters in step.
+    Returns the document before the update, or None if nothing matched.
+    """
+    coll = get_db().get_collection(entity)
+    before = await coll.find_one_and_update(filter, update, return_document=ReturnDocument.BEFORE, **kwargs)
+    await record_update(entity, before, update)
+    return before
+
+
+async def tracked_delete(entity: str, filter: dict):
+    """delete_one() that keeps the counters in step; returns the deleted document"""
+    before = await get_db().get_collection(entity).find_one_and_delete(filter)
+    if before:
+        await apply_counter_change(entity, before, None)
+    return before
+
+
+# ============ RECONCILE ============
+
+def _reconcile_pipeline(entity: str) -> list:
+    spec = COUNTED[entity]
+    facets = {
+        'byStatus': [{'$group': {'_id': f"${spec['field']}", 'count': {'$sum': 1}}}],
+    }
+    if spec['sums']:
+        facets['sums'] = [{'$group': {
+            '_id': None,
+            **{field: {'$sum': f"${field}"} for field in spec['sums']},
+        }}]
+    if spec['group']:
+        facets['groups'] = [
+            {'$match': {spec['group']: {'$nin': [None, '']}}},
+            {'$group': {'_id': f"${spec['group']}", 'count': {'$sum': 1}}},
+        ]
+    return [{'$facet': facets}]
+
+
+async def _compute_counters(entity: str) -> dict:
+    coll = get_db().get_collection(entity)
+    result = (await coll.aggregate(_reconcile_pipeline(entity)).to_list(1))[0]
+    counts = {}
+    for row in result.get('byStatus', []):
+        counts[_key(row['_id'])] = counts.get(_key(row['_id']), 0) + row['count']
+    sums_row = (result.get('sums') or [{}])[0]
+    groups = {}
+    for row in result.get('groups', []):
+        groups[_key(row['_id'])] = groups.get(_key(row['_id']), 0) + row['count']
+    return {
+        'total': sum(counts.values()),
+        'counts': counts,
+        'sums': {field: sums_row.get(field, 0) for field in COUNTED[entity]['sums']},
+        'groups': groups,
+    }
+
+
+def _drift(stored: dict, fresh: dict) -> dict:
+    """Counters that were wrong, as {name: stored - actual}"""
+    drift = {}
+    if (stored.get('total') or 0) != fresh['total']:
+        drift['total'] = (stored.get('total') or 0) - fresh['total']
+    for group in ('counts', 'sums', 'groups'):
+        old = stored.get(group) or {}
+        new = fresh[group]
+        for key in set(old) | set(new):
+            if (old.get(key) or 0) != (new.get(key) or 0):
+                drift[f"{group}.{key}"] = (old.get(key) or 0) - (new.get(key) or 0)
+    return drift
+
+
+async def reconcile_counters(entity: str = None) -> dict:
+    """
+    Recompute counters from the collections and overwrite the stored ones.
+    Returns the drift that was corrected per entity.
+    """
+    coll = get_db().get_collection(COUNTERS_COLLECTION)
+    entities = [entity] if entity else list(COUNTED)
+    report = {}
+    for name in entities:
+        fresh = await _compute_counters(name)
+        now = datetime.utcnow()
+        stored = await coll.find_one_and_update(
+            {'_id': name},
+            {'$set': {**fresh, 'updatedAt': now, 'reconciledAt': now}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        drift = _drift(stored or {}, fresh) if stored else {}
+        report[name] = drift
+    return report
+
+
+# ============ READERS ============
+
+async def get_counters(entity: str) -> dict:
+    """Counters document for one entity, computed on first use"""
+    doc = await get_db().get_collection(COUNTERS_COLLECTION).find_one({'_id': entity})
+    if doc is None:
+        await reconcile_counters(entity)
+        doc = await get_db().get_collection(COUNTERS_COLLECTION).find_one({'_id': entity})
+    doc = doc or {}
+    return {
+        'total': doc.get('total') or 0,
+        'counts': {k: v for k, v in (doc.get('counts') or {}).items() if v},
+        'sums': doc.get('sums') or {},
+        'groups': {k: v for k, v in (doc.get('groups') or {}).items() if v},
+        'reconciledAt': doc.get('reconciledAt'),
+    }
+
+
+async def get_all_counters() -> dict:
+    results = await asyncio.gather(*(get_counters(entity) for entity in COUNTED))
+    return dict(zip(COUNTED, results))
@@ -0,0 +1,191 @@
+"""
+Durable Timers Module
+Persistent one-shot timers for delayed state transitions (walk-in table
+release, end of table cleaning, ...).
+
+Timers live in the `timers` collection with their `dueAt` time, so they
+survive restarts and redeploys. The scheduler polls for due timers every
+TIMER_POLL_SECONDS and fires them in batches. A worker claims a batch by
+writing its lease token on the timers; a timer whose lease has expired
+(worker crashed mid-run) becomes claimable again, so handlers must be
+idempotent.
+
+There is one pending timer per (kind, key): scheduling again replaces it.
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from .db import get_db
+from .indexes import declare_index
+
+TIMERS_COLLECTION = 'timers'
+
+POLL_SECONDS = float(os.getenv('TIMER_POLL_SECONDS', '5'))
+BATCH_SIZE = int(os.getenv('TIMER_BATCH_SIZE', '100'))
+LEASE_SECONDS = int(os.getenv('TIMER_LEASE_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.getenv('TIMER_MAX_ATTEMPTS', '5'))
+RETRY_SECONDS = int(os.getenv('TIMER_RETRY_SECONDS', '30'))
+# Fired timers are kept for a day for troubleshooting
+RETENTION_SECONDS = int(os.getenv('TIMER_RETENTION_SECONDS', str(24 * 3600)))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+declare_index(TIMERS_COLLECTION, [("status", 1), ("dueAt", 1)])
+declare_index(TIMERS_COLLECTION, [("leaseToken", 1)])
+declare_index(TIMERS_COLLECTION, [("completedAt", 1)], expireAfterSeconds=RETENTION_SECONDS)
+
+# kind -> async handler(key: str, payload: dict)
+_handlers = {}
+
+
+def register_timer_handler(kind: str, handler):
+    """Register the coroutine function that runs when a timer of `kind` is due"""
+    _handlers[kind] = handler
+
+
+def timer_id(kind: str, key: str) -> str:
+    return f"{kind}:{key}"
+
+
+async def schedule_timer(kind: str, key: str, due_at: datetime, payload: dict = None):
+    """
+    Schedule (or reschedule) the timer for (kind, key).
+
+    Args:
+        kind: Registered handler name, e.g. 'walk_in_release'
+        key: What the timer is about, usually a document id
+        due_at: Naive UTC datetime when the handler should run
+        payload: Extra arguments passed to the handler
+    """
+    db = get_db()
+    now = datetime.utcnow()
+    await db.get_collection(TIMERS_COLLECTION).replace_one(
+        {'_id': timer_id(kind, key)},
+        {
+            'kind': kind,
+            'key': key,
+            'payload': payload or {},
+            'dueAt': due_at,
+            'status': 'pending',
+            'attempts': 0,
+            'leaseToken': None,
+            'leaseOwner': None,
+            'leaseUntil': None,
+            'lastError': None,
+            'createdAt': now,
+        },
+        upsert=True
+    )
+
+
+async def cancel_timer(kind: str, key: str) -> bool:
+    """Cancel a pending timer; returns False if there was none"""
+    db = get_db()
+    result = await db.get_collection(TIMERS_COLLECTION).delete_one(
+        {'_id': timer_id(kind, key), 'status': 'pending'}
+    )
+    return result.deleted_count > 0
+
+
+def _claimable(now: datetime) -> dict:
+    return {'$or': [
+        {'status': 'pending', 'dueAt': {'$lte': now}},
+        {'status': 'running', 'leaseUntil': {'$lt': now}},
+    ]}
+
+
+async def _claim_batch(coll, batch_size: int) -> list:
+    """Lease up to `batch_size` due timers to this worker"""
+    now = datetime.utcnow()
+    candidates = await coll.find(_claimable(now), {'_id': 1}).sort('dueAt', 1).limit(batch_size).to_list(batch_size)
+    if not candidates:
+        return []
+
+    token = uuid.uuid4().hex
+    # Re-check the claim condition so only one worker wins each timer
+    await coll.update_many(
+        {'_id': {'$in': [c['_id'] for c in candidates]}, **_claimable(now)},
+        {
+            '$set': {
+                'status': 'running',
+                'leaseToken': token,
+                'leaseOwner': WORKER_ID,
+                'leaseUntil': now + timedelta(seconds=LEASE_SECONDS),
+            },
+            '$inc': {'attempts': 1},
+        }
+    )
+    return await coll.find({'leaseToken': token}).to_list(batch_size)
+
+
+async def _fire(coll, timer: dict):
+    lease = {'_id': timer['_id'], 'leaseToken': timer['leaseToken']}
+    handler = _handlers.get(timer['kind'])
+    try:
+        if handler is None:
+            raise RuntimeError(f"No handler registered for timer kind '{timer['kind']}'")
+        await handler(timer['key'], timer.get('payload') or {})
+    except Exception as e:
+        print(f"[Timers] {timer['_id']} failed (attempt {timer.get('attempts', 1)}): {e}")
+        failed = timer.get('attempts', 1) >= MAX_ATTEMPTS
+        await coll.update_one(lease, {'$set': {
+            'status': 'failed' if failed else 'pending',
+            'dueAt': datetime.utcnow() + timedelta(seconds=RETRY_SECONDS),
+            'leaseToken': None,
+            'leaseUntil': None,
+            'lastError': str(e),
+        }})
+        return False
+
+    # Only mark done if the timer still belongs to this run (not rescheduled meanwhile)
+    await coll.update_one(lease, {'$set': {
+        'status': 'done',
+        'leaseToken': None,
+        'leaseUntil': None,
+        'completedAt': datetime.utcnow(),
+    }})
+    return True
+
+
+async def fire_due_timers(batch_size: int = None) -> dict:
+    """Claim and run every due timer, one batch at a time"""
+    db = get_db()
+    coll = db.get_collection(TIMERS_COLLECTION)
+    fired = 0
+    failed = 0
+    while True:
+        batch = await _claim_batch(coll, batch_size or BATCH_SIZE)
+        if not batch:
+            break
+        results = await asyncio.gather(*(_fire(coll, timer) for timer in batch))
+        fired += sum(1 for ok in results if ok)
+        failed += sum(1 for ok in results if not ok)
+        if len(batch) < (batch_size or BATCH_SIZE):
+            break
+    if fired or failed:
+        print(f"[Timers] Fired {fired} timer(s), {failed} failed")
+    return {'fired': fired, 'failed': failed}
+
+
+async def get_timer_stats() -> dict:
+    db = get_db()
+    coll = db.get_collection(TIMERS_COLLECTION)
+    counts = {}
+    async for row in coll.aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+        counts[row['_id']] = row['count']
+    next_due = await coll.find_one({'status': 'pending'}, {'dueAt': 1, 'kind': 1, 'key': 1}, sort=[('dueAt', 1)])
+    overdue = await coll.count_documents({'status': 'pending', 'dueAt': {'$lte': datetime.utcnow()}})
+    return {
+        'byStatus': counts,
+        'overdue': overdue,
+        'nextDue': {
+            'id': next_due['_id'],
+            'kind': next_due.get('kind'),
+            'dueAt': next_due['dueAt'].isoformat() + 'Z',
+        } if next_due else None,
+        'handlers': sorted(_handlers.keys()),
+        'worker': WORKER_ID,
+    }
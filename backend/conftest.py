@@ -0,0 +1 @@
+# Lets tests under backend/tests import the `app` package
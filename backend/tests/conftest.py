@@ -0,0 +1,30 @@
+import os
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+
+@pytest.fixture
+def mongo_uri():
+    """MONGODB_URI (default localhost) if a mongod answers, else skip the test"""
+    uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"no mongod reachable: {e}")
+    finally:
+        client.close()
+    return uri
+
+
+@pytest.fixture
+def scratch_db_name(mongo_uri):
+    """Name of a throwaway database, dropped after the test"""
+    name = f"rms_test_{uuid.uuid4().hex[:8]}"
+    yield name
+    client = MongoClient(mongo_uri)
+    client.drop_database(name)
+    client.close()
@@ -0,0 +1,40 @@
+"""
+Audit Daily Stats
+Entries written by the buffered audit writer must be counted in the daily
+stats buckets, like entries written inline or from the outbox. Needs a
+reachable mongod (MONGODB_URI, default localhost); skipped otherwise.
+"""
+
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app import audit
+from app import db as db_module
+from app.audit_storage import get_audit_summary
+
+
+def test_buffered_flush_updates_daily_stats(mongo_uri, scratch_db_name, monkeypatch):
+    # Only the explicit flush below writes: no timed or batch-size wakeups
+    monkeypatch.setattr(audit, "WRITE_MODE", "buffered")
+    monkeypatch.setattr(audit, "FLUSH_SECONDS", 3600)
+    monkeypatch.setattr(audit, "BATCH_SIZE", 1000)
+
+    async def run():
+        client = AsyncIOMotorClient(mongo_uri)
+        monkeypatch.setattr(db_module, "db", client[scratch_db_name])
+        audit.start_audit_writer()
+        try:
+            await audit.log_audit("create", "order", "o1")
+            await audit.log_audit("create", "order", "o2")
+            await audit.log_audit("delete", "table", "t1")
+            assert await audit.flush_audit() == 3
+            return await get_audit_summary()
+        finally:
+            await audit.stop_audit_writer()
+            client.close()
+
+    summary = asyncio.run(run())
+    assert summary["today"] == 3
+    assert summary["byAction"] == {"create": 2, "delete": 1}
+    assert summary["byResource"] == {"order": 2, "table": 1}
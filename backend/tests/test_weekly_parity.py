@@ -0,0 +1,130 @@
+"""
+Weekly Analytics Parity
+Checks both weekly pipelines (app/pipelines.py) against a reference
+computed in Python with the app.rollups helpers: weekly_orders_pipeline on
+orders seeded into a scratch database, weekly_rollups_pipeline on the
+buckets a rollup rebuild makes of the same orders. Needs a reachable mongod (MONGODB_URI, default
+localhost); skipped otherwise.
+
+Usage:
+    cd backend
+    python -m pytest tests
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import MongoClient
+
+from app.pipelines import (
+    weekly_orders_pipeline, weekly_rollups_pipeline, shape_weekly_result, TOP_ITEMS_LIMIT,
+)
+from app.rollups import (
+    extract_items, get_order_datetime, get_order_total, _accumulate, ROLLUPS_COLLECTION,
+)
+
+
+@pytest.fixture
+def orders_db(mongo_uri, scratch_db_name):
+    client = MongoClient(mongo_uri)
+    yield client[scratch_db_name]
+    client.close()
+
+
+def _week_window():
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=6), today
+
+
+def reference_weekly(orders: list, week_start: datetime, today: datetime) -> dict:
+    """The weekly result computed order by order in Python"""
+    prev_week_start = week_start - timedelta(days=7)
+    end = today + timedelta(days=1)
+
+    daily_rows = {}
+    item_rows = {}
+    for order in orders:
+        order_dt = get_order_datetime(order)
+        if not order_dt or not (prev_week_start <= order_dt < end):
+            continue
+        in_current_week = order_dt >= week_start
+        if in_current_week:
+            key = order_dt.strftime("%Y-%m-%d")
+            row = daily_rows.setdefault(key, {"date": key, "orders": 0, "revenue": 0.0})
+            row["orders"] += 1
+            row["revenue"] += get_order_total(order)
+        for item in extract_items(order):
+            row = item_rows.setdefault(str(item["name"]), {"_id": str(item["name"]), "count": 0, "revenue": 0.0, "prevCount": 0})
+            if in_current_week:
+                row["count"] += item["quantity"]
+                row["revenue"] += item["price"] * item["quantity"]
+            else:
+                row["prevCount"] += item["quantity"]
+
+    top_items = sorted(
+        (row for row in item_rows.values() if row["count"] > 0),
+        key=lambda row: (-row["count"], row["_id"])
+    )[:TOP_ITEMS_LIMIT]
+    return shape_weekly_result(week_start, today, {"daily": list(daily_rows.values()), "topItems": top_items})
+
+
+def pipeline_weekly(collection, pipeline, week_start: datetime, today: datetime) -> dict:
+    facet = list(collection.aggregate(pipeline(week_start, today)))
+    return shape_weekly_result(week_start, today, facet[0] if facet else {})
+
+
+def _check(db, orders: list):
+    db.orders.insert_many([dict(order) for order in orders])
+    # The buckets rebuild_rollups() would write for these orders
+    buckets = {}
+    for order in orders:
+        _accumulate(buckets, order)
+    if buckets:
+        db[ROLLUPS_COLLECTION].insert_many(list(buckets.values()))
+
+    week_start, today = _week_window()
+    reference = reference_weekly(orders, week_start, today)
+    assert pipeline_weekly(db.orders, weekly_orders_pipeline, week_start, today) == reference
+    assert pipeline_weekly(db[ROLLUPS_COLLECTION], weekly_rollups_pipeline, week_start, today) == reference
+
+
+def test_pipeline_matches_reference(orders_db):
+    week_start, today = _week_window()
+    noon = today + timedelta(hours=12)
+    _check(orders_db, [
+        # createdAt as a date, as an ISO string and as an ISO string with Z
+        {"createdAt": noon, "total": 300, "items": [{"name": "Biryani", "quantity": 2, "price": 150}]},
+        {"createdAt": (noon - timedelta(days=1)).isoformat(), "total": "1,200",
+         "items": [{"name": "Biryani", "quantity": "3", "price": "200"}, {"name": "Tea", "quantity": 2, "price": 20}]},
+        {"createdAt": (noon - timedelta(days=2)).isoformat() + "Z",
+         "items": [{"name": "Tea", "price": 20}, {"name": "Dosa", "quantity": 1.7, "price": 80}]},
+        # Offsets move the order to another UTC day (and one into the window)
+        {"createdAt": (today - timedelta(days=3)).strftime("%Y-%m-%dT01:30:00+05:30"), "total": 70,
+         "items": [{"name": "Dosa", "quantity": 1, "price": 70}]},
+        {"createdAt": (week_start - timedelta(days=7)).strftime("%Y-%m-%dT23:00:00-02:00"), "total": 20,
+         "items": [{"name": "Dosa", "quantity": 1, "price": 20}]},
+        # Previous week only counts towards prevCount
+        {"createdAt": noon - timedelta(days=9), "total": 40, "items": [{"name": "Tea", "quantity": 2, "price": 20}]},
+        # Outside both weeks, no date, non-object items
+        {"createdAt": noon - timedelta(days=30), "total": 999, "items": [{"name": "Tea", "quantity": 9, "price": 20}]},
+        {"total": 50, "items": [{"name": "Tea", "quantity": 1, "price": 50}]},
+        {"createdAt": noon, "total": 10, "items": ["Tea", None]},
+    ])
+
+
+def test_string_zero_quantity(orders_db):
+    _, today = _week_window()
+    _check(orders_db, [
+        {"createdAt": today + timedelta(hours=12), "total": 0,
+         "items": [{"name": "Tea", "quantity": "0", "price": 20}, {"name": "Dosa", "quantity": 1, "price": 80},
+                   {"name": "Dosa", "quantity": 0, "price": 80}, {"name": "Tea", "quantity": "", "price": 20}]},
+    ])
+
+
+def test_snake_case_created_at(orders_db):
+    _, today = _week_window()
+    _check(orders_db, [
+        {"created_at": today + timedelta(hours=12), "total": 80, "items": [{"name": "Dosa", "quantity": 1, "price": 80}]},
+        {"created_at": (today - timedelta(days=1)).isoformat() + "Z", "total": 30,
+         "items": [{"name": "Tea", "quantity": 1, "price": 30}]},
+    ])
@@ -50,6 +50,30 @@ async function fetchApi<T>(
   }
 }
 
+// Download a streamed CSV export; the filename comes from Content-Disposition
+async function fetchCsvExport(
+  endpoint: string,
+  fallbackFilename: string
+): Promise<{ csv: string; filename: string }> {
+  const url = `${API_BASE_URL}${endpoint}`;
+
+  try {
+    const response = await fetch(url, { headers: getHeaders() });
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+    }
+
+    const disposition = response.headers.get('Content-Disposition') || '';
+    const match = disposition.match(/filename="?([^";]+)"?/);
+    return { csv: await response.text(), filename: match ? match[1] : fallbackFilename };
+  } catch (error) {
+    console.error(`API Error [${endpoint}]:`, error);
+    throw error;
+  }
+}
+
 
 // ============ AUTH API ============
 export const authApi = {
@@ -137,7 +161,7 @@ export const staffApi = {
     if (params?.role) query.append('role', params.role);
     if (params?.active !== undefined) query.append('active', String(params.active));
     if (params?.shift) query.append('shift', params.shift);
-    return fetchApi<{ csv: string; filename: string }>(`/staff/export/csv?${query.toString()}`);
+    return fetchCsvExport(`/staff/export/csv?${query.toString()}`, 'staff_export.csv');
   },
 
   // Export attendance as CSV
@@ -147,7 +171,7 @@ export const staffApi = {
     if (params?.date_from) query.append('date_from', params.date_from);
     if (params?.date_to) query.append('date_to', params.date_to);
     if (params?.status) query.append('status', params.status);
-    return fetchApi<{ csv: string; filename: string }>(`/staff/attendance/export/csv?${query.toString()}`);
+    return fetchCsvExport(`/staff/attendance/export/csv?${query.toString()}`, 'attendance_export.csv');
   },
 
   // Export shifts as CSV
@@ -156,7 +180,7 @@ export const staffApi = {
     if (params?.staffId) query.append('staffId', params.staffId);
     if (params?.date_from) query.append('date_from', params.date_from);
     if (params?.date_to) query.append('date_to', params.date_to);
-    return fetchApi<{ csv: string; filename: string }>(`/staff/shifts/export/csv?${query.toString()}`);
+    return fetchCsvExport(`/staff/shifts/export/csv?${query.toString()}`, 'shifts_export.csv');
   },
 
   // Export payroll as CSV
@@ -164,7 +188,7 @@ export const staffApi = {
     const query = new URLSearchParams();
     if (params?.date_from) query.append('date_from', params.date_from);
     if (params?.date_to) query.append('date_to', params.date_to);
-    return fetchApi<{ csv: string; filename: string }>(`/staff/payroll/export/csv?${query.toString()}`);
+    return fetchCsvExport(`/staff/payroll/export/csv?${query.toString()}`, 'payroll_export.csv');
   },
 };
 